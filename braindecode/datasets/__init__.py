@@ -4,3 +4,4 @@ Loader code for some datasets.
 from .base import WindowsDataset, BaseDataset, BaseConcatDataset
 from .moabb import MOABBDataset
 from .tuh import TUHAbnormal
+from .streaming import StreamingWindowsDataset, ShardedWindowsDataset
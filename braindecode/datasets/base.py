@@ -10,10 +10,14 @@ Dataset classes.
 #
 # License: BSD (3-clause)
 
+import copy
+import os
+
+import mne
 import numpy as np
 import pandas as pd
 
-from torch.utils.data import Dataset, ConcatDataset
+from torch.utils.data import Dataset, ConcatDataset, Subset
 
 
 class BaseDataset(Dataset):
@@ -30,6 +34,9 @@ class BaseDataset(Dataset):
         name of the index in `description` that should be use to provide the
         target (e.g., to be used in a prediction task later on).
     """
+    # name of the attribute holding the mne object with the signals
+    _signal_attr = 'raw'
+
     def __init__(self, raw, description=None, target_name=None):
         self.raw = raw
         if description is not None:
@@ -56,6 +63,50 @@ class BaseDataset(Dataset):
     def __len__(self):
         return len(self.raw)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # only valid for the signals of this process
+        state.pop('_file_check', None)
+        if self._signal_attr not in state:
+            # signals were not reopened since unpickling
+            return state
+        if state.get('_shared_data') is not None:
+            # signals are in shared memory, pickle the mne object without them
+            mne_obj = copy.copy(state[self._signal_attr])
+            mne_obj._data = None
+            state[self._signal_attr] = mne_obj
+            return state
+        # the file header is only read again if the signals changed since the
+        # last check
+        reopen_state, self._file_check = _get_reopen_state(
+            state[self._signal_attr], self.__dict__.get('_file_check'))
+        if reopen_state is not None:
+            # signals are read lazily from a file, only pickle what is needed
+            # to reopen the file
+            del state[self._signal_attr]
+            state['_reopen_state'] = reopen_state
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if state.get('_shared_data') is not None:
+            # copy-on-write, changes stay local to this process
+            getattr(self, self._signal_attr)._data = (
+                self._shared_data.open(mode='c'))
+
+    def __getattr__(self, name):
+        # only called if the attribute is missing, i.e., for the signals after
+        # unpickling a dataset with lazily loaded signals, they are reopened
+        # on first access
+        if (name == self._signal_attr and
+                self.__dict__.get('_reopen_state') is not None):
+            mne_obj, self._file_check = _reopen(
+                self.__dict__.pop('_reopen_state'))
+            setattr(self, name, mne_obj)
+            return mne_obj
+        raise AttributeError(
+            f"'{type(self).__name__}' object has no attribute '{name}'")
+
 
 class WindowsDataset(BaseDataset):
     """Applies a windower to a base dataset.
@@ -67,7 +118,28 @@ class WindowsDataset(BaseDataset):
         BaseDataset
     description: dict | pandas.Series | None
         holds additional info about the windows
+
+    Attributes
+    ----------
+    window_table: np.ndarray
+        structured array with fields 'i_window_in_trial', 'i_start_in_trial',
+        'i_stop_in_trial' and 'i_trial' (index of the trial in the recording)
+        of every window, all int32 if their values allow it, else int64
+    crop_inds: np.ndarray
+        view of the first three fields of `window_table` as n_windows x 3
+        array
+    y: np.ndarray
+        targets of the windows, integers stored as int32 if their values
+        allow it and floats as float32
+
+    Notes
+    -----
+    The metadata of the windows is replaced by a DataFrame whose window
+    table columns and targets share their memory with `window_table` and
+    `y`.
     """
+    _signal_attr = 'windows'
+
     def __init__(self, windows, description=None):
         self.windows = windows
         if description is not None:
@@ -78,21 +150,302 @@ class WindowsDataset(BaseDataset):
             if isinstance(description, dict):
                 description = pd.Series(description)
         self.description = description
-        self.y = np.array(self.windows.metadata.loc[:,'target'])
-        self.crop_inds = np.array(self.windows.metadata.loc[:,
-                              ['i_window_in_trial', 'i_start_in_trial',
-                               'i_stop_in_trial']])
+        metadata = self.windows.metadata
+        columns = {name: metadata[name].to_numpy()
+                   for name in _WINDOW_TABLE_FIELDS if name in metadata}
+        if 'i_trial' not in columns:
+            # windows created without trial indices, a new trial starts when
+            # the index of the window in the trial does not increment by 1
+            columns['i_trial'] = np.cumsum(np.diff(
+                columns['i_window_in_trial'], prepend=[np.inf]) != 1) - 1
+        dtype = _get_compact_int_dtype(np.concatenate(list(columns.values())))
+        self.window_table = np.empty(
+            len(metadata),
+            dtype=[(name, dtype) for name in _WINDOW_TABLE_FIELDS])
+        for name, values in columns.items():
+            self.window_table[name] = values
+        self.y = _compact_targets(metadata['target'].to_numpy())
+        self._slim_metadata()
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if self._signal_attr in self.__dict__:
+            # unpickled metadata is a copy of the window table and targets
+            self._slim_metadata()
+
+    def __getattr__(self, name):
+        mne_obj = super().__getattr__(name)
+        # signals were reopened with a copy of the window table and targets
+        self._slim_metadata()
+        return mne_obj
+
+    def _slim_metadata(self):
+        """Replace the metadata of the windows by a DataFrame sharing its
+        window table columns and targets with `window_table` and `y`."""
+        # all fields have the same dtype, so the table can be viewed as a 2d
+        # array without copying
+        table = self.window_table.view(self.window_table.dtype[0]).reshape(
+            len(self.window_table), len(_WINDOW_TABLE_FIELDS))
+        self.crop_inds = table[:, :3]
+        old_metadata = self.windows.metadata
+        metadata = pd.DataFrame(table, columns=_WINDOW_TABLE_FIELDS,
+                                copy=False)
+        metadata['target'] = self.y
+        for name in old_metadata.columns:
+            if name not in metadata:
+                metadata[name] = old_metadata[name].to_numpy()
+        self.windows.metadata = metadata
+        # view on the target column of the metadata
+        self.y = self.windows.metadata['target'].to_numpy()
 
     def __getitem__(self, index):
         X = self.windows.get_data(item=index)[0].astype('float32')
         y = self.y[index]
+        if np.issubdtype(self.y.dtype, np.integer):
+            # torch losses expect int64 class indices
+            y = np.int64(y)
         # necessary to cast as list to get list of
         # three tensors from batch, otherwise get single 2d-tensor...
-        crop_inds = list(self.crop_inds[index])
+        crop_inds = self.crop_inds[index].tolist()
         return X, y, crop_inds
 
     def __len__(self):
-        return len(self.windows.events)
+        return len(self.window_table)
+
+    def memory_usage(self):
+        """Memory used by the window metadata of this dataset.
+
+        Returns
+        -------
+        n_bytes: int
+            number of bytes of the window table, the targets and all other
+            columns and the index of the metadata of the windows
+        """
+        n_bytes = self.window_table.nbytes + self.y.nbytes
+        metadata = self.windows.metadata
+        usage = metadata.memory_usage(index=True, deep=True)
+        for name in metadata.columns:
+            values = metadata[name].to_numpy()
+            if not (np.shares_memory(values, self.window_table) or
+                    np.shares_memory(values, self.y)):
+                n_bytes += usage[name]
+        return int(n_bytes + usage['Index'])
+
+
+_WINDOW_TABLE_FIELDS = [
+    'i_window_in_trial', 'i_start_in_trial', 'i_stop_in_trial', 'i_trial']
+
+
+def _get_compact_int_dtype(values):
+    """Get int32 if all values fit into it, else int64."""
+    int32_info = np.iinfo(np.int32)
+    if len(values) == 0 or (
+            values.min() >= int32_info.min and values.max() <= int32_info.max):
+        return np.dtype(np.int32)
+    return np.dtype(np.int64)
+
+
+# channel info fields that are replayed by setting the channel types
+_CH_TYPE_FIELDS = ('kind', 'unit', 'coil_type')
+
+
+def _open_raw(raw_cls, init_kwargs):
+    return raw_cls(**dict(init_kwargs, preload=False, verbose='error'))
+
+
+def _info_values_equal(value, other):
+    """Compare nested info values, much faster than mne.utils.object_diff."""
+    if value is other:
+        return True
+    if type(value) is not type(other):
+        return False
+    if isinstance(value, dict):
+        return value.keys() == other.keys() and all(
+            _info_values_equal(value[k], other[k]) for k in value)
+    if isinstance(value, (list, tuple)):
+        return len(value) == len(other) and all(
+            map(_info_values_equal, value, other))
+    if isinstance(value, np.ndarray):
+        return value.shape == other.shape and np.array_equal(
+            value, other, equal_nan=value.dtype.kind == 'f')
+    return bool(value == other)
+
+
+def _get_retyped_channels(info, file_info, read_picks):
+    """Get the indices of the channels of a lazily loaded raw whose types
+    differ from the header of its file, or None if its info differs from the
+    header by more than what is replayed on reopening: picked, renamed and
+    retyped channels, and bad channels.
+    """
+    for key in info:
+        if key not in ('chs', 'ch_names', 'nchan', 'bads') and (
+                not _info_values_equal(info[key], file_info[key])):
+            return None
+    retyped = []
+    for i_ch, (ch, i_file_ch) in enumerate(zip(info['chs'], read_picks)):
+        file_ch = file_info['chs'][i_file_ch]
+        ignored = ('ch_name',)
+        if ch['kind'] != file_ch['kind']:
+            ignored += _CH_TYPE_FIELDS
+            retyped.append(i_ch)
+        if not _info_values_equal(
+                {k: v for k, v in ch.items() if k not in ignored},
+                {k: v for k, v in file_ch.items() if k not in ignored}):
+            return None
+    return retyped
+
+
+def _create_file_check(raw, retyped):
+    """Store the result of checking the info of a raw against the header of
+    its file, together with what it depends on."""
+    return dict(
+        raw_cls=type(raw), init_kwargs=copy.deepcopy(raw._init_kwargs),
+        filename=raw.filenames[0], read_picks=raw._read_picks[0].copy(),
+        info=raw.info.copy(), retyped=retyped)
+
+
+def _check_file(raw, file_check=None):
+    """Check the info of a lazily loaded raw against the header of its file,
+    see `_get_retyped_channels`. The header is only read if the raw does not
+    match `file_check`, the result of an earlier check.
+    """
+    if file_check is not None and (
+            type(raw) is file_check['raw_cls']
+            and raw.filenames[0] == file_check['filename']
+            and _info_values_equal(raw._init_kwargs, file_check['init_kwargs'])
+            and _info_values_equal(
+                raw._read_picks[0], file_check['read_picks'])
+            and _info_values_equal(raw.info, file_check['info'])):
+        return file_check
+    file_raw = _open_raw(type(raw), raw._init_kwargs)
+    retyped = _get_retyped_channels(
+        raw.info, file_raw.info, raw._read_picks[0])
+    return _create_file_check(raw, retyped)
+
+
+def _get_raw_reopen_state(raw, file_check=None):
+    """Get what is needed to reopen a lazily loaded mne.io.Raw from its file,
+    or None if the raw is preloaded, not stored in a single file, or its info
+    was changed in a way that cannot be replayed on reopening. Also returns
+    the check of the raw against its file header, to be passed again on the
+    next call.
+    """
+    if (raw.preload or len(raw.filenames) != 1 or raw.filenames[0] is None
+            or not os.path.exists(raw.filenames[0])
+            or getattr(raw, '_init_kwargs', None) is None
+            or len(raw._read_picks) != 1):
+        return None, None
+    file_check = _check_file(raw, file_check)
+    retyped = file_check['retyped']
+    if retyped is None:
+        return None, file_check
+    reopen_state = dict(
+        raw_cls=type(raw), init_kwargs=raw._init_kwargs,
+        read_picks=raw._read_picks[0], ch_names=raw.ch_names,
+        ch_types={raw.ch_names[i]: mne.channel_type(raw.info, i)
+                  for i in retyped},
+        bads=raw.info['bads'], first_samp=raw.first_samp,
+        last_samp=raw.last_samp, annotations=raw.annotations)
+    return reopen_state, file_check
+
+
+def _reopen_raw(state):
+    """Reopen a raw from the state of `_get_raw_reopen_state`, also returns
+    the check of the reopened raw against its file header."""
+    raw = _open_raw(state['raw_cls'], state['init_kwargs'])
+    # picks are indices into the channels of the file
+    raw.pick(state['read_picks'])
+    if raw.ch_names != state['ch_names']:
+        raw.rename_channels(
+            dict(zip(raw.ch_names, state['ch_names'])), verbose='error')
+    if state['ch_types']:
+        raw.set_channel_types(state['ch_types'], verbose='error')
+    raw.info['bads'] = state['bads']
+    sfreq = raw.info['sfreq']
+    raw.crop(tmin=(state['first_samp'] - raw.first_samp) / sfreq,
+             tmax=(state['last_samp'] - raw.first_samp) / sfreq)
+    annotations = state['annotations']
+    if annotations.orig_time is None:
+        # without measurement date, mne stores onsets relative to the first
+        # sample of the file but expects them relative to the first sample
+        # of the raw when setting them
+        annotations = annotations.copy()
+        annotations.onset -= raw.first_time
+    raw.set_annotations(annotations)
+    retyped = [raw.ch_names.index(name) for name in state['ch_types']]
+    return raw, _create_file_check(raw, retyped)
+
+
+def _get_reopen_state(mne_obj, file_check=None):
+    """Get what is needed to reopen lazily loaded mne.io.Raw or mne.Epochs
+    from file, or None if they cannot be reopened, and the check of their raw
+    against its file header (see `_get_raw_reopen_state`).
+    """
+    if isinstance(mne_obj, mne.io.BaseRaw):
+        return _get_raw_reopen_state(mne_obj, file_check)
+    if type(mne_obj) is not mne.Epochs or mne_obj.preload:
+        return None, None
+    raw_state, file_check = _get_raw_reopen_state(mne_obj._raw, file_check)
+    if raw_state is None:
+        return None, file_check
+    return dict(
+        raw=raw_state, events=mne_obj.events, event_id=mne_obj.event_id,
+        picks=mne_obj.ch_names, tmin=mne_obj.tmin, tmax=mne_obj.tmax,
+        baseline=mne_obj.baseline, reject=mne_obj.reject,
+        flat=mne_obj.flat, reject_tmin=mne_obj.reject_tmin,
+        reject_tmax=mne_obj.reject_tmax, detrend=mne_obj.detrend,
+        decim=mne_obj._decim, metadata=mne_obj.metadata,
+        bad_dropped=mne_obj._bad_dropped), file_check
+
+
+def _reopen(state):
+    if 'raw' not in state:
+        return _reopen_raw(state)
+    raw, file_check = _reopen_raw(state['raw'])
+    epochs = mne.Epochs(
+        raw, state['events'], state['event_id'],
+        tmin=state['tmin'], tmax=state['tmax'], baseline=state['baseline'],
+        picks=state['picks'], reject=state['reject'], flat=state['flat'],
+        reject_tmin=state['reject_tmin'], reject_tmax=state['reject_tmax'],
+        detrend=state['detrend'], decim=state['decim'],
+        metadata=state['metadata'], preload=False, verbose='error')
+    # windows were already checked before pickling
+    epochs._bad_dropped = state['bad_dropped']
+    return epochs, file_check
+
+
+def _compact_targets(targets):
+    """Store targets with a fixed-width dtype: integers as int32 if their
+    values allow it, else int64, and floats as float32. Other targets are
+    kept as they are.
+    """
+    if np.issubdtype(targets.dtype, np.integer):
+        return targets.astype(_get_compact_int_dtype(targets))
+    if np.issubdtype(targets.dtype, np.floating):
+        return targets.astype(np.float32)
+    return targets
+
+
+def _create_description(descriptions):
+    """Create the description DataFrame of a BaseConcatDataset column by
+    column. Creating it row by row from a list of pandas.Series aligns every
+    single Series, which gets slow for many recordings.
+    """
+    if len(descriptions) > 0 and all(
+            [isinstance(d, pd.Series) for d in descriptions]):
+        index = descriptions[0].index
+        if index.is_unique and all(
+                [d.index.equals(index) for d in descriptions]):
+            values = np.empty((len(descriptions), len(index)), dtype=object)
+            for i_desc, description in enumerate(descriptions):
+                values[i_desc] = description.to_numpy(dtype=object)
+            return pd.DataFrame(
+                {name: values[:, i_col].tolist()
+                 for i_col, name in enumerate(index)})
+    # general case, e.g. descriptions with differing entries or None
+    description = pd.DataFrame(descriptions)
+    description.reset_index(inplace=True, drop=True)
+    return description
 
 
 class BaseConcatDataset(ConcatDataset):
@@ -109,8 +462,82 @@ class BaseConcatDataset(ConcatDataset):
         if isinstance(list_of_ds[0], BaseConcatDataset):
             list_of_ds = [d for ds in list_of_ds for d in ds.datasets]
         super().__init__(list_of_ds)
-        self.description = pd.DataFrame([ds.description for ds in list_of_ds])
-        self.description.reset_index(inplace=True, drop=True)
+        self.description = _create_description(
+            [ds.description for ds in list_of_ds])
+        self._window_index = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the window index is a cache that is rebuilt on demand
+        state['_window_index'] = None
+        return state
+
+    @property
+    def window_index(self):
+        """Table of all windows of all WindowsDatasets, built on first access.
+
+        Has one row per window, in the order of the windows in this dataset,
+        with columns 'i_recording' (index of the dataset the window belongs
+        to), 'i_trial' (running trial index over all datasets),
+        'i_window_in_trial', 'i_start_in_trial', 'i_stop_in_trial', 'target'
+        and the columns of the description of the dataset the window belongs
+        to.
+
+        Returns
+        -------
+        window_index: pandas.DataFrame
+        """
+        if self._window_index is None:
+            self._window_index = self._build_window_index()
+        return self._window_index
+
+    def _build_window_index(self):
+        if not all([isinstance(ds, WindowsDataset) for ds in self.datasets]):
+            raise ValueError(
+                'A window index can only be built for WindowsDatasets.')
+        lengths = [len(ds) for ds in self.datasets]
+        i_recordings = np.repeat(np.arange(len(self.datasets)), lengths)
+        crop_inds = np.concatenate([ds.crop_inds for ds in self.datasets])
+        targets = np.concatenate([ds.y for ds in self.datasets])
+        i_window_in_trials = crop_inds[:, 0]
+        i_trials_in_recordings = np.concatenate(
+            [ds.window_table['i_trial'] for ds in self.datasets])
+        # A new trial starts with a new trial of the windower or a new dataset,
+        # also if windows in the middle of a trial were dropped
+        trial_starts = np.diff(i_trials_in_recordings, prepend=[-1]) != 0
+        trial_starts |= np.diff(i_recordings, prepend=[-1]) != 0
+        window_index = pd.DataFrame({
+            'i_recording': i_recordings,
+            'i_trial': np.cumsum(trial_starts) - 1,
+            'i_window_in_trial': i_window_in_trials,
+            'i_start_in_trial': crop_inds[:, 1],
+            'i_stop_in_trial': crop_inds[:, 2],
+            'target': targets,
+        })
+        description = self.description.drop(
+            columns=window_index.columns, errors='ignore')
+        description = description.iloc[i_recordings].reset_index(drop=True)
+        return pd.concat([window_index, description], axis=1)
+
+    def select_windows(self, mask):
+        """Select windows through a boolean mask over the rows of
+        `window_index`, without copying any signal data.
+
+        Parameters
+        ----------
+        mask: array-like of bool
+            one entry per window, e.g. a condition on `window_index`
+
+        Returns
+        -------
+        subset: torch.utils.data.Subset
+            view on the selected windows of this dataset
+        """
+        mask = np.asarray(mask)
+        if mask.dtype != bool or mask.shape != (len(self),):
+            raise ValueError(
+                f'Expected a boolean mask with {len(self)} entries.')
+        return Subset(self, np.flatnonzero(mask))
 
     def split(self, property=None, split_ids=None):
         """Split the dataset based on some property listed in its description
@@ -132,12 +559,25 @@ class BaseConcatDataset(ConcatDataset):
         if split_ids is None:
             if property not in self.description:
                 raise ValueError(f'{property} not found in self.description')
-            split_ids = {k: list(v) for k, v in self.description.groupby(
-                property).groups.items()}
+            split_ids = self.description.groupby(property).indices
         else:
             split_ids = {split_i: split
                          for split_i, split in enumerate(split_ids)}
 
-        return {split_name: BaseConcatDataset(
-            [self.datasets[ds_ind] for ds_ind in ds_inds])
-            for split_name, ds_inds in split_ids.items()}
+        return {split_name: self._subset(ds_inds)
+                for split_name, ds_inds in split_ids.items()}
+
+    def _subset(self, ds_inds):
+        """Create a BaseConcatDataset of some of the datasets, reusing the
+        description and cumulative sizes already computed for this dataset
+        instead of building them again from the individual datasets.
+        """
+        ds_inds = np.asarray(ds_inds, dtype=int)
+        subset = BaseConcatDataset.__new__(BaseConcatDataset)
+        subset.datasets = [self.datasets[ds_ind] for ds_ind in ds_inds]
+        lengths = np.diff(self.cumulative_sizes, prepend=0)[ds_inds]
+        subset.cumulative_sizes = np.cumsum(lengths).tolist()
+        subset.description = self.description.iloc[ds_inds].reset_index(
+            drop=True)
+        subset._window_index = None
+        return subset
@@ -0,0 +1,193 @@
+"""
+Datasets that stream windows of recordings instead of indexing them.
+"""
+
+# License: BSD (3-clause)
+
+import json
+import os
+from glob import glob
+
+import numpy as np
+import pandas as pd
+from sklearn.utils import check_random_state
+from torch.utils.data import IterableDataset, get_worker_info
+
+from .base import BaseConcatDataset, BaseDataset
+from ..datautil.serialization import load_concat_dataset
+
+
+class StreamingWindowsDataset(IterableDataset):
+    """Walk through the recordings one after another, cut them into windows
+    on the fly and mix the windows through a bounded shuffle buffer.
+
+    Each recording is read once per epoch, in one sequential read if the
+    windower preloads the data (default). With several DataLoader workers,
+    the recordings are split between the workers, so each recording is still
+    read only once per epoch. The order of the recordings is shuffled in
+    every epoch. With DataLoader workers, the randomness is derived from the
+    base seed of the DataLoader, so use `torch.manual_seed` or the
+    `generator` argument of the DataLoader for reproducible orders.
+
+    Parameters
+    ----------
+    concat_ds: BaseConcatDataset of BaseDatasets | str
+        recordings to stream, or path to a directory where they were stored
+        with `save_concat_dataset`
+    windower: callable
+        windower to cut each recording, e.g. `create_windows_from_events` or
+        `create_fixed_length_windows`
+    shuffle_buffer_size: int
+        number of windows to keep in the shuffle buffer. If 0 or 1, windows
+        are returned in the order of the recordings.
+    shuffle_recordings: bool
+        whether to shuffle the order of the recordings in every epoch
+    random_state: None | int | np.random.RandomState
+        random state for shuffling, only used without DataLoader workers
+    windower_kwargs:
+        keyword arguments passed to the windower, e.g. window size and stride.
+        As every recording is windowed on its own, pass `mapping` to
+        `create_windows_from_events` to get the same targets for all
+        recordings.
+    """
+    def __init__(self, concat_ds, windower, shuffle_buffer_size=1000,
+                 shuffle_recordings=True, random_state=None,
+                 **windower_kwargs):
+        if isinstance(concat_ds, str):
+            self.path = concat_ds
+            self.concat_ds = None
+            self.description = _read_description(concat_ds)
+        else:
+            if not all([type(ds) is BaseDataset for ds in concat_ds.datasets]):
+                raise ValueError('Only BaseDatasets can be cut into windows.')
+            self.path = None
+            self.concat_ds = concat_ds
+            self.description = concat_ds.description
+        self.windower = windower
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.shuffle_recordings = shuffle_recordings
+        self.rng = check_random_state(random_state)
+        windower_kwargs.setdefault('preload', True)
+        self.windower_kwargs = windower_kwargs
+
+    def __iter__(self):
+        i_recordings, rng = _split_between_workers(
+            len(self.description), self.shuffle_recordings, self.rng)
+        windows = self._iter_windows(i_recordings)
+        if self.shuffle_buffer_size > 1:
+            windows = _shuffle_buffer(windows, self.shuffle_buffer_size, rng)
+        return windows
+
+    def _iter_windows(self, i_recordings):
+        for i_recording in i_recordings:
+            windows_ds = self.windower(
+                self._get_recording(i_recording), **self.windower_kwargs)
+            for i_window in range(len(windows_ds)):
+                yield windows_ds[i_window]
+
+    def _get_recording(self, i_recording):
+        if self.path is None:
+            return BaseConcatDataset([self.concat_ds.datasets[i_recording]])
+        return load_concat_dataset(
+            self.path, preload=False,
+            ids_to_load=[self.description.index[i_recording]])
+
+
+class ShardedWindowsDataset(IterableDataset):
+    """Stream windows from shards written by `save_concat_dataset` with
+    `shard_size`.
+
+    Every shard is read at once, with one large sequential read. The order
+    of the shards and the order of the windows inside each shard are
+    shuffled in every epoch. With several DataLoader workers, the shards are
+    split between the workers, so each shard is read once per epoch. With
+    DataLoader workers, the randomness is derived from the base seed of the
+    DataLoader.
+
+    Parameters
+    ----------
+    path: str
+        directory holding the shards and shards.json
+    shuffle_shards: bool
+        whether to shuffle the order of the shards in every epoch
+    shuffle_within_shard: bool
+        whether to shuffle the windows of each shard
+    random_state: None | int | np.random.RandomState
+        random state for shuffling, only used without DataLoader workers
+
+    Attributes
+    ----------
+    description: pandas.DataFrame
+        description of the stored recordings
+    shards: list of dict
+        file name and number of windows of every shard
+    """
+    def __init__(self, path, shuffle_shards=True, shuffle_within_shard=True,
+                 random_state=None):
+        self.path = path
+        with open(os.path.join(path, 'shards.json')) as f:
+            self.shards = json.load(f)['shards']
+        self.description = pd.read_json(os.path.join(path, 'description.json'))
+        self.shuffle_shards = shuffle_shards
+        self.shuffle_within_shard = shuffle_within_shard
+        self.rng = check_random_state(random_state)
+
+    def __iter__(self):
+        i_shards, rng = _split_between_workers(
+            len(self.shards), self.shuffle_shards, self.rng)
+        for i_shard in i_shards:
+            with np.load(os.path.join(
+                    self.path, self.shards[i_shard]['file_name'])) as shard:
+                X, y, crop_inds = shard['X'], shard['y'], shard['crop_inds']
+            i_windows = np.arange(len(X))
+            if self.shuffle_within_shard:
+                rng.shuffle(i_windows)
+            for i_window in i_windows:
+                # crop indices as list, same as WindowsDataset
+                yield X[i_window], y[i_window], crop_inds[i_window].tolist()
+
+    def __len__(self):
+        return sum([shard['n_windows'] for shard in self.shards])
+
+
+def _split_between_workers(n_items, shuffle, rng):
+    """Get the items (recordings or shards) to read in the current process
+    and the random state to use for shuffling their windows."""
+    i_items = np.arange(n_items)
+    worker_info = get_worker_info()
+    if worker_info is None:
+        if shuffle:
+            rng.shuffle(i_items)
+        return i_items, rng
+    # all workers share the base seed of the epoch, so they agree on the
+    # order of the items and every item is read once
+    base_seed = worker_info.seed - worker_info.id
+    if shuffle:
+        np.random.RandomState(base_seed % 2 ** 32).shuffle(i_items)
+    i_items = i_items[worker_info.id::worker_info.num_workers]
+    return i_items, np.random.RandomState(worker_info.seed % 2 ** 32)
+
+
+def _read_description(path):
+    if not os.path.isfile(os.path.join(path, '0-raw.fif')):
+        raise ValueError(f'Expected stored raws inside {path}.')
+    description = pd.read_json(os.path.join(path, 'description.json'))
+    file_names = glob(os.path.join(path, '*-raw.fif'))
+    ids = sorted([int(os.path.split(f)[-1].split('-')[0])
+                  for f in file_names])
+    return description.iloc[ids]
+
+
+def _shuffle_buffer(items, buffer_size, rng):
+    """Mix items by keeping up to buffer_size of them and returning a random
+    one of them for every new item."""
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        i_item = rng.randint(buffer_size)
+        yield buffer[i_item]
+        buffer[i_item] = item
+    rng.shuffle(buffer)
+    yield from buffer
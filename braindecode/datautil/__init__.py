@@ -7,3 +7,7 @@ from .preprocess import zscore, scale, exponential_moving_demean, exponential_mo
 from .xy import create_from_X_y
 from .mne import create_from_mne_raw, create_from_mne_epochs
 from .serialization import save_concat_dataset, load_concat_dataset
+from .shared_memory import share_memory, SharedArray
+from .samplers import (
+    RecordingBlockSampler, BalancedWindowSampler, StratifiedWindowSampler,
+    DistributedRecordingSampler)
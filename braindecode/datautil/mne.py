@@ -4,7 +4,8 @@ import mne
 
 from ..datasets.base import BaseDataset, BaseConcatDataset, WindowsDataset
 from ..datautil.windowers import (
-    _check_windowing_arguments, create_windows_from_events)
+    _check_windowing_arguments, create_windows_from_events,
+    _mark_bad_windows_dropped)
 
 
 def create_from_mne_raw(
@@ -75,6 +76,9 @@ def create_from_mne_epochs(list_of_epochs, window_size_samples,
                            window_stride_samples, drop_last_window):
     """Create WindowsDatasets from mne.Epochs
 
+    One WindowsDataset is created per mne.Epochs. All trials of an mne.Epochs
+    share the same window positions relative to the trial onset.
+
     Parameters
     ----------
     list_of_epochs: array-like
@@ -100,7 +104,9 @@ def create_from_mne_epochs(list_of_epochs, window_size_samples,
     for epochs in list_of_epochs:
         event_descriptions = epochs.events[:, 2]
         original_trial_starts = epochs.events[:, 0]
-        stop = len(epochs.times) - window_size_samples
+        epochs_data = epochs.get_data()
+        n_trials, n_channels, n_times = epochs_data.shape
+        stop = n_times - window_size_samples
 
         # already includes last incomplete window start
         starts = np.arange(0, stop + 1, window_stride_samples)
@@ -108,29 +114,42 @@ def create_from_mne_epochs(list_of_epochs, window_size_samples,
         if not drop_last_window and starts[-1] < stop:
             # if last window does not end at trial stop, make it stop there
             starts = np.append(starts, stop)
-
-        fake_events = [[start, window_size_samples, -1] for start in
-                       starts]
-
-        for trial_i, trial in enumerate(epochs):
-            metadata = pd.DataFrame({
-                'i_window_in_trial': np.arange(len(fake_events)),
-                'i_start_in_trial': starts + original_trial_starts[trial_i],
-                'i_stop_in_trial': starts + original_trial_starts[
-                    trial_i] + window_size_samples,
-                'target': len(fake_events) * [event_descriptions[trial_i]]
-            })
-            # window size - 1, since tmax is inclusive
-            mne_epochs = mne.Epochs(
-                mne.io.RawArray(trial, epochs.info), fake_events,
-                baseline=None,
-                tmin=0,
-                tmax=(window_size_samples - 1) / epochs.info["sfreq"],
-                metadata=metadata)
-
-            mne_epochs.drop_bad(reject=None, flat=None)
-
-            windows_ds = WindowsDataset(mne_epochs)
-            list_of_windows_ds.append(windows_ds)
+        n_windows_per_trial = len(starts)
+
+        # put all trials of this mne.Epochs one after another into a single
+        # continuous signal, so that windows of all trials can be addressed
+        # with index arithmetic on one mne.io.RawArray
+        data = epochs_data.transpose(1, 0, 2).reshape(n_channels, -1)
+        trial_offsets = np.arange(n_trials) * n_times
+        window_starts = (trial_offsets[:, None] + starts[None, :]).ravel()
+
+        fake_events = np.zeros((len(window_starts), 3), dtype=int)
+        fake_events[:, 0] = window_starts
+        fake_events[:, 1] = window_size_samples
+        fake_events[:, 2] = -1
+        i_start_in_trials = (
+            original_trial_starts[:, None] + starts[None, :]).ravel()
+        metadata = pd.DataFrame({
+            'i_window_in_trial': np.tile(
+                np.arange(n_windows_per_trial), n_trials),
+            'i_start_in_trial': i_start_in_trials,
+            'i_stop_in_trial': i_start_in_trials + window_size_samples,
+            'i_trial': np.repeat(np.arange(n_trials), n_windows_per_trial),
+            'target': np.repeat(event_descriptions, n_windows_per_trial)
+        })
+        # window size - 1, since tmax is inclusive
+        mne_epochs = mne.Epochs(
+            mne.io.RawArray(data, epochs.info), fake_events,
+            baseline=None,
+            tmin=0,
+            tmax=(window_size_samples - 1) / epochs.info["sfreq"],
+            metadata=metadata)
+
+        # all windows lie inside the trials by construction, so there are no
+        # bad windows to drop
+        _mark_bad_windows_dropped(mne_epochs)
+
+        windows_ds = WindowsDataset(mne_epochs)
+        list_of_windows_ds.append(windows_ds)
 
     return BaseConcatDataset(list_of_windows_ds)
@@ -0,0 +1,267 @@
+"""
+Samplers to draw windows from a BaseConcatDataset.
+"""
+
+# License: BSD (3-clause)
+
+import heapq
+
+import numpy as np
+import torch.distributed as dist
+from sklearn.utils import check_random_state
+from torch.utils.data import Sampler
+
+
+class RecordingBlockSampler(Sampler):
+    """Shuffle windows in blocks of recordings.
+
+    The order of the recordings is shuffled and consecutive recordings are
+    grouped into blocks of `n_recordings_per_block`. All windows of one block
+    are drawn (in shuffled order) before the next block is started. With lazy
+    loading, only the files of one block are read at the same time, which
+    keeps reads local, while batches still mix windows of several
+    recordings. Setting `n_recordings_per_block` to the number of recordings
+    results in a full shuffle.
+
+    Parameters
+    ----------
+    concat_ds: BaseConcatDataset
+        dataset to sample windows from
+    n_recordings_per_block: int
+        number of recordings whose windows are shuffled together
+    shuffle_recordings: bool
+        whether to shuffle the order of the recordings before grouping them
+        into blocks
+    shuffle_within_block: bool
+        whether to shuffle the windows within a block. If False, the windows
+        of each recording are drawn in order.
+    random_state: None | int | np.random.RandomState
+        random state for shuffling
+    """
+    def __init__(self, concat_ds, n_recordings_per_block=4,
+                 shuffle_recordings=True, shuffle_within_block=True,
+                 random_state=None):
+        if n_recordings_per_block < 1:
+            raise ValueError('n_recordings_per_block has to be at least 1.')
+        self.n_recordings_per_block = n_recordings_per_block
+        self.shuffle_recordings = shuffle_recordings
+        self.shuffle_within_block = shuffle_within_block
+        self.rng = check_random_state(random_state)
+        self.stops = np.asarray(concat_ds.cumulative_sizes)
+        self.starts = np.concatenate([[0], self.stops[:-1]])
+
+    def __iter__(self):
+        i_recordings = np.arange(len(self.stops))
+        if self.shuffle_recordings:
+            self.rng.shuffle(i_recordings)
+        for i_block_start in range(
+                0, len(i_recordings), self.n_recordings_per_block):
+            block = i_recordings[
+                i_block_start:i_block_start + self.n_recordings_per_block]
+            inds = np.concatenate([
+                np.arange(self.starts[i], self.stops[i]) for i in block])
+            if self.shuffle_within_block:
+                self.rng.shuffle(inds)
+            yield from inds.tolist()
+
+    def __len__(self):
+        return int(self.stops[-1]) if len(self.stops) > 0 else 0
+
+
+class BalancedWindowSampler(Sampler):
+    """Draw windows such that all classes are drawn equally often in
+    expectation.
+
+    Only the targets of the windows are used, the signals are not touched.
+    Windows are drawn with probability inversely proportional to the number
+    of windows of their class.
+
+    Parameters
+    ----------
+    concat_ds: BaseConcatDataset of WindowsDatasets
+        dataset to sample windows from
+    n_samples: int | None
+        number of windows to draw per epoch. If None, the number of windows
+        in the dataset.
+    replacement: bool
+        whether to draw windows with replacement. Without replacement,
+        `n_samples` cannot be larger than the number of windows.
+    random_state: None | int | np.random.RandomState
+        random state for drawing
+    """
+    def __init__(self, concat_ds, n_samples=None, replacement=True,
+                 random_state=None):
+        y = _get_window_targets(concat_ds)
+        _, i_classes, class_counts = np.unique(
+            y, return_inverse=True, return_counts=True)
+        weights = 1 / class_counts[i_classes]
+        self.p = weights / weights.sum()
+        self.n_samples = len(y) if n_samples is None else n_samples
+        if not replacement and self.n_samples > len(y):
+            raise ValueError('Cannot draw more windows than there are '
+                             'without replacement.')
+        self.replacement = replacement
+        self.rng = check_random_state(random_state)
+
+    def __iter__(self):
+        yield from self.rng.choice(
+            len(self.p), size=self.n_samples, replace=self.replacement,
+            p=self.p).tolist()
+
+    def __len__(self):
+        return self.n_samples
+
+
+class StratifiedWindowSampler(Sampler):
+    """Shuffle windows such that every part of the drawn sequence, and
+    therefore every batch, contains the groups in about the same proportions
+    as the whole dataset.
+
+    The groups are either the targets of the windows or given by a column of
+    the description, e.g. the subject. Only the targets and the description
+    are used, the signals are not touched. Within each group the windows are
+    shuffled, then the groups are interleaved evenly.
+
+    Parameters
+    ----------
+    concat_ds: BaseConcatDataset of WindowsDatasets
+        dataset to sample windows from
+    by: str | None
+        column of the description to stratify by. If None, stratify by the
+        targets of the windows.
+    random_state: None | int | np.random.RandomState
+        random state for shuffling
+    """
+    def __init__(self, concat_ds, by=None, random_state=None):
+        if by is None:
+            groups = _get_window_targets(concat_ds)
+        else:
+            if by not in concat_ds.description:
+                raise ValueError(f'{by} not found in description.')
+            n_windows = np.diff(concat_ds.cumulative_sizes, prepend=0)
+            groups = np.repeat(concat_ds.description[by].to_numpy(), n_windows)
+        _, self.i_groups, self.group_sizes = np.unique(
+            groups, return_inverse=True, return_counts=True)
+        self.rng = check_random_state(random_state)
+
+    def __iter__(self):
+        # shuffle all windows, then the rank of every window in its group
+        # determines its relative position, e.g., the 3rd of 10 windows of
+        # a group is placed at about 30% of the sequence
+        inds = self.rng.permutation(len(self.i_groups))
+        i_groups = self.i_groups[inds]
+        order = np.argsort(i_groups, kind='stable')
+        group_starts = np.concatenate([[0], np.cumsum(self.group_sizes)[:-1]])
+        ranks = np.empty(len(inds))
+        ranks[order] = np.arange(len(inds)) - np.repeat(
+            group_starts, self.group_sizes)
+        positions = (ranks + self.rng.uniform(size=len(inds))) / (
+            self.group_sizes[i_groups])
+        yield from inds[np.argsort(positions, kind='stable')].tolist()
+
+    def __len__(self):
+        return len(self.i_groups)
+
+
+def _get_window_targets(concat_ds):
+    if not all([hasattr(ds, 'y') for ds in concat_ds.datasets]):
+        raise ValueError('Targets of windows are only available for '
+                         'WindowsDatasets.')
+    return np.concatenate([ds.y for ds in concat_ds.datasets])
+
+
+class DistributedRecordingSampler(Sampler):
+    """Split the windows of a BaseConcatDataset between distributed
+    processes by whole recordings.
+
+    Every process (rank) only draws windows of its own recordings, so with
+    lazy loading each process only reads its own files. Recordings are
+    assigned to ranks once, balancing the number of windows per rank
+    greedily. The assignment only depends on the window counts, so all
+    ranks agree on it. In every epoch, the windows of each rank are shuffled
+    with `seed` + epoch, set through `set_epoch`.
+
+    Parameters
+    ----------
+    concat_ds: BaseConcatDataset
+        dataset to sample windows from
+    num_replicas: int | None
+        number of processes. If None, taken from torch.distributed.
+    rank: int | None
+        rank of the current process. If None, taken from torch.distributed.
+    shuffle: bool
+        whether to shuffle the windows of the rank in every epoch
+    seed: int
+        seed for shuffling, has to be the same for all ranks
+    pad: bool
+        whether to repeat windows of a rank such that all ranks draw the same
+        number of windows, which is needed to keep the processes in sync
+        during training. Disable it for evaluation to draw every window once.
+
+    Attributes
+    ----------
+    i_recordings: np.ndarray
+        indices of the recordings assigned to this rank
+    """
+    def __init__(self, concat_ds, num_replicas=None, rank=None, shuffle=True,
+                 seed=0, pad=True):
+        if num_replicas is None:
+            num_replicas = dist.get_world_size()
+        if rank is None:
+            rank = dist.get_rank()
+        if not 0 <= rank < num_replicas:
+            raise ValueError(
+                f'rank {rank} is not in the interval [0, {num_replicas - 1}]')
+        n_windows = np.diff(concat_ds.cumulative_sizes, prepend=0)
+        if len(n_windows) < num_replicas:
+            raise ValueError(
+                f'Cannot split {len(n_windows)} recordings between '
+                f'{num_replicas} ranks.')
+        assignment = _assign_recordings(n_windows, num_replicas)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.pad = pad
+        self.epoch = 0
+        self.i_recordings = np.flatnonzero(assignment == rank)
+        starts = np.asarray(concat_ds.cumulative_sizes) - n_windows
+        self.inds = np.concatenate([
+            np.arange(starts[i], starts[i] + n_windows[i])
+            for i in self.i_recordings]).astype(np.int64)
+        self.n_padded = int(np.bincount(
+            assignment, weights=n_windows, minlength=num_replicas).max())
+
+    def set_epoch(self, epoch):
+        """Set the epoch to draw a new order of windows.
+
+        Parameters
+        ----------
+        epoch: int
+            number of the epoch
+        """
+        self.epoch = epoch
+
+    def __iter__(self):
+        inds = self.inds
+        if self.shuffle:
+            rng = np.random.RandomState(self.seed + self.epoch)
+            inds = rng.permutation(inds)
+        if self.pad and len(inds) < self.n_padded:
+            inds = np.resize(inds, self.n_padded)
+        yield from inds.tolist()
+
+    def __len__(self):
+        return self.n_padded if self.pad else len(self.inds)
+
+
+def _assign_recordings(n_windows, n_ranks):
+    """Assign recordings to ranks, the largest recordings first, each to the
+    rank with the fewest windows so far."""
+    assignment = np.empty(len(n_windows), dtype=int)
+    loads = [(0, i_rank) for i_rank in range(n_ranks)]
+    for i_recording in np.argsort(-n_windows, kind='stable'):
+        load, i_rank = heapq.heappop(loads)
+        assignment[i_recording] = i_rank
+        heapq.heappush(loads, (load + n_windows[i_recording], i_rank))
+    return assignment
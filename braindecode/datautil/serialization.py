@@ -11,12 +11,14 @@ import os
 from glob import glob
 
 import mne
+import numpy as np
 import pandas as pd
 
 from ..datasets.base import BaseDataset, BaseConcatDataset, WindowsDataset
 
 
-def save_concat_dataset(path, concat_dataset, overwrite=False):
+def save_concat_dataset(path, concat_dataset, overwrite=False,
+                        shard_size=None):
     """Save a BaseConcatDataset of BaseDatasets or WindowsDatasets to files
 
     Parameters
@@ -27,8 +29,18 @@ def save_concat_dataset(path, concat_dataset, overwrite=False):
         to save to files
     overwrite: bool
         whether to overwrite existing files (will delete old fif files in specified directory)
+    shard_size: int | None
+        If given, store the windows of WindowsDatasets in shards of
+        `shard_size` windows each instead of one .fif file per dataset. Each
+        shard is a .npz file holding the windows, targets and crop indices,
+        the shards are listed in shards.json. Choose the shard size such that
+        the shards are large (e.g. ~1 GB) to read them sequentially. Read
+        them with `braindecode.datasets.ShardedWindowsDataset`.
     """
     assert len(concat_dataset.datasets) > 0, "Expect at least one dataset"
+    if shard_size is not None:
+        _save_shards(path, concat_dataset, shard_size, overwrite)
+        return
     assert (hasattr(concat_dataset.datasets[0], 'raw') + hasattr(
         concat_dataset.datasets[0], 'windows') == 1), (
         "dataset should have either raw or windows attribute")
@@ -61,6 +73,62 @@ def save_concat_dataset(path, concat_dataset, overwrite=False):
     concat_dataset.description.to_json(description_file_name)
 
 
+def _save_shards(path, concat_dataset, shard_size, overwrite):
+    assert all([hasattr(ds, 'windows') for ds in concat_dataset.datasets]), (
+        "Only WindowsDatasets can be stored in shards")
+    assert shard_size > 0, "shard_size has to be larger than 0"
+    shards_file_name = os.path.join(path, 'shards.json')
+    description_file_name = os.path.join(path, 'description.json')
+    if overwrite:
+        _ = [os.remove(f) for f in glob(os.path.join(path, 'shard-*.npz'))]
+        if os.path.isfile(shards_file_name):
+            os.remove(shards_file_name)
+    elif os.path.isfile(shards_file_name):
+        raise FileExistsError(f'{shards_file_name} already exists.')
+
+    shards = []
+
+    def write_shard(arrays):
+        file_name = f'shard-{len(shards)}.npz'
+        np.savez(os.path.join(path, file_name), **arrays)
+        shards.append({'file_name': file_name,
+                       'n_windows': len(arrays['X'])})
+
+    buffer = dict(X=[], y=[], crop_inds=[], i_recording=[])
+    n_buffered = 0
+    X_shape = None
+    for i_ds, ds in enumerate(concat_dataset.datasets):
+        if len(ds) == 0:
+            continue
+        X = ds.windows.get_data().astype('float32')
+        if X_shape is not None and X.shape[1:] != X_shape:
+            raise ValueError('All windows need to have the same shape to be '
+                             'stored in shards.')
+        X_shape = X.shape[1:]
+        buffer['X'].append(X)
+        y = ds.y
+        if np.issubdtype(y.dtype, np.integer):
+            # shards yield targets as stored, torch losses expect int64
+            y = y.astype(np.int64)
+        buffer['y'].append(y)
+        buffer['crop_inds'].append(ds.crop_inds)
+        buffer['i_recording'].append(np.full(len(X), i_ds))
+        n_buffered += len(X)
+        if n_buffered >= shard_size:
+            arrays = {k: np.concatenate(v) for k, v in buffer.items()}
+            n_full = n_buffered - n_buffered % shard_size
+            for start in range(0, n_full, shard_size):
+                write_shard({k: v[start:start + shard_size]
+                             for k, v in arrays.items()})
+            buffer = {k: [v[n_full:]] for k, v in arrays.items()}
+            n_buffered -= n_full
+    if n_buffered > 0:
+        write_shard({k: np.concatenate(v) for k, v in buffer.items()})
+
+    json.dump({'shards': shards}, open(shards_file_name, 'w'))
+    concat_dataset.description.to_json(description_file_name)
+
+
 def load_concat_dataset(path, preload, ids_to_load=None, target_name=None):
     """Load a stored BaseConcatDataset of BaseDatasets or WindowsDatasets from
     files
@@ -0,0 +1,138 @@
+"""
+Store preloaded signals of datasets in shared memory.
+"""
+
+# License: BSD (3-clause)
+
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+
+class SharedArray:
+    """Picklable handle to an array stored in a file in shared memory.
+
+    Pickling a SharedArray only stores the file name, dtype and shape of the
+    array, so all processes that open the handle map the same physical
+    memory. The file is removed once the handle of the process that created
+    it is garbage collected.
+
+    Parameters
+    ----------
+    filename: str
+        path of the file holding the array
+    dtype: numpy.dtype | str
+        dtype of the array
+    shape: tuple
+        shape of the array
+    """
+    def __init__(self, filename, dtype, shape):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_array(cls, array, dirname=None):
+        """Copy an array into a new file in shared memory.
+
+        Parameters
+        ----------
+        array: np.ndarray
+            array to copy
+        dirname: str | None
+            directory in which the file is created. If None, /dev/shm is
+            used if it exists, otherwise the default temporary directory.
+
+        Returns
+        -------
+        shared: SharedArray
+            handle to the copied array
+        """
+        if dirname is None:
+            dirname = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, filename = tempfile.mkstemp(
+            suffix='.dat', prefix='braindecode-', dir=dirname)
+        os.close(fd)
+        shared = cls(filename, array.dtype, array.shape)
+        shared._finalizer = weakref.finalize(
+            shared, _remove_file, filename, os.getpid())
+        if array.size > 0:
+            memmap = np.memmap(
+                filename, dtype=array.dtype, mode='w+', shape=array.shape)
+            memmap[:] = array
+            memmap.flush()
+        return shared
+
+    def open(self, mode='r+'):
+        """Map the array into memory of the current process.
+
+        Parameters
+        ----------
+        mode: str
+            mode passed to numpy.memmap. 'r+' writes changes to the shared
+            memory, 'c' keeps changes private to the current process.
+
+        Returns
+        -------
+        array: np.ndarray
+            memory-mapped array
+        """
+        if int(np.prod(self.shape)) == 0:
+            # mmap cannot map empty files
+            return np.empty(self.shape, dtype=self.dtype)
+        return np.memmap(
+            self.filename, dtype=self.dtype, mode=mode, shape=self.shape)
+
+    def __getstate__(self):
+        # do not pickle the finalizer, only the creating process removes the
+        # file
+        return dict(
+            filename=self.filename, dtype=self.dtype.str, shape=self.shape)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def _remove_file(filename, pid):
+    # forked processes inherit the finalizer, but must not remove the file
+    if os.getpid() == pid and os.path.exists(filename):
+        os.remove(filename)
+
+
+def share_memory(concat_ds, dirname=None):
+    """Move the preloaded signals of all datasets into shared memory.
+
+    Afterwards, pickling the datasets, e.g. when sending them to DataLoader
+    workers or to parallel jobs, only pickles a handle to the signals instead
+    of the signals themselves. All processes then read the same physical
+    copy of the data. Datasets that are not preloaded are left unchanged.
+
+    Parameters
+    ----------
+    concat_ds: BaseConcatDataset of BaseDatasets or WindowsDatasets
+        datasets whose signals are moved into shared memory (in place)
+    dirname: str | None
+        directory in which the shared files are created. If None, /dev/shm is
+        used if it exists, otherwise the default temporary directory.
+
+    Returns
+    -------
+    concat_ds: BaseConcatDataset of BaseDatasets or WindowsDatasets
+        the same datasets
+    """
+    for ds in concat_ds.datasets:
+        mne_obj = getattr(ds, ds._signal_attr)
+        if (not mne_obj.preload
+                or getattr(ds, '_shared_data', None) is not None):
+            continue
+        ds._shared_data = SharedArray.from_array(mne_obj._data, dirname)
+        mne_obj._data = ds._shared_data.open()
+        if isinstance(getattr(mne_obj, '_init_kwargs', None), dict):
+            # mne.io.RawArray keeps a reference to its input data, which
+            # would otherwise stay in memory and be pickled
+            mne_obj._init_kwargs = {
+                k: v for k, v in mne_obj._init_kwargs.items()
+                if not isinstance(v, np.ndarray)}
+    return concat_ds
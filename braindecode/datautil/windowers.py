@@ -52,10 +52,13 @@ def create_windows_from_events(
     preload: bool
         if True, preload the data of the Epochs objects.
     drop_bad_windows: bool
-        If True, call `.drop_bad()` on the resulting mne.Epochs object. This
-        step allows identifying e.g., windows that fall outside of the
-        continuous recording. It is suggested to run this step here as otherwise
-        the BaseConcatDataset has to be updated as well.
+        If True, drop windows that fall outside of the continuous recording
+        or overlap with bad annotations (descriptions starting with 'bad').
+        This is equivalent to calling `.drop_bad(reject=None, flat=None)` on
+        the resulting mne.Epochs object, but is computed from sample bounds
+        and annotations only, without loading any data. It is suggested to
+        run this step here as otherwise the BaseConcatDataset has to be
+        updated as well.
 
     Returns
     -------
@@ -134,8 +137,15 @@ def create_windows_from_events(
             'i_window_in_trial': i_window_in_trials,
             'i_start_in_trial': starts,
             'i_stop_in_trial': stops,
+            'i_trial': i_trials,
             'target': description})
 
+        if drop_bad_windows:
+            valid_mask = _get_valid_windows_mask(
+                ds.raw, events[:, 0], window_size_samples)
+            events = events[valid_mask]
+            metadata = metadata[valid_mask].reset_index(drop=True)
+
         # window size - 1, since tmax is inclusive
         mne_epochs = mne.Epochs(
             ds.raw, events, events_id, baseline=None, tmin=0,
@@ -143,7 +153,7 @@ def create_windows_from_events(
             metadata=metadata, preload=preload)
 
         if drop_bad_windows:
-            mne_epochs = mne_epochs.drop_bad(reject=None, flat=None)
+            _mark_bad_windows_dropped(mne_epochs)
 
         windows_ds = WindowsDataset(mne_epochs, ds.description)
         list_of_windows_ds.append(windows_ds)
@@ -177,10 +187,13 @@ def create_fixed_length_windows(
     preload: bool
         if True, preload the data of the Epochs objects.
     drop_bad_windows: bool
-        If True, call `.drop_bad()` on the resulting mne.Epochs object. This
-        step allows identifying e.g., windows that fall outside of the
-        continuous recording. It is suggested to run this step here as otherwise
-        the BaseConcatDataset has to be updated as well.
+        If True, drop windows that fall outside of the continuous recording
+        or overlap with bad annotations (descriptions starting with 'bad').
+        This is equivalent to calling `.drop_bad(reject=None, flat=None)` on
+        the resulting mne.Epochs object, but is computed from sample bounds
+        and annotations only, without loading any data. It is suggested to
+        run this step here as otherwise the BaseConcatDataset has to be
+        updated as well.
 
     Returns
     -------
@@ -210,14 +223,22 @@ def create_fixed_length_windows(
         if mapping is not None:
             target = mapping[target]
 
-        fake_events = [[start, window_size_samples, -1] for start in starts]
+        fake_events = np.array(
+            [[start, window_size_samples, -1] for start in starts])
         metadata = pd.DataFrame({
             'i_window_in_trial': np.arange(len(fake_events)),
             'i_start_in_trial': starts,
             'i_stop_in_trial': starts + window_size_samples,
+            'i_trial': np.zeros(len(fake_events), dtype=int),
             'target': len(fake_events) * [target]
         })
 
+        if drop_bad_windows:
+            valid_mask = _get_valid_windows_mask(
+                ds.raw, starts, window_size_samples)
+            fake_events = fake_events[valid_mask]
+            metadata = metadata[valid_mask].reset_index(drop=True)
+
         # window size - 1, since tmax is inclusive
         mne_epochs = mne.Epochs(
             ds.raw, fake_events, baseline=None,
@@ -225,7 +246,7 @@ def create_fixed_length_windows(
             metadata=metadata, preload=preload)
 
         if drop_bad_windows:
-            mne_epochs = mne_epochs.drop_bad(reject=None, flat=None)
+            _mark_bad_windows_dropped(mne_epochs)
 
         windows_ds = WindowsDataset(mne_epochs, ds.description)
         list_of_windows_ds.append(windows_ds)
@@ -233,6 +254,64 @@ def create_fixed_length_windows(
     return BaseConcatDataset(list_of_windows_ds)
 
 
+def _get_valid_windows_mask(raw, window_starts, window_size_samples):
+    """Find windows that lie inside the continuous recording and do not
+    overlap with bad annotations, without loading any data.
+
+    Vectorized equivalent of `mne.Epochs.drop_bad(reject=None, flat=None)`
+    for windows with tmin=0.
+
+    Parameters
+    ----------
+    raw: mne.io.Raw
+        continuous signal the windows are cut from
+    window_starts: array-like
+        window starts in samples, including `raw.first_samp` as in mne events
+    window_size_samples: int
+        window size
+
+    Returns
+    -------
+    valid_mask: np.ndarray
+        boolean mask, True for windows that would be kept by mne
+    """
+    starts = np.asarray(window_starts) - raw.first_samp
+    stops = starts + window_size_samples
+    valid_mask = (starts >= 0) & (stops <= raw.n_times)
+
+    annotations = raw.annotations
+    if len(annotations) > 0:
+        is_bad = np.array([desc.lower().startswith('bad')
+                           for desc in annotations.description], dtype=bool)
+        if is_bad.any():
+            sfreq = raw.info['sfreq']
+            bad_onsets = annotations.onset[is_bad] - raw.first_time
+            bad_ends = bad_onsets + annotations.duration[is_bad]
+            order = np.argsort(bad_onsets, kind='stable')
+            bad_onsets = bad_onsets[order]
+            # latest end of all bad segments starting up to a given one
+            max_bad_ends = np.maximum.accumulate(bad_ends[order])
+            # number of bad segments starting before the end of each window
+            n_bad_before_stop = np.searchsorted(
+                bad_onsets, stops / sfreq, side='left')
+            has_bad_before_stop = n_bad_before_stop > 0
+            overlaps_bad = np.zeros(len(starts), dtype=bool)
+            overlaps_bad[has_bad_before_stop] = (
+                max_bad_ends[n_bad_before_stop[has_bad_before_stop] - 1] >
+                starts[has_bad_before_stop] / sfreq)
+            valid_mask &= ~overlaps_bad
+    return valid_mask
+
+
+def _mark_bad_windows_dropped(mne_epochs):
+    """Mark bad windows of mne.Epochs as dropped, after they have been
+    removed with `_get_valid_windows_mask`. Avoids mne loading every single
+    window from disk to check it, which happens in `.drop_bad()` of lazy
+    mne.Epochs.
+    """
+    mne_epochs._bad_dropped = True
+
+
 def _compute_window_inds(
         starts, stops, start_offset, stop_offset, size, stride, drop_last_window):
     """Create window starts from trial onsets (shifted by offset) to trial
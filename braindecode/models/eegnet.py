@@ -2,19 +2,16 @@ import torch
 from torch import nn
 from torch.nn.functional import elu
 
-from .modules import Expression
+from .modules import Expression, apply_max_norm, set_max_norm
 from .functions import squeeze_final_output
 
 class Conv2dWithConstraint(nn.Conv2d):
+    """Convolution with a max norm constraint on its weights, applied after
+    every optimizer step (see `set_max_norm`)."""
     def __init__(self, *args, max_norm=1, **kwargs):
         self.max_norm = max_norm
         super(Conv2dWithConstraint, self).__init__(*args, **kwargs)
-
-    def forward(self, x):
-        self.weight.data = torch.renorm(
-            self.weight.data, p=2, dim=0, maxnorm=self.max_norm
-        )
-        return super(Conv2dWithConstraint, self).forward(x)
+        set_max_norm(self, max_norm)
 
 
 class EEGNetv4(nn.Sequential):
@@ -171,6 +168,7 @@ class EEGNetv4(nn.Sequential):
         self.add_module("squeeze", Expression(squeeze_final_output))
 
         _glorot_weight_zero_bias(self)
+        apply_max_norm(self)
 
 
 def _transpose_to_b_1_c_0(x):
@@ -236,7 +234,7 @@ class EEGNetv1(nn.Sequential):
         self.add_module("elu_1", Expression(elu))
         # transpose to examples x 1 x (virtual, not EEG) channels x time
         self.add_module(
-            "permute_1", Expression(lambda x: x.permute(0, 3, 1, 2))
+            "permute_1", Expression(_transpose_to_b_1_c_0)
         )
 
         self.add_module("drop_1", nn.Dropout(p=self.drop_prob))
@@ -1,3 +1,5 @@
+import functools
+
 import numpy as np
 
 import torch
@@ -110,6 +112,92 @@ class AvgPool2dWithConv(torch.nn.Module):
         return pooled
 
 
+def set_max_norm(module, max_norm, param_name="weight"):
+    """Register a max norm constraint on a parameter of a module.
+
+    The constraint is not applied in the forward pass, but by
+    `apply_max_norm` after optimizer steps. `EEGClassifier` and
+    `EEGRegressor` apply it after every step of their optimizer, for plain
+    PyTorch training loops use `register_max_norm_hook`. The constraint is
+    stored on the module and kept by copies of it.
+
+    Parameters
+    ----------
+    module: torch.nn.Module
+        Module owning the parameter.
+    max_norm: float
+        Maximum L2 norm of the parameter per output unit, i.e. of each slice
+        along its first dimension.
+    param_name: str
+        Name of the parameter in the module.
+    """
+    if not hasattr(module, "max_norms"):
+        module.max_norms = dict()
+    module.max_norms[param_name] = max_norm
+
+
+def apply_max_norm(model):
+    """Renormalize all parameters of a model with a max norm constraint
+    registered by `set_max_norm` in-place, in a single pass.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+    """
+    _renorm([
+        (getattr(module, param_name), max_norm)
+        for module in model.modules()
+        for param_name, max_norm in getattr(
+            module, "max_norms", dict()).items()])
+
+
+def register_max_norm_hook(model, optimizer):
+    """Apply the max norm constraints of a model (see `set_max_norm`) after
+    every step of an optimizer.
+
+    Copies of the optimizer do not keep the hook, register it again on them.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+    optimizer: torch.optim.Optimizer
+        optimizer updating the parameters of the model
+
+    Returns
+    -------
+    handle: torch.utils.hooks.RemovableHandle
+        handle to remove the hook with ``handle.remove()``
+    """
+    return optimizer.register_step_post_hook(
+        functools.partial(_apply_max_norm_after_step, model))
+
+
+def _apply_max_norm_after_step(model, optimizer, args, kwargs):
+    apply_max_norm(model)
+
+
+def _renorm(params_and_max_norms):
+    """Renormalize parameters like `torch.Tensor.renorm_` with p=2 and dim=0,
+    with grouped foreach operations over all parameters of the same device
+    and dtype.
+    """
+    groups = dict()
+    for param, max_norm in params_and_max_norms:
+        group = groups.setdefault((param.device, param.dtype), ([], []))
+        group[0].append(param.detach().view(len(param), -1))
+        group[1].append(max_norm)
+    with torch.no_grad():
+        for rows, max_norms in groups.values():
+            norms = [torch.linalg.vector_norm(r, dim=1, keepdim=True)
+                     for r in rows]
+            # same epsilon as renorm_
+            torch._foreach_add_(norms, 1e-7)
+            torch._foreach_reciprocal_(norms)
+            torch._foreach_mul_(norms, max_norms)
+            torch._foreach_clamp_max_(norms, 1.0)
+            torch._foreach_mul_(rows, norms)
+
+
 class IntermediateOutputWrapper(torch.nn.Module):
     """Wraps network model such that outputs of intermediate layers can be returned.
     forward() returns list of intermediate activations in a network during forward pass.
@@ -1,5 +1,24 @@
+import warnings
+
 import torch
 import numpy as np
+from torch import nn
+from torch.nn.modules.utils import _pair
+
+from .eegnet import _transpose_1_0, _transpose_to_b_1_c_0
+from .functions import transpose_time_to_spat
+from .modules import AvgPool2dWithConv, Expression
+from .tcn import TCN, Chomp1d
+
+# permutations of the axes of the intermediate outputs by expressions
+_AXES_PERMUTATIONS = {
+    transpose_time_to_spat: (0, 3, 2, 1),
+    _transpose_to_b_1_c_0: (0, 3, 1, 2),
+    _transpose_1_0: (0, 1, 3, 2),
+}
+_TIME_WINDOW_MODULES = (
+    nn.Conv1d, nn.Conv2d, nn.MaxPool1d, nn.MaxPool2d, nn.AvgPool1d,
+    nn.AvgPool2d, AvgPool2dWithConv)
 
 
 def to_dense_prediction_model(model, axis=(2, 3)):
@@ -15,10 +34,15 @@ def to_dense_prediction_model(model, axis=(2, 3)):
     axis: int or (int,int)
         Axis to transform (in terms of intermediate output axes)
         can either be 2, 3, or (2,3).
-    
+
     Notes
     -----
-    Does not yet work correctly for average pooling.
+    Average poolings (`torch.nn.AvgPool2d`) cannot be dilated, they are
+    replaced by equivalent `AvgPool2dWithConv` modules.
+    Dense predictions equal the predictions of strided windows if no layer
+    after a strided layer pads its input. Otherwise, e.g. for EEGNet, a
+    warning is raised, as the padded zeros are dilated and the dense
+    predictions differ.
     Prior to version 0.1.7, there had been a bug that could move strides
     backwards one layer.
 
@@ -28,12 +52,23 @@ def to_dense_prediction_model(model, axis=(2, 3)):
     assert all([ax in [2, 3] for ax in axis]), "Only 2 and 3 allowed for axis"
     axis = np.array(axis) - 2
     stride_so_far = np.array([1, 1])
-    for module in model.modules():
+    padded_after_stride = None
+    for name, module in list(model.named_modules()):
+        if isinstance(module, nn.AvgPool2d):
+            module = _to_avg_pool_with_conv(module)
+            _set_submodule(model, name, module)
+        if hasattr(module, "stride") and not hasattr(module, "dilation"):
+            raise ValueError(
+                f"Cannot insert dilations into {module.__class__.__name__}.")
         if hasattr(module, "dilation"):
             assert module.dilation == 1 or (module.dilation == (1, 1)), (
                 "Dilation should equal 1 before conversion, maybe the model is "
                 "already converted?"
             )
+            if padded_after_stride is None and any(
+                    stride_so_far[ax] > 1 and _get_padding(module)[ax] > 0
+                    for ax in axis):
+                padded_after_stride = name
             new_dilation = [1, 1]
             for ax in axis:
                 new_dilation[ax] = int(stride_so_far[ax])
@@ -46,6 +81,142 @@ def to_dense_prediction_model(model, axis=(2, 3)):
             for ax in axis:
                 new_stride[ax] = 1
             module.stride = tuple(new_stride)
+    if padded_after_stride is not None:
+        warnings.warn(
+            f"{padded_after_stride} pads its input after a strided layer, "
+            f"dense predictions of {model.__class__.__name__} differ from "
+            f"the predictions of strided windows.")
+
+
+def _get_padding(module):
+    padding = getattr(module, "padding", 0)
+    if padding == "valid":
+        return (0, 0)
+    if padding == "same":
+        return tuple(int(k > 1) for k in _pair(module.kernel_size))
+    return _pair(padding)
+
+
+def _to_avg_pool_with_conv(pool):
+    if pool.ceil_mode or pool.divisor_override is not None or (
+            not pool.count_include_pad and pool.padding not in [0, (0, 0)]):
+        raise ValueError(
+            "Only average poolings without ceil mode and divisor override "
+            "that count padded zeros can be transformed.")
+    return AvgPool2dWithConv(
+        kernel_size=_pair(pool.kernel_size), stride=_pair(pool.stride),
+        padding=_pair(pool.padding))
+
+
+def _set_submodule(model, name, module):
+    if name == "":
+        raise ValueError("Cannot transform a model that is a single pooling.")
+    *parent_names, child_name = name.split(".")
+    parent = model
+    for parent_name in parent_names:
+        parent = getattr(parent, parent_name)
+    setattr(parent, child_name, module)
+
+
+def optimize_for_inference(model):
+    """
+    Fuse the layers of a model for faster inference. Modifies model in-place
+    and sets it to evaluation mode.
+
+    - Weight normalizations (e.g. in `TCN`) are removed, so the weights are
+      not recomputed in every forward pass.
+    - Batch norms are folded into the convolution directly before them.
+    - With `split_first_layer`, `conv_time` and `conv_spat` are merged into a
+      single convolution over time and channels.
+
+    Fused convolutions are plain `torch.nn.Conv1d` or `torch.nn.Conv2d`
+    modules, removed modules are replaced by `torch.nn.Identity`. The model
+    cannot be trained afterwards and its parameters cannot be loaded from
+    or saved to a state dict of the original model.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        Model which modules will be modified
+
+    Notes
+    -----
+    A batch norm is only folded if it is registered directly after a
+    convolution in the same module, as in all braindecode models.
+    """
+    model.eval()
+    for module in model.modules():
+        if hasattr(module, "weight_g"):
+            nn.utils.remove_weight_norm(module)
+    for parent in list(model.modules()):
+        children = list(parent.named_children())
+        for (name, module), (next_name, next_module) in zip(
+                children[:-1], children[1:]):
+            if isinstance(module, (nn.Conv1d, nn.Conv2d)) and isinstance(
+                    next_module, (nn.BatchNorm1d, nn.BatchNorm2d)) and (
+                    next_module.track_running_stats):
+                setattr(parent, name, _fold_batch_norm(module, next_module))
+                setattr(parent, next_name, nn.Identity())
+        if isinstance(getattr(parent, "conv_time", None), nn.Conv2d) and (
+                isinstance(getattr(parent, "conv_spat", None), nn.Conv2d)):
+            merged_conv = _merge_time_and_spat_conv(
+                parent.conv_time, parent.conv_spat)
+            if merged_conv is not None:
+                parent.conv_time = merged_conv
+                parent.conv_spat = nn.Identity()
+
+
+def _copy_conv(conv, weight, bias, **conv_kwargs):
+    conv_class = nn.Conv1d if isinstance(conv, nn.Conv1d) else nn.Conv2d
+    kwargs = dict(
+        kernel_size=tuple(weight.shape[2:]), stride=conv.stride,
+        padding=conv.padding, dilation=conv.dilation, groups=conv.groups,
+        padding_mode=conv.padding_mode)
+    kwargs.update(conv_kwargs)
+    new_conv = conv_class(
+        weight.shape[1] * kwargs['groups'], weight.shape[0], **kwargs).to(
+        device=weight.device, dtype=weight.dtype)
+    with torch.no_grad():
+        new_conv.weight.copy_(weight)
+        new_conv.bias.copy_(bias)
+    return new_conv.eval()
+
+
+def _fold_batch_norm(conv, batch_norm):
+    weight = conv.weight.detach()
+    bias = torch.zeros_like(batch_norm.running_mean) if (
+        conv.bias is None) else conv.bias.detach()
+    scale = torch.rsqrt(batch_norm.running_var + batch_norm.eps)
+    shift = -batch_norm.running_mean
+    if batch_norm.affine:
+        scale = scale * batch_norm.weight.detach()
+    bias = (bias + shift) * scale
+    if batch_norm.affine:
+        bias = bias + batch_norm.bias.detach()
+    weight = weight * scale.reshape((-1,) + (1,) * (weight.ndim - 1))
+    return _copy_conv(conv, weight, bias)
+
+
+def _merge_time_and_spat_conv(conv_time, conv_spat):
+    # conv_time only convolves time, conv_spat only channels, both linear
+    if conv_time.kernel_size[1] != 1 or conv_spat.kernel_size[0] != 1 or (
+            conv_time.stride != (1, 1)) or conv_time.padding[1] != 0 or (
+            conv_spat.padding[0] != 0) or conv_time.groups != 1 or (
+            conv_spat.groups != 1) or conv_time.padding_mode != "zeros":
+        return None
+    time_weight = conv_time.weight.detach()[:, :, :, 0]
+    spat_weight = conv_spat.weight.detach()[:, :, 0, :]
+    weight = torch.einsum('ofc,fit->oitc', spat_weight, time_weight)
+    bias = torch.zeros(weight.shape[0], dtype=weight.dtype,
+                       device=weight.device)
+    if conv_spat.bias is not None:
+        bias = bias + conv_spat.bias.detach()
+    if conv_time.bias is not None:
+        bias = bias + spat_weight.sum(dim=2) @ conv_time.bias.detach()
+    return _copy_conv(
+        conv_spat, weight, bias,
+        padding=(conv_time.padding[0], conv_spat.padding[1]),
+        dilation=(conv_time.dilation[0], conv_spat.dilation[1]))
 
 
 def get_output_shape(model, in_chans, input_window_samples):
@@ -64,3 +235,182 @@ def get_output_shape(model, in_chans, input_window_samples):
         )
         output_shape = model(dummy_input).shape
     return output_shape
+
+
+def get_receptive_field(model, input_window_samples):
+    """Compute the receptive field and the output length of a model along
+    the time axis analytically, without a forward pass.
+
+    Walks the convolutions and poolings of `Deep4Net`, `ShallowFBCSPNet`,
+    `EEGNetv4`, `EEGNetv1`, `EEGResNet`, `HybridNet` and `TCN`, also after
+    `to_dense_prediction_model`. Residual connections are assumed to have a
+    smaller receptive field than the main path, all other modules are
+    assumed not to change the time axis.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        model taking inputs of shape batch x channels x time (x 1)
+    input_window_samples: int
+        number of samples of the input windows
+
+    Returns
+    -------
+    receptive_field_info: dict
+        `receptive_field`: number of input samples that one prediction sees,
+        `stride`: number of input samples between two predictions,
+        `n_preds_per_input`: number of predictions for an input window,
+        `min_input_window_samples`: smallest input window the model can
+        predict
+    """
+    n_preds_per_input, receptive_field, stride = _get_time_axis_params(
+        model, input_window_samples)
+    if n_preds_per_input < 1:
+        raise ValueError(
+            f'Input window of {input_window_samples} samples is too short '
+            f'for the model.')
+    # output lengths do not decrease with the input length
+    n_min, n_max = 1, max(receptive_field, 1)
+    while _get_time_axis_params(model, n_max)[0] < 1:
+        n_max *= 2
+    while n_min < n_max:
+        n_samples = (n_min + n_max) // 2
+        if _get_time_axis_params(model, n_samples)[0] < 1:
+            n_min = n_samples + 1
+        else:
+            n_max = n_samples
+    return dict(receptive_field=receptive_field, stride=stride,
+                n_preds_per_input=n_preds_per_input,
+                min_input_window_samples=n_min)
+
+
+def get_dense_window_params(model, window_size_samples):
+    """Get the windowing parameters to cut trials into (super)crops for a
+    dense prediction model.
+
+    A dense prediction model (see `to_dense_prediction_model`) accepts
+    inputs longer than the window it was created for and then predicts
+    every time step after its receptive field. Feeding long supercrops or
+    whole trials computes shared receptive fields only once, instead of
+    once per overlapping window. With a stride equal to the number of
+    predictions per window, every time step of a trial is predicted once,
+    and the trial predictions are identical to those of shorter windows.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        dense prediction model
+    window_size_samples: int
+        size of the supercrops, e.g. the length of the trials to feed whole
+        trials
+
+    Returns
+    -------
+    window_params: dict
+        `window_size_samples` and `window_stride_samples` to pass to
+        `create_windows_from_events` or `create_fixed_length_windows`
+    """
+    receptive_field_info = get_receptive_field(model, window_size_samples)
+    if receptive_field_info['stride'] != 1:
+        raise ValueError(
+            'Model does not predict every time step, transform it with '
+            'to_dense_prediction_model first.')
+    return dict(
+        window_size_samples=window_size_samples,
+        window_stride_samples=receptive_field_info['n_preds_per_input'])
+
+
+def get_cropped_window_params(model, input_window_samples):
+    """Plan the windowing parameters for cropped decoding from the receptive
+    field of a dense prediction model.
+
+    The stride between windows equals the number of predictions per window,
+    so every time step of a trial after the first receptive field is
+    predicted exactly once. To feed supercrops or whole trials instead of
+    windows of the input size of the model, see `get_dense_window_params`.
+
+    Parameters
+    ----------
+    model: torch.nn.Module
+        dense prediction model (see `to_dense_prediction_model`)
+    input_window_samples: int
+        number of samples of the input windows
+
+    Returns
+    -------
+    window_params: dict
+        `window_size_samples` and `window_stride_samples` to pass to
+        `create_windows_from_events` or `create_fixed_length_windows`
+    """
+    return get_dense_window_params(model, input_window_samples)
+
+
+def _get_time_axis_params(model, n_times):
+    """Propagate the length, receptive field and stride of the time axis
+    through a model, returns a length below 1 if the input is too short."""
+    state = _propagate_time_axis(model, (n_times, 1, 1, 2))
+    n_out, receptive_field, stride, _ = state
+    if isinstance(model, TCN):
+        # only predictions without zero padding in their receptive field
+        n_out = n_times - model.min_len + 1
+    return n_out, receptive_field, stride
+
+
+def _propagate_time_axis(module, state):
+    n_times, receptive_field, stride, time_axis = state
+    if n_times < 1:
+        return state
+    if isinstance(module, _TIME_WINDOW_MODULES):
+        i_axis = time_axis - 2
+        kernel_size = _get_time_value(module.kernel_size, i_axis)
+        module_stride = _get_time_value(module.stride, i_axis)
+        dilation = _get_time_value(getattr(module, 'dilation', 1), i_axis)
+        padding = _get_time_value(getattr(module, 'padding', 0), i_axis)
+        n_after_first = (n_times + 2 * padding -
+                         dilation * (kernel_size - 1) - 1)
+        if getattr(module, 'ceil_mode', False):
+            n_out = -(-n_after_first // module_stride) + 1
+            # last window has to start inside the input or left padding
+            if (n_out - 1) * module_stride >= n_times + padding:
+                n_out -= 1
+            n_times = n_out
+        else:
+            n_times = n_after_first // module_stride + 1
+        receptive_field += (kernel_size - 1) * dilation * stride
+        stride *= module_stride
+    elif isinstance(module, Chomp1d):
+        n_times -= module.chomp_size
+    elif isinstance(module, Expression):
+        permutation = _AXES_PERMUTATIONS.get(module.expression_fn)
+        if permutation is not None:
+            time_axis = permutation.index(time_axis)
+    elif _is_hybrid_net(module):
+        # deep and shallow part see the same input, the shorter output is
+        # padded in front
+        deep_state = _propagate_time_axis(module.reduced_deep_model, state)
+        shallow_state = _propagate_time_axis(
+            module.reduced_shallow_model, state)
+        n_times = max(deep_state[0], shallow_state[0])
+        if min(deep_state[0], shallow_state[0]) < 1:
+            n_times = 0
+        receptive_field = max(deep_state[1], shallow_state[1])
+        stride = max(deep_state[2], shallow_state[2])
+        time_axis = deep_state[3]
+    else:
+        for child in module.children():
+            n_times, receptive_field, stride, time_axis = (
+                _propagate_time_axis(
+                    child, (n_times, receptive_field, stride, time_axis)))
+    return n_times, receptive_field, stride, time_axis
+
+
+def _get_time_value(param, i_axis):
+    if hasattr(param, '__len__'):
+        return param[i_axis] if len(param) > 1 else param[0]
+    return param
+
+
+def _is_hybrid_net(module):
+    # hybrid module imports this module, so it cannot be imported here
+    from .hybrid import HybridNet
+    return isinstance(module, HybridNet)
@@ -1,12 +1,18 @@
-import numpy as np
 from sklearn.metrics import get_scorer
 from skorch.callbacks import EpochTimer, BatchScoring, PrintLog, EpochScoring
 from skorch.classifier import NeuralNet
 from skorch.regressor import NeuralNetRegressor
 from skorch.utils import train_loss_score, valid_loss_score, noop
 
-from .training.scoring import PostEpochTrainScoring, CroppedTrialEpochScoring
-from .util import ThrowAwayIndexLoader, update_estimator_docstring
+from .models.modules import register_max_norm_hook
+from .training.scoring import (
+    CroppedTrialEpochScoring, PostEpochTrainScoring,
+    predict_with_window_inds_and_ys)
+from .training.distributed import (
+    average_buffers, average_gradients, broadcast_module,
+    gather_epoch_results, get_distributed_iterator, is_main_process)
+from .util import (
+    ThrowAwayIndexLoader, predict_recording, update_estimator_docstring)
 
 
 class EEGRegressor(NeuralNetRegressor):
@@ -37,14 +43,41 @@ class EEGRegressor(NeuralNetRegressor):
     iterator_train__shuffle: bool (default=True)
         Defines whether train dataset will be shuffled. As skorch does not
         shuffle the train dataset by default this one overwrites this option.
+        Ignored if ``iterator_train__sampler`` is given, as the sampler
+        defines the order of the train dataset.
+
+    distributed: bool (default=False)
+        Whether to train data-parallel in all processes of the default
+        ``torch.distributed`` process group, e.g. with the gloo backend. The
+        process group has to be initialized before calling fit. During fit,
+        each process only loads its own shard of the data, and gradients are
+        averaged over all processes after each backward pass. Losses and
+        scores are computed from the data of all processes. Only rank 0
+        prints the log and saves parameters. A sampler given as
+        ``iterator_train__sampler`` draws the order of the training data in
+        rank 0, which is split between all processes.
+
+    prefetch_batches: int (default=0)
+        Number of batches to prepare ahead on a background thread during fit
+        and predict. Prepared batches are cast to the expected dtypes and
+        moved to ``device``, with non-blocking copies from pinned memory for
+        cuda devices. With prefetching, the time spent waiting for each batch
+        is recorded in the batch history as ``train_data_wait`` and
+        ``valid_data_wait``. If 0, batches are prepared when they are needed.
 
     """
     __doc__ = update_estimator_docstring(NeuralNetRegressor, doc)
 
     def __init__(self, *args, cropped=False, callbacks=None,
-                 iterator_train__shuffle=True, **kwargs):
+                 iterator_train__shuffle=True, distributed=False,
+                 prefetch_batches=0, **kwargs):
         self.cropped = cropped
+        self.distributed = distributed
+        self.prefetch_batches = prefetch_batches
         callbacks = self._parse_callbacks(callbacks)
+        if kwargs.get('iterator_train__sampler') is not None:
+            # torch DataLoader does not accept a sampler together with shuffle
+            iterator_train__shuffle = False
 
         super().__init__(*args,
                          callbacks=callbacks,
@@ -119,14 +152,70 @@ class EEGRegressor(NeuralNetRegressor):
         """
         return NeuralNet.get_loss(self, y_pred, y_true, *args, **kwargs)
 
+    def initialize_optimizer(self, triggered_directly=True):
+        super().initialize_optimizer(triggered_directly=triggered_directly)
+        # max norm constraints registered with set_max_norm
+        register_max_norm_hook(self.module_, self.optimizer_)
+        return self
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        # copies of optimizers do not keep their hooks
+        if hasattr(self, 'optimizer_'):
+            register_max_norm_hook(self.module_, self.optimizer_)
+
     def get_iterator(self, dataset, training=False, drop_index=True):
-        iterator = super().get_iterator(dataset, training=training)
+        if self._is_fitting_distributed():
+            iterator = get_distributed_iterator(self, dataset, training)
+        else:
+            iterator = super().get_iterator(dataset, training=training)
         if drop_index:
-            return ThrowAwayIndexLoader(self, iterator, is_regression=True)
+            return ThrowAwayIndexLoader(
+                self, iterator, is_regression=True,
+                n_prefetch=self.prefetch_batches, device=self.device)
         else:
             return iterator
 
+    def _is_fitting_distributed(self):
+        return self.distributed and getattr(self, 'fitting_distributed_', False)
+
+    def on_train_begin(self, net, X=None, y=None, **kwargs):
+        super().on_train_begin(net, X=X, y=y, **kwargs)
+        if self.distributed:
+            # start from the same parameters in all processes
+            broadcast_module(self.module_)
+            self.fitting_distributed_ = True
+
+    def on_train_end(self, net, X=None, y=None, **kwargs):
+        super().on_train_end(net, X=X, y=y, **kwargs)
+        self.fitting_distributed_ = False
+
+    def on_grad_computed(self, net, named_parameters, **kwargs):
+        super().on_grad_computed(net, named_parameters, **kwargs)
+        if self.distributed:
+            average_gradients(self.module_.parameters())
+
+    def on_epoch_end(self, net, dataset_train=None, dataset_valid=None,
+                     **kwargs):
+        super().on_epoch_end(net, dataset_train=dataset_train,
+                             dataset_valid=dataset_valid, **kwargs)
+        if self.distributed:
+            # runs before all callbacks, so they see results of all ranks
+            average_buffers(self.module_)
+            gather_epoch_results(self)
+
+    def save_params(self, *args, **kwargs):
+        # parameters are the same in all processes, only rank 0 saves them
+        if self.distributed and not is_main_process():
+            return
+        super().save_params(*args, **kwargs)
+
     def on_batch_end(self, net, X, y, training=False, **kwargs):
+        if hasattr(self, '_last_data_wait'):
+            prefix = 'train' if training else 'valid'
+            self.history.record_batch(
+                prefix + '_data_wait', self._last_data_wait)
+            del self._last_data_wait
         # If training is false, assume that our loader has indices for this
         # batch
         if not training:
@@ -144,23 +233,50 @@ class EEGRegressor(NeuralNetRegressor):
                     cb.window_inds_.append(self._last_window_inds)
                 del self._last_window_inds
 
-    def predict_with_window_inds_and_ys(self, dataset):
-        preds = []
-        i_window_in_trials = []
-        i_window_stops = []
-        window_ys = []
-        for X, y, i in self.get_iterator(dataset, drop_index=False):
-            i_window_in_trials.append(i[0].cpu().numpy())
-            i_window_stops.append(i[2].cpu().numpy())
-            preds.append(self.predict_proba(X))
-            window_ys.append(y.cpu().numpy())
-        preds = np.concatenate(preds)
-        i_window_in_trials = np.concatenate(i_window_in_trials)
-        i_window_stops = np.concatenate(i_window_stops)
-        window_ys = np.concatenate(window_ys)
-        return dict(
-            preds=preds, i_window_in_trials=i_window_in_trials,
-            i_window_stops=i_window_stops, window_ys=window_ys)
+    def predict_with_window_inds_and_ys(self, dataset, dtype='float32'):
+        """Predict all windows of a dataset in a single pass without
+        gradients and return the predictions together with the window
+        indices and targets.
+
+        Parameters
+        ----------
+        dataset: torch.utils.data.Dataset
+            dataset returning windows, targets and window indices
+        dtype: str | numpy.dtype
+            dtype of the predictions, e.g. 'float16' to halve their memory
+
+        Returns
+        -------
+        results: dict
+            predictions, indices of the windows in their trials, stops of
+            the windows in their trials and targets of the windows
+        """
+        return predict_with_window_inds_and_ys(self, dataset, dtype=dtype)
+
+    def predict_recording(self, X, chunk_size_samples=10000):
+        """Predict every sample of a continuous recording with a dense
+        prediction model.
+
+        The recording is streamed through the module in chunks of
+        ``chunk_size_samples`` that overlap by the receptive field of the
+        module, so memory stays bounded by the chunk size. Returns the raw
+        outputs of the module, without the predict nonlinearity.
+
+        Parameters
+        ----------
+        X: mne.io.Raw | BaseDataset | ndarray
+            continuous signal, channels x time for arrays
+        chunk_size_samples: int
+            number of samples fed through the module at once
+
+        Returns
+        -------
+        trace: ndarray
+            outputs x time, NaN before the receptive field is filled
+        """
+        self.check_is_fitted()
+        return predict_recording(
+            self.module_, X, chunk_size_samples, device=self.device)
 
     # Removes default EpochScoring callback computing 'accuracy' to work properly
     # with cropped decoding.
@@ -183,5 +299,7 @@ class EEGRegressor(NeuralNetRegressor):
                     valid_loss_score, name="valid_loss", target_extractor=noop,
                 ),
             ),
-            ("print_log", PrintLog()),
+            ("print_log", PrintLog(
+                sink=noop if self.distributed and not is_main_process()
+                else print)),
         ]
@@ -5,4 +5,6 @@ Functionality for skorch-based training.
 
 from .losses import CroppedLoss
 from .scoring import (CroppedTrialEpochScoring, PostEpochTrainScoring,
-                      trial_preds_from_window_preds,)
\ No newline at end of file
+                      RecordingEpochScoring, trial_preds_from_window_preds,
+                      trial_mean_preds_from_window_preds,
+                      recording_preds_from_window_preds,)
\ No newline at end of file
@@ -1,21 +1,21 @@
 from skorch.callbacks import ProgressBar, Callback
-import torch
+
+from ..models.modules import _renorm
 
 
 class MaxNormConstraintCallback(Callback):
+    """Constrain the weights of all children of the module with a weight
+    (except batch norms) to a maximum norm of 2, and the weights of the last
+    of them to a maximum norm of 0.5, as for Deep4Net.
+
+    The constraints are applied after every training batch, in a single
+    pass, without registering them on the module.
+    """
     def on_batch_end(self, net, training, *args, **kwargs):
         if training:
-            model = net.module_
-            last_weight = None
-            for name, module in list(model.named_children()):
+            weights = [
+                module.weight for name, module in net.module_.named_children()
                 if hasattr(module, "weight") and (
-                    not module.__class__.__name__.startswith("BatchNorm")
-                ):
-                    module.weight.data = torch.renorm(
-                        module.weight.data, 2, 0, maxnorm=2
-                    )
-                    last_weight = module.weight
-            if last_weight is not None:
-                last_weight.data = torch.renorm(
-                    last_weight.data, 2, 0, maxnorm=0.5
-                )
+                    not module.__class__.__name__.startswith("BatchNorm"))]
+            _renorm([(weight, 0.5 if i_weight == len(weights) - 1 else 2)
+                     for i_weight, weight in enumerate(weights)])
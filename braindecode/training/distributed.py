@@ -0,0 +1,276 @@
+"""
+Helpers for data-parallel training with torch.distributed.
+"""
+
+# License: BSD-3
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import DistributedSampler, Sampler, Subset
+from skorch.callbacks import EpochScoring
+
+from ..datasets.base import BaseConcatDataset
+from ..datautil.samplers import DistributedRecordingSampler
+
+
+def is_main_process():
+    """Whether this is the process that logs and saves, i.e., rank 0 of a
+    distributed training or the only process otherwise.
+
+    Returns
+    -------
+    is_main: bool
+    """
+    return (not dist.is_available() or not dist.is_initialized() or
+            dist.get_rank() == 0)
+
+
+def broadcast_module(module, src=0):
+    """Copy parameters and buffers of a module from one rank to all others.
+
+    Parameters
+    ----------
+    module: torch.nn.Module
+    src: int
+        rank to copy from
+    """
+    with torch.no_grad():
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            dist.broadcast(tensor.data, src=src)
+
+
+def average_gradients(parameters):
+    """Average the gradients of the parameters over all ranks, with one
+    all-reduce of the flattened gradients.
+
+    Parameters
+    ----------
+    parameters: iterable of torch.nn.Parameter
+    """
+    grads = [p.grad for p in parameters if p.grad is not None]
+    if len(grads) == 0:
+        return
+    flat_grads = torch.cat([g.reshape(-1) for g in grads])
+    dist.all_reduce(flat_grads)
+    flat_grads /= dist.get_world_size()
+    i_start = 0
+    for g in grads:
+        g.copy_(flat_grads[i_start:i_start + g.numel()].view_as(g))
+        i_start += g.numel()
+
+
+def average_buffers(module):
+    """Average floating point buffers of a module, e.g. running statistics of
+    batch norm layers, over all ranks.
+
+    Parameters
+    ----------
+    module: torch.nn.Module
+    """
+    with torch.no_grad():
+        for buffer in module.buffers():
+            if torch.is_floating_point(buffer):
+                dist.all_reduce(buffer.data)
+                buffer.data /= dist.get_world_size()
+
+
+def all_gather_list(items):
+    """Concatenate lists from all ranks, in order of the ranks.
+
+    Parameters
+    ----------
+    items: list
+        picklable items of this rank, tensors are moved to the cpu
+
+    Returns
+    -------
+    all_items: list
+        items of all ranks
+    """
+    items = [_to_cpu(item) for item in items]
+    gathered = [None] * dist.get_world_size()
+    dist.all_gather_object(gathered, items)
+    return [item for rank_items in gathered for item in rank_items]
+
+
+def _to_cpu(item):
+    if isinstance(item, torch.Tensor):
+        return item.detach().cpu()
+    if isinstance(item, (list, tuple)):
+        return type(item)([_to_cpu(i) for i in item])
+    return item
+
+
+def gather_epoch_results(net):
+    """Gather the batch records of the current epoch and the predictions
+    cached by scoring callbacks from all ranks.
+
+    Afterwards, the batches in the history of every rank hold the batches of
+    all ranks, so epoch losses are averaged over all ranks, and scoring
+    callbacks score the predictions of all ranks.
+
+    Parameters
+    ----------
+    net: skorch.NeuralNet
+        net that is trained in distributed mode
+    """
+    net.history[-1]['batches'] = all_gather_list(net.history[-1]['batches'])
+    for _, cb in net.callbacks_:
+        # cropped scoring callbacks accumulate or predict trials on their
+        # own and gather them themselves
+        if (not isinstance(cb, EpochScoring) or not cb.use_caching or
+                cb.__class__.__name__ == 'CroppedTrialEpochScoring'):
+            continue
+        cb.y_preds_ = all_gather_list(cb.y_preds_)
+        cb.y_trues_ = all_gather_list(cb.y_trues_)
+
+
+def get_distributed_iterator(net, dataset, training):
+    """Get a data loader for the shard of the dataset of this rank.
+
+    With a BaseConcatDataset, every rank gets whole recordings. During
+    training, the shards are padded to the same length and shuffled in
+    every epoch. During evaluation, every window is in exactly one shard and
+    all windows of a trial are in the same shard.
+
+    A sampler given for training draws the order of the windows on rank 0,
+    which is split between the ranks. Samplers for evaluation are not
+    supported.
+
+    Parameters
+    ----------
+    net: skorch.NeuralNet
+        net that is trained in distributed mode
+    dataset: torch.utils.data.Dataset
+        dataset to split
+    training: bool
+        whether to get the loader for training or evaluation
+
+    Returns
+    -------
+    iterator: torch.utils.data.DataLoader
+    """
+    if training:
+        kwargs = net.get_params_for('iterator_train')
+        iterator = net.iterator_train
+    else:
+        kwargs = net.get_params_for('iterator_valid')
+        iterator = net.iterator_valid
+    if 'batch_size' not in kwargs:
+        kwargs['batch_size'] = net.batch_size
+    if kwargs['batch_size'] == -1:
+        kwargs['batch_size'] = len(dataset)
+
+    epoch = len(net.history)
+    # the samplers define the order
+    kwargs.pop('shuffle', None)
+    sampler = kwargs.get('sampler')
+    if sampler is not None:
+        if not training:
+            raise ValueError(
+                'A sampler for evaluation is not supported in distributed '
+                'mode, as predictions of all ranks are gathered in a fixed '
+                'order.')
+        kwargs['sampler'] = sampler = _RankShardSampler(sampler)
+    else:
+        if _shard_by_recordings(dataset):
+            sampler = DistributedRecordingSampler(
+                dataset, shuffle=training, pad=training)
+        elif training:
+            sampler = DistributedSampler(dataset, shuffle=True)
+        else:
+            # contiguous shards split between trials, to keep windows of a
+            # trial together
+            sampler = _split_between_trials(
+                _get_trial_ids(dataset), len(dataset),
+                dist.get_world_size())[dist.get_rank()].tolist()
+        kwargs['sampler'] = sampler
+    if hasattr(sampler, 'set_epoch'):
+        sampler.set_epoch(epoch)
+    return iterator(dataset, **kwargs)
+
+
+class _RankShardSampler(Sampler):
+    """Shard of the indices drawn by a sampler on rank 0, which is the same
+    in all ranks. The indices are padded by repeating them such that all
+    ranks draw the same number of indices.
+    """
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    def set_epoch(self, epoch):
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        n_ranks = dist.get_world_size()
+        inds = [list(self.sampler) if dist.get_rank() == 0 else None]
+        dist.broadcast_object_list(inds, src=0)
+        inds = inds[0]
+        if len(inds) % n_ranks != 0:
+            inds = np.resize(inds, len(self) * n_ranks).tolist()
+        yield from inds[dist.get_rank()::n_ranks]
+
+    def __len__(self):
+        return -(-len(self.sampler) // dist.get_world_size())
+
+
+def get_evaluation_order(dataset):
+    """Get the order in which the predictions of all ranks are gathered
+    after distributed evaluation of a dataset without a custom sampler.
+
+    Parameters
+    ----------
+    dataset: torch.utils.data.Dataset
+        evaluated dataset
+
+    Returns
+    -------
+    inds: np.ndarray
+        index of every gathered prediction in the dataset
+    """
+    if not _shard_by_recordings(dataset):
+        # contiguous shards in order of the ranks
+        return np.arange(len(dataset))
+    n_ranks = dist.get_world_size()
+    return np.concatenate([DistributedRecordingSampler(
+        dataset, num_replicas=n_ranks, rank=rank, shuffle=False,
+        pad=False).inds for rank in range(n_ranks)])
+
+
+def _shard_by_recordings(dataset):
+    return isinstance(dataset, BaseConcatDataset) and (
+        len(dataset.datasets) >= dist.get_world_size())
+
+
+def _get_trial_ids(dataset):
+    """Get the running trial index of every window of a dataset, or None if
+    the dataset has no window index.
+    """
+    if isinstance(dataset, Subset):
+        trial_ids = _get_trial_ids(dataset.dataset)
+        return None if trial_ids is None else trial_ids[dataset.indices]
+    if isinstance(dataset, BaseConcatDataset) and all(
+            hasattr(ds, 'window_table') for ds in dataset.datasets):
+        return dataset.window_index['i_trial'].to_numpy()
+    return None
+
+
+def _split_between_trials(trial_ids, n_inds, n_splits):
+    """Split the indices of a dataset into contiguous splits of about equal
+    size, moving every split point to the closest start of a trial. Splits
+    can be empty if there are fewer trials than splits.
+    """
+    inds = np.arange(n_inds)
+    if trial_ids is None:
+        return np.array_split(inds, n_splits)
+    trial_starts = np.flatnonzero(np.diff(trial_ids, prepend=np.nan) != 0)
+    trial_starts = np.append(trial_starts, n_inds)
+    split_points = np.arange(1, n_splits) * n_inds / n_splits
+    i_after = np.searchsorted(trial_starts, split_points)
+    i_before = np.maximum(i_after - 1, 0)
+    closest = np.where(
+        split_points - trial_starts[i_before] <=
+        trial_starts[i_after] - split_points, i_before, i_after)
+    return np.split(inds, trial_starts[closest])
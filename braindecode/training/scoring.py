@@ -4,13 +4,20 @@
 #
 # License: BSD-3
 
+import hashlib
+import numbers
 from contextlib import contextmanager
 
 import numpy as np
 import torch
+from sklearn.utils import check_random_state
 from skorch.callbacks.scoring import EpochScoring
 from skorch.utils import to_numpy
 from skorch.dataset import unpack_data
+from torch.utils.data import Subset
+from torch.utils.data.dataloader import default_collate
+
+from .distributed import all_gather_list, get_evaluation_order
 
 
 def trial_preds_from_window_preds(
@@ -21,9 +28,11 @@ def trial_preds_from_window_preds(
 
     Parameters
     ----------
-    preds: list of ndarrays (atleast 2darrays)
-        List of window predictions, in each window prediction
-         time is in axis=1
+    preds: ndarray | list of ndarrays
+        window predictions, windows x classes x time, or list of window
+        predictions with time in axis=1, e.g. classes x time. Lists of
+        predictions of different lengths, e.g. of whole trials, are split
+        window by window, all other inputs at once.
     i_window_in_trials: list
         Index/number of window in trial
     i_stop_in_trials: list
@@ -35,49 +44,326 @@ def trial_preds_from_window_preds(
         Predictions in each trial, duplicates removed
 
     """
+    if not isinstance(preds, np.ndarray):
+        if len({np.shape(p) for p in preds}) > 1:
+            return _trial_preds_from_ragged_window_preds(
+                preds, i_window_in_trials, i_stop_in_trials)
+        preds = np.asarray(preds)
+    assert len(preds) == len(i_window_in_trials)
+    assert len(i_window_in_trials) == len(i_stop_in_trials)
+    new_trial, keep_mask = _get_new_preds_mask(
+        preds.shape[2], i_window_in_trials, i_stop_in_trials)
+    trial_starts = np.flatnonzero(new_trial)
+    # windows x time x classes, to select the kept time steps of all windows
+    # at once, in order of the windows
+    kept_preds = np.moveaxis(preds, 2, 1)[keep_mask]
+    n_kept_per_trial = np.add.reduceat(keep_mask.sum(axis=1), trial_starts)
+    return [np.moveaxis(trial_preds, 0, 1) for trial_preds in np.split(
+        kept_preds, np.cumsum(n_kept_per_trial)[:-1])]
+
+
+def _trial_preds_from_ragged_window_preds(
+        preds, i_window_in_trials, i_stop_in_trials):
+    """Assign window predictions of different lengths to trials, one window
+    after the other."""
     assert len(preds) == len(i_window_in_trials)
     assert len(i_window_in_trials) == len(i_stop_in_trials)
-
-    # Algorithm for assigning window predictions to trials
-    # while removing duplicate predictions:
-    # Loop through windows:
-    # In each iteration you have predictions (assumed: #classes x #timesteps,
-    # or at least #timesteps must be in axis=1)
-    # and you have i_window_in_trial, i_stop_in_trial
-    # (i_trial removed from variable names for brevity)
-    # You first check if the i_window_in_trial is 1 larger
-    # than in last iteration, then you are still in the same trial
-    # Otherwise you are in a new trial
-    # If you are in the same trial, you check for duplicate predictions
-    # Only take predictions that are after (inclusive)
-    # the stop of the last iteration (i.e., the index of final prediction
-    # in the last iteration)
-    # Then add the duplicate-removed predictions from this window
-    # to predictions for current trial
     preds_per_trial = []
-    cur_trial_preds = []
-    i_last_stop = None
-    i_last_window = -1
+    i_last_window, i_last_stop = -1, None
     for window_preds, i_window, i_stop in zip(
             preds, i_window_in_trials, i_stop_in_trials):
-        window_preds = np.array(window_preds)
-        if i_window != (i_last_window + 1):
+        window_preds = np.asarray(window_preds)
+        if i_window != i_last_window + 1:
             assert i_window == 0, (
                 "window numbers in new trial should start from 0")
-            preds_per_trial.append(np.concatenate(cur_trial_preds, axis=1))
-            cur_trial_preds = []
             i_last_stop = None
+        if i_last_stop is None:
+            preds_per_trial.append([window_preds])
+        else:
+            # only predictions after the stop of the previous window are new
+            n_preds = window_preds.shape[1]
+            n_new_preds = min(i_stop - i_last_stop, n_preds)
+            preds_per_trial[-1].append(
+                window_preds[:, n_preds - n_new_preds:])
+        i_last_window, i_last_stop = i_window, i_stop
+    return [np.concatenate(trial_preds, axis=1)
+            for trial_preds in preds_per_trial]
+
+
+def trial_mean_preds_from_window_preds(
+        preds, i_window_in_trials, i_stop_in_trials):
+    """Average the predictions of each trial over time, without duplicate
+    predictions of overlapping windows.
+
+    Same as averaging the outputs of `trial_preds_from_window_preds` over
+    time, but without splitting the predictions into trials.
+
+    Parameters
+    ----------
+    preds: ndarray
+        window predictions, windows x classes x time
+    i_window_in_trials: list
+        Index/number of window in trial
+    i_stop_in_trials: list
+        stop position of window in trial
+
+    Returns
+    -------
+    mean_preds_per_trial: ndarray
+        mean prediction of each trial, trials x classes
+    """
+    accumulator = _TrialPredsAccumulator()
+    accumulator.add(preds, i_window_in_trials, i_stop_in_trials)
+    return accumulator.get_mean_preds()
+
+
+def recording_preds_from_window_preds(
+        preds, cumulative_sizes, aggregation='mean'):
+    """Aggregate window predictions into one prediction per recording.
+
+    The windows have to be in order of the recordings, as in a
+    BaseConcatDataset. All recordings are aggregated at once, without a loop
+    over recordings or windows.
 
-        if i_last_stop is not None:
-            # Remove duplicates
-            n_needed_preds = i_stop - i_last_stop
-            window_preds = window_preds[:, -n_needed_preds:]
-        cur_trial_preds.append(window_preds)
-        i_last_window = i_window
-        i_last_stop = i_stop
-    # add last trial preds
-    preds_per_trial.append(np.concatenate(cur_trial_preds, axis=1))
-    return preds_per_trial
+    Parameters
+    ----------
+    preds: ndarray
+        window predictions, windows x classes, or windows for regression.
+        Further axes, e.g. time of cropped predictions, are averaged.
+    cumulative_sizes: list of int
+        cumulative number of windows of the recordings, e.g.
+        `cumulative_sizes` of a BaseConcatDataset
+    aggregation: str
+        'mean' or 'median' of the window predictions, or 'vote' for the
+        fraction of windows predicting each class
+
+    Returns
+    -------
+    recording_preds: ndarray
+        recordings x classes, or recordings for regression. NaN for
+        recordings without windows.
+    """
+    preds = np.asarray(preds)
+    if preds.ndim > 2:
+        preds = preds.mean(axis=tuple(range(2, preds.ndim)))
+    cumulative_sizes = np.asarray(cumulative_sizes)
+    n_windows = np.diff(cumulative_sizes, prepend=0)
+    if len(preds) != (cumulative_sizes[-1] if len(n_windows) > 0 else 0):
+        raise ValueError(
+            f'Expected {cumulative_sizes[-1]} window predictions, got '
+            f'{len(preds)}.')
+    starts = cumulative_sizes - n_windows
+    has_windows = n_windows > 0
+    starts, counts = starts[has_windows], n_windows[has_windows]
+    if aggregation == 'mean':
+        dtype = np.result_type(preds.dtype, np.float32)
+        aggregated = np.add.reduceat(
+            preds.astype(dtype, copy=False), starts, axis=0) / (
+            counts.reshape((-1,) + (1,) * (preds.ndim - 1)))
+    elif aggregation == 'median':
+        # sort the predictions within every recording, then take the middle
+        # one or two of every recording
+        i_recordings = np.repeat(np.arange(len(counts)), counts)
+        sorted_preds = np.empty(preds.shape, dtype=preds.dtype)
+        for i_class in np.ndindex(preds.shape[1:]):
+            class_preds = preds[(slice(None),) + i_class]
+            order = np.lexsort((class_preds, i_recordings))
+            sorted_preds[(slice(None),) + i_class] = class_preds[order]
+        aggregated = (sorted_preds[starts + (counts - 1) // 2] +
+                      sorted_preds[starts + counts // 2]) / 2
+    elif aggregation == 'vote':
+        if preds.ndim != 2:
+            raise ValueError('Voting needs predictions for every class.')
+        n_classes = preds.shape[1]
+        i_recordings = np.repeat(np.arange(len(counts)), counts)
+        votes = np.bincount(
+            i_recordings * n_classes + preds.argmax(axis=1),
+            minlength=len(counts) * n_classes)
+        aggregated = votes.reshape(-1, n_classes) / counts[:, None]
+    else:
+        raise ValueError(
+            f"Unknown aggregation {aggregation}, expected 'mean', 'median' "
+            f"or 'vote'.")
+    recording_preds = np.full(
+        (len(n_windows),) + aggregated.shape[1:], np.nan,
+        dtype=aggregated.dtype)
+    recording_preds[has_windows] = aggregated
+    return recording_preds
+
+
+def predict_with_window_inds_and_ys(net, dataset, dtype='float32'):
+    """Predict all windows of a dataset in a single pass without gradients
+    and return the predictions together with the window indices and targets.
+
+    Predictions are written directly into a preallocated array. Without
+    windows to predict, e.g. for an empty shard of a distributed net, empty
+    arrays shaped like the predictions and targets of the first window of
+    the dataset are returned.
+
+    Parameters
+    ----------
+    net: EEGClassifier | EEGRegressor
+        fitted net
+    dataset: torch.utils.data.Dataset
+        dataset returning windows, targets and window indices
+    dtype: str | numpy.dtype
+        dtype of the predictions, e.g. 'float16' to halve their memory
+
+    Returns
+    -------
+    results: dict
+        predictions, indices of the windows in their trials, stops of
+        the windows in their trials and targets of the windows
+    """
+    net.check_is_fitted()
+    nonlin = net._get_predict_nonlinearity()
+
+    def predict(X):
+        y_pred = net.infer(X)
+        y_pred = y_pred[0] if isinstance(y_pred, tuple) else y_pred
+        return nonlin(y_pred).cpu().numpy()
+
+    iterator = net.get_iterator(dataset, drop_index=False)
+    n_windows = len(iterator.sampler)
+    preds = None
+    i_window_in_trials = np.empty(n_windows, dtype=np.int64)
+    i_window_stops = np.empty(n_windows, dtype=np.int64)
+    window_ys = None
+    i_start = 0
+    net.module_.eval()
+    with torch.no_grad():
+        for X, y, i in iterator:
+            y_pred = predict(X)
+            if preds is None:
+                preds = np.empty((n_windows,) + y_pred.shape[1:], dtype=dtype)
+                window_ys = np.empty((n_windows,) + tuple(y.shape[1:]),
+                                     dtype=y.numpy().dtype)
+            i_stop = i_start + len(y_pred)
+            preds[i_start:i_stop] = y_pred
+            i_window_in_trials[i_start:i_stop] = i[0].numpy()
+            i_window_stops[i_start:i_stop] = i[2].numpy()
+            window_ys[i_start:i_stop] = y.numpy()
+            i_start = i_stop
+        if preds is None:
+            if len(dataset) > 0:
+                X, y, _ = default_collate([dataset[0]])
+                preds = np.empty((0,) + predict(X).shape[1:], dtype=dtype)
+                window_ys = np.empty((0,) + tuple(y.shape[1:]),
+                                     dtype=y.numpy().dtype)
+            else:
+                preds = np.empty(0, dtype=dtype)
+                window_ys = np.empty(0, dtype=np.int64)
+    # fewer windows if the loader drops the last batch
+    preds, i_window_in_trials, i_window_stops, window_ys = [
+        a[:i_start] for a in (
+            preds, i_window_in_trials, i_window_stops, window_ys)]
+    if net._is_fitting_distributed():
+        # every rank predicted its own shard of the dataset
+        preds, i_window_in_trials, i_window_stops, window_ys = [
+            np.concatenate(all_gather_list([a])) for a in (
+                preds, i_window_in_trials, i_window_stops, window_ys)]
+    return dict(
+        preds=preds, i_window_in_trials=i_window_in_trials,
+        i_window_stops=i_window_stops, window_ys=window_ys)
+
+
+def _get_new_preds_mask(n_preds_per_window, i_window_in_trials,
+                        i_stop_in_trials, last_window=None):
+    """Find the windows that start a trial and mask the time steps of every
+    window that were not already predicted by the previous window.
+
+    A new trial starts when the index of the window in the trial does not
+    increment by 1. Of the following windows of a trial, only predictions
+    after (inclusive) the stop of the previous window are new. The window
+    before the first one can be given as tuple of its index in the trial
+    and its stop.
+    """
+    i_window_in_trials = np.asarray(i_window_in_trials)
+    i_stop_in_trials = np.asarray(i_stop_in_trials)
+    new_trial = np.ones(len(i_window_in_trials), dtype=bool)
+    new_trial[1:] = i_window_in_trials[1:] != i_window_in_trials[:-1] + 1
+    i_previous_stops = np.roll(i_stop_in_trials, 1)
+    if last_window is not None:
+        new_trial[0] = i_window_in_trials[0] != last_window[0] + 1
+        i_previous_stops[0] = last_window[1]
+    assert np.all(i_window_in_trials[new_trial] == 0), (
+        "window numbers in new trial should start from 0")
+    n_new_preds = np.where(
+        new_trial, n_preds_per_window,
+        np.minimum(i_stop_in_trials - i_previous_stops, n_preds_per_window))
+    keep_mask = np.arange(n_preds_per_window) >= (
+        n_preds_per_window - n_new_preds[:, None])
+    return new_trial, keep_mask
+
+
+class _TrialPredsAccumulator(object):
+    """Running sums and counts of the new predictions of every trial, for
+    windows that arrive in batches, in order of the trials.
+
+    Only trials x classes sums are kept, so memory does not grow with the
+    number of windows or predicted time steps.
+    """
+    def __init__(self):
+        self.sums = []
+        self.counts = []
+        self.ys = []
+        self.last_window = None
+
+    def add(self, preds, i_window_in_trials, i_stop_in_trials, window_ys=None):
+        preds = np.asarray(preds)
+        assert len(preds) == len(i_window_in_trials)
+        assert len(i_window_in_trials) == len(i_stop_in_trials)
+        if len(preds) == 0:
+            return
+        # the last window of the previous batch may continue into this one
+        new_trial, keep_mask = _get_new_preds_mask(
+            preds.shape[2], i_window_in_trials, i_stop_in_trials,
+            last_window=self.last_window)
+        self.last_window = (i_window_in_trials[-1], i_stop_in_trials[-1])
+
+        # accumulate at least in float32, e.g. for float16 predictions
+        dtype = np.result_type(preds.dtype, np.float32)
+        window_sums = np.einsum(
+            'nct...,nt->nc...', preds.astype(dtype, copy=False),
+            keep_mask.astype(dtype))
+        window_counts = keep_mask.sum(axis=1)
+        trial_starts = np.flatnonzero(new_trial)
+        n_continued = trial_starts[0] if len(trial_starts) > 0 else len(preds)
+        if n_continued > 0:
+            # first windows belong to the last trial of the previous batch
+            self.sums[-1][-1] += window_sums[:n_continued].sum(axis=0)
+            self.counts[-1][-1] += window_counts[:n_continued].sum()
+        if len(trial_starts) > 0:
+            self.sums.append(np.add.reduceat(
+                window_sums[n_continued:], trial_starts - n_continued, axis=0))
+            self.counts.append(np.add.reduceat(
+                window_counts[n_continued:], trial_starts - n_continued))
+            if window_ys is not None:
+                self.ys.append(np.asarray(window_ys)[trial_starts])
+
+    def gather(self):
+        """Collect the trials of all ranks of a distributed training."""
+        self.sums = all_gather_list(self.sums)
+        self.counts = all_gather_list(self.counts)
+        self.ys = all_gather_list(self.ys)
+        self.last_window = None
+
+    def get_mean_preds(self):
+        sums = np.concatenate(self.sums)
+        counts = np.concatenate(self.counts)
+        return sums / counts.reshape((-1,) + (1,) * (sums.ndim - 1)).astype(
+            sums.dtype)
+
+    def get_ys(self):
+        return np.concatenate(self.ys)
+
+
+def _hash_inds(inds):
+    """Hash indices of samples to record which samples were scored."""
+    if inds is None:
+        return None
+    return hashlib.sha1(
+        np.ascontiguousarray(inds, dtype=np.int64).tobytes()).hexdigest()
 
 
 @contextmanager
@@ -132,7 +418,7 @@ class CroppedTrialEpochScoring(EpochScoring):
         )
         if not self.on_train:
             self.window_inds_ = []
-
+            self.trial_accumulator_ = _TrialPredsAccumulator()
 
     def _initialize_cache(self):
         super()._initialize_cache()
@@ -141,44 +427,51 @@ class CroppedTrialEpochScoring(EpochScoring):
         self.y_preds_ = []
         if not self.on_train:
             self.window_inds_ = []
+            self.trial_accumulator_ = _TrialPredsAccumulator()
+
+    def on_batch_end(self, net, y, y_pred, training, **kwargs):
+        if self.on_train:
+            # predictions on the training set are recomputed at epoch end
+            return
+        super().on_batch_end(net, y=y, y_pred=y_pred, training=training,
+                             **kwargs)
+        self._accumulate_cached_batches()
+
+    def _accumulate_cached_batches(self):
+        # fold the cached batches into the per-trial sums and drop them
+        n_batches = min(len(self.y_preds_), len(self.y_trues_),
+                        len(self.window_inds_))
+        for y_pred, y, window_inds in zip(
+                self.y_preds_, self.y_trues_, self.window_inds_):
+            self.trial_accumulator_.add(
+                to_numpy(y_pred), to_numpy(window_inds[0]),
+                to_numpy(window_inds[2]), to_numpy(y))
+        self.y_preds_ = self.y_preds_[n_batches:]
+        self.y_trues_ = self.y_trues_[n_batches:]
+        self.window_inds_ = self.window_inds_[n_batches:]
 
     def on_epoch_end(self, net, dataset_train, dataset_valid, **kwargs):
         assert self.use_caching == True
         if not self.crops_to_trials_computed:
             if self.on_train:
-                pred_results = net.predict_with_window_inds_and_ys(
-                    dataset_train)
-
+                pred_results = predict_with_window_inds_and_ys(
+                    net, dataset_train)
+                accumulator = _TrialPredsAccumulator()
+                accumulator.add(
+                    pred_results['preds'],
+                    pred_results['i_window_in_trials'],
+                    pred_results['i_window_stops'],
+                    pred_results['window_ys'])
             else:
-                pred_results = {}
-                pred_results['i_window_in_trials'] = np.concatenate(
-                    [i[0].cpu().numpy() for i in self.window_inds_]
-                )
-                pred_results['i_window_stops'] = np.concatenate(
-                    [i[2].cpu().numpy() for i in self.window_inds_]
-                )
-                pred_results['preds'] = np.concatenate(
-                    [y_pred.cpu().numpy() for y_pred in self.y_preds_])
-                pred_results['window_ys'] = np.concatenate(
-                    [y.cpu().numpy() for y in self.y_trues_])
-
-
-            # A new trial starts
-            # when the index of the window in trials
-            # does not increment by 1
-            # Add dummy infinity at start
-            window_0_per_trial_mask = np.diff(
-                pred_results['i_window_in_trials'], prepend=[np.inf]) != 1
-            trial_ys = pred_results['window_ys'][window_0_per_trial_mask]
-            trial_preds = trial_preds_from_window_preds(
-                pred_results['preds'],
-                pred_results['i_window_in_trials'],
-                pred_results['i_window_stops'])
-            # trial preds is a list
-            # each item is an 2darray classes x time
-            y_preds_per_trial = np.array(
-                [np.mean(p, axis=1) for p in trial_preds]
-            )
+                self._accumulate_cached_batches()
+                accumulator = self.trial_accumulator_
+                if getattr(net, 'distributed', False):
+                    # every rank accumulated the trials of its own shard
+                    accumulator.gather()
+
+            # trials x classes
+            y_preds_per_trial = accumulator.get_mean_preds()
+            trial_ys = accumulator.get_ys()
             # Move into format expected by skorch (list of torch tensors)
             y_preds_per_trial = [torch.tensor(y_preds_per_trial)]
 
@@ -211,6 +504,13 @@ class PostEpochTrainScoring(EpochScoring):
     Epoch Scoring class that recomputes predictions after the epoch
     on the training in validation mode.
 
+    To make scoring cheaper, predictions can be recomputed on a random subset
+    of the training set only, which is chosen once and then reused in every
+    epoch, and only every few epochs. When scoring on a subset, the number
+    of scored samples is recorded in the history as ``<name>_n_samples`` and
+    a hash of their indices as ``<name>_subset_hash`` (None if all samples
+    are scored), to tell which subset scores were computed on.
+
     Note: For unknown reasons, this affects global random generator and
     therefore all results may change slightly if you add this scoring callback.
 
@@ -229,6 +529,22 @@ class PostEpochTrainScoring(EpochScoring):
       ``scoring`` argument.
     target_extractor : callable (default=to_numpy)
       This is called on y before it is passed to scoring.
+    subset_size : None, int or float (default=None)
+      If int, number of training samples to score on. If float, fraction of
+      the training samples to score on. If None, score on all training
+      samples.
+    every_n_epochs : int (default=1)
+      Only score in epochs that are a multiple of ``every_n_epochs``.
+      Nothing is recorded in the other epochs.
+    random_state : None, int or np.random.RandomState (default=None)
+      Random state to choose the subset. In distributed training, the subset
+      of rank 0 is used by all ranks.
+
+    Attributes
+    ----------
+    subset_inds_ : ndarray or None
+      Sorted indices of the scored training samples, None if all samples
+      are scored.
     """
 
     def __init__(
@@ -237,6 +553,9 @@ class PostEpochTrainScoring(EpochScoring):
         lower_is_better=True,
         name=None,
         target_extractor=to_numpy,
+        subset_size=None,
+        every_n_epochs=1,
+        random_state=None,
     ):
         super().__init__(
             scoring=scoring,
@@ -246,10 +565,49 @@ class PostEpochTrainScoring(EpochScoring):
             target_extractor=target_extractor,
             use_caching=False,
         )
+        self.subset_size = subset_size
+        self.every_n_epochs = every_n_epochs
+        self.random_state = random_state
+
+    def initialize(self):
+        super().initialize()
+        self.subset_inds_ = None
+        return self
+
+    def _choose_subset(self, net, n_samples):
+        if isinstance(self.subset_size, float):
+            n_subset = int(round(self.subset_size * n_samples))
+        else:
+            n_subset = self.subset_size
+        if n_subset >= n_samples:
+            return None
+        inds = np.sort(check_random_state(self.random_state).choice(
+            n_samples, size=n_subset, replace=False))
+        if getattr(net, 'distributed', False):
+            # all ranks have to score the same samples
+            inds = all_gather_list([inds])[0]
+        return inds
+
+    def _shares_predictions_with(self, cb):
+        if cb is self:
+            return True
+        if (self.subset_size != cb.subset_size or
+                self.every_n_epochs != cb.every_n_epochs):
+            return False
+        # random subsets are only the same if chosen with the same seed
+        return self.subset_size is None or (
+            isinstance(self.random_state, numbers.Integral) and
+            self.random_state == cb.random_state)
 
     def on_epoch_end(self, net, dataset_train, dataset_valid, **kwargs):
+        if len(net.history) % self.every_n_epochs != 0:
+            return
         if len(self.y_preds_) == 0:
             dataset = net.get_dataset(dataset_train)
+            if self.subset_size is not None and self.subset_inds_ is None:
+                self.subset_inds_ = self._choose_subset(net, len(dataset))
+            if self.subset_inds_ is not None:
+                dataset = Subset(dataset, self.subset_inds_)
             iterator = net.get_iterator(dataset, training=False)
             y_preds = []
             y_test = []
@@ -260,19 +618,27 @@ class PostEpochTrainScoring(EpochScoring):
                 y_test.append(self.target_extractor(batch_y))
                 y_preds.append(yp)
             y_test = np.concatenate(y_test)
+            if getattr(net, 'distributed', False):
+                # every rank predicted its own shard of the training data
+                y_preds = all_gather_list(y_preds)
+                y_test = np.concatenate(all_gather_list([y_test]))
 
             # Adding the recomputed preds to all other
             # instances of PostEpochTrainScoring of this
             # Skorch-Net (NeuralNet, BraindecodeClassifier etc.)
+            # that score on the same samples
             # (They will be reinitialized to empty lists by skorch
             # each epoch)
             cbs = net._default_callbacks + net.callbacks
             epoch_cbs = [
-                cb for name, cb in cbs if isinstance(cb, PostEpochTrainScoring)
+                cb for name, cb in cbs if isinstance(
+                    cb, PostEpochTrainScoring) and (
+                    self._shares_predictions_with(cb))
             ]
             for cb in epoch_cbs:
                 cb.y_preds_ = y_preds
                 cb.y_trues_ = y_test
+                cb.subset_inds_ = self.subset_inds_
 
         # y pred should be same as self.y_preds_
         with _cache_net_forward_iter(
@@ -282,3 +648,114 @@ class PostEpochTrainScoring(EpochScoring):
                 cached_net, dataset_train, self.y_trues_
             )
         self._record_score(net.history, current_score)
+        if self.subset_size is not None:
+            net.history.record(self.name + '_n_samples', len(self.y_trues_))
+            net.history.record(
+                self.name + '_subset_hash', _hash_inds(self.subset_inds_))
+
+
+class RecordingEpochScoring(EpochScoring):
+    """Score predictions per recording, aggregated from the predictions of
+    the windows of each recording of a BaseConcatDataset, e.g., for TUH
+    abnormal decoding.
+
+    The target of a recording is the target of its first window. On the
+    validation set, the predictions of the epoch are used. On the training
+    set, predictions are recomputed after the epoch in evaluation mode, as
+    training batches are shuffled. Predictions with further axes than
+    classes, e.g. time of cropped predictions, are averaged per window.
+
+    Parameters
+    ----------
+    scoring : None, str, or callable (default=None)
+      If None, use the ``score`` method of the model. If str, it
+      should be a valid sklearn scorer (e.g. "f1", "accuracy"). If a
+      callable, it should have the signature (model, X, y), and it
+      should return a scalar.
+    lower_is_better : bool (default=True)
+      Whether lower scores should be considered better or worse.
+    on_train : bool (default=False)
+      Whether to score the training or the validation set.
+    name : str or None (default=None)
+      If not an explicit string, tries to infer the name from the
+      ``scoring`` argument.
+    target_extractor : callable (default=to_numpy)
+      This is called on y before it is passed to scoring.
+    aggregation : str (default='mean')
+      'mean' or 'median' of the window predictions, or 'vote' for the
+      fraction of windows predicting each class, see
+      `recording_preds_from_window_preds`.
+    """
+
+    def __init__(
+        self,
+        scoring,
+        lower_is_better=True,
+        on_train=False,
+        name=None,
+        target_extractor=to_numpy,
+        aggregation='mean',
+    ):
+        super().__init__(
+            scoring=scoring,
+            lower_is_better=lower_is_better,
+            on_train=on_train,
+            name=name,
+            target_extractor=target_extractor,
+            use_caching=True,
+        )
+        self.aggregation = aggregation
+
+    def on_batch_end(self, net, y, y_pred, training, **kwargs):
+        if self.on_train:
+            # predictions on the training set are recomputed at epoch end
+            return
+        if y_pred.ndim > 2:
+            # only keep one prediction per window
+            y_pred = y_pred.mean(dim=tuple(range(2, y_pred.ndim)))
+        super().on_batch_end(net, y=y, y_pred=y_pred, training=training,
+                             **kwargs)
+
+    def on_epoch_end(self, net, dataset_train, dataset_valid, **kwargs):
+        dataset = dataset_train if self.on_train else dataset_valid
+        if dataset is None:
+            return
+        if not hasattr(dataset, 'cumulative_sizes'):
+            raise ValueError(
+                'Scoring per recording needs a BaseConcatDataset.')
+        if self.on_train:
+            y_preds, y_trues = [], []
+            for data in net.get_iterator(dataset, training=False):
+                batch_X, batch_y = unpack_data(data)
+                y_preds.append(net.evaluation_step(
+                    batch_X, training=False).to(device="cpu"))
+                y_trues.append(batch_y)
+            if getattr(net, 'distributed', False):
+                # every rank predicted its own shard of the training data
+                y_preds = all_gather_list(y_preds)
+                y_trues = all_gather_list(y_trues)
+        else:
+            y_preds, y_trues = self.y_preds_, self.y_trues_
+        window_preds = np.concatenate([to_numpy(y) for y in y_preds])
+        window_ys = np.concatenate(
+            [self.target_extractor(y) for y in y_trues])
+        if getattr(net, 'distributed', False):
+            # gathered in order of the ranks, restore order of the dataset
+            order = get_evaluation_order(dataset)
+            window_preds[order] = window_preds.copy()
+            window_ys[order] = window_ys.copy()
+
+        recording_preds = recording_preds_from_window_preds(
+            window_preds, dataset.cumulative_sizes, self.aggregation)
+        n_windows = np.diff(dataset.cumulative_sizes, prepend=0)
+        has_windows = n_windows > 0
+        recording_ys = window_ys[
+            (np.asarray(dataset.cumulative_sizes) - n_windows)[has_windows]]
+        # Move into format expected by skorch (list of torch tensors)
+        recording_preds = [torch.as_tensor(recording_preds[has_windows])]
+
+        with _cache_net_forward_iter(
+            net, use_caching=True, y_preds=recording_preds
+        ) as cached_net:
+            current_score = self._scoring(cached_net, dataset, recording_ys)
+        self._record_score(net.history, current_score)
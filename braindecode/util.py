@@ -1,5 +1,8 @@
 import os
+import queue
 import random
+import threading
+import time
 
 import numpy as np
 import mne
@@ -289,30 +292,210 @@ def create_mne_dummy_raw(n_channels, n_times, sfreq, include_anns=True,
 
 
 class ThrowAwayIndexLoader(object):
-    def __init__(self, net, loader, is_regression):
+    """Wrap a data loader to drop the window indices from the batches and to
+    cast inputs and targets to the dtypes expected by the net.
+
+    The window indices of the current batch are stored on the net for the
+    scoring callbacks. Tensors are only cast if they do not have the
+    expected dtype yet. Optionally, the next batches are fetched, cast and
+    moved to the device of the net on a background thread, using pinned
+    memory and non-blocking copies for cuda devices, while the net trains
+    on the current batch. When prefetching, the time spent waiting for each
+    batch is stored on the net, which records it in the batch history as
+    `train_data_wait` or `valid_data_wait`.
+
+    Parameters
+    ----------
+    net: skorch.NeuralNet
+        net that consumes the batches
+    loader: torch.utils.data.DataLoader
+        loader returning batches of inputs, targets and optionally window
+        indices
+    is_regression: bool
+        whether targets are cast to float32 (regression) or to int64
+        (classification)
+    n_prefetch: int
+        number of batches to prepare ahead on a background thread. If 0,
+        batches are prepared when they are requested.
+    device: str | torch.device | None
+        device to move the batches to. If None, batches are not moved.
+    """
+    def __init__(self, net, loader, is_regression, n_prefetch=0, device=None):
         self.net = net
         self.loader = loader
         self.last_i = None
         self.is_regression = is_regression
+        self.n_prefetch = n_prefetch
+        self.device = None if device is None else torch.device(device)
+        self.y_dtype = torch.float32 if is_regression else torch.int64
+
+    def __len__(self):
+        return len(self.loader)
 
     def __iter__(self, ):
-        normal_iter = self.loader.__iter__()
-        for batch in normal_iter:
-            if len(batch) == 3:
-                x, y, i = batch
-                # Store for scoring callbacks
-                self.net._last_window_inds = i
-            else:
-                x, y = batch
-
-            # TODO: should be on dataset side
-            if hasattr(x, 'type'):
-                x = x.type(torch.float32)
-                if self.is_regression:
-                    y = y.type(torch.float32)
-                else:
-                    y = y.type(torch.int64)
-            yield x, y
+        if self.n_prefetch > 0:
+            batches = self._prefetch()
+        else:
+            batches = map(self._prepare_batch, self.loader)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    x, y, i = next(batches)
+                except StopIteration:
+                    return
+                if self.n_prefetch > 0:
+                    self.net._last_data_wait = time.perf_counter() - start
+                if i is not None:
+                    # Store for scoring callbacks
+                    self.net._last_window_inds = i
+                yield x, y
+        finally:
+            if hasattr(batches, 'close'):
+                # stop the prefetching thread
+                batches.close()
+
+    def _prepare_batch(self, batch):
+        if len(batch) == 3:
+            x, y, i = batch
+        else:
+            x, y = batch
+            i = None
+        if hasattr(x, 'type'):
+            x = self._to_device(x, torch.float32)
+            y = self._to_device(y, self.y_dtype)
+        return x, y, i
+
+    def _to_device(self, tensor, dtype):
+        if not isinstance(tensor, torch.Tensor):
+            return tensor
+        if tensor.dtype != dtype:
+            tensor = tensor.type(dtype)
+        if self.device is None or tensor.device == self.device:
+            return tensor
+        non_blocking = self.device.type == 'cuda'
+        if non_blocking and not tensor.is_pinned():
+            tensor = tensor.pin_memory()
+        return tensor.to(self.device, non_blocking=non_blocking)
+
+    def _prefetch(self):
+        batches = queue.Queue(maxsize=self.n_prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            # give up if the consumer stopped iterating
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fill():
+            try:
+                for batch in self.loader:
+                    if not put((None, self._prepare_batch(batch))):
+                        return
+            except Exception as e:
+                put((e, None))
+                return
+            put((None, None))
+
+        thread = threading.Thread(target=fill, daemon=True)
+        thread.start()
+        try:
+            while True:
+                error, batch = batches.get()
+                if error is not None:
+                    raise error
+                if batch is None:
+                    return
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+
+def predict_recording(module, X, chunk_size_samples, device='cpu'):
+    """Predict every sample of a continuous recording with a dense
+    prediction model, streaming the recording through the model in chunks.
+
+    Consecutive chunks overlap by the receptive field of the model minus one
+    sample, so every sample after the first receptive field is predicted
+    exactly once, without overlapping windows. Only one chunk of the signal
+    is read and predicted at a time.
+
+    Parameters
+    ----------
+    module: torch.nn.Module
+        dense prediction model (see `to_dense_prediction_model`) taking
+        inputs of shape batch x channels x time
+    X: mne.io.Raw | BaseDataset | ndarray
+        continuous signal, channels x time for arrays
+    chunk_size_samples: int
+        number of samples fed through the model at once, at least the
+        receptive field of the model
+    device: str | torch.device
+        device of the model
+
+    Returns
+    -------
+    trace: ndarray
+        outputs x time, predictions of the model for every sample, NaN for
+        the first samples before the receptive field is filled
+    """
+    if hasattr(X, 'raw'):
+        X = X.raw
+    if isinstance(X, mne.io.BaseRaw):
+        n_times = X.n_times
+
+        def get_chunk(start, stop):
+            return X.get_data(start=start, stop=stop)
+    else:
+        X = np.asarray(X)
+        n_times = X.shape[1]
+
+        def get_chunk(start, stop):
+            return X[:, start:stop]
+
+    def predict_chunk(chunk):
+        chunk = torch.as_tensor(
+            chunk[None], dtype=torch.float32, device=device)
+        y_pred = module(chunk)
+        y_pred = y_pred[0] if isinstance(y_pred, tuple) else y_pred
+        return y_pred[0].cpu().numpy()
+
+    chunk_size_samples = min(chunk_size_samples, n_times)
+    module.eval()
+    trace = None
+    with torch.no_grad():
+        start, stop = 0, chunk_size_samples
+        while True:
+            chunk = get_chunk(start, stop)
+            chunk_preds = predict_chunk(chunk)
+            n_preds = chunk_preds.shape[-1]
+            if trace is None:
+                receptive_field = chunk_size_samples - n_preds + 1
+                # a dense model adds one prediction per added sample
+                for n_samples in [receptive_field + 1, receptive_field + 2]:
+                    if predict_chunk(chunk[:, :n_samples]).shape[-1] != (
+                            n_samples - receptive_field + 1):
+                        raise ValueError(
+                            'Model does not predict every time step, '
+                            'transform it with to_dense_prediction_model '
+                            'first.')
+                trace = np.full(chunk_preds.shape[:-1] + (n_times,), np.nan,
+                                dtype=chunk_preds.dtype)
+                i_next_sample = receptive_field - 1
+            # predictions of the chunk are for its last n_preds samples
+            n_new_preds = stop - i_next_sample
+            trace[..., i_next_sample:stop] = chunk_preds[..., -n_new_preds:]
+            i_next_sample = stop
+            if stop == n_times:
+                return trace
+            stop = min(stop + n_preds, n_times)
+            start = stop - chunk_size_samples
 
 
 def update_estimator_docstring(base_class, docstring):
@@ -181,16 +181,18 @@ if cuda:
 # crops.
 #
 
-from braindecode.models.util import to_dense_prediction_model, get_output_shape
+from braindecode.models.util import (
+    to_dense_prediction_model, get_cropped_window_params)
 to_dense_prediction_model(model)
 
 
 ######################################################################
-# To know the models’ receptive field, we calculate the shape of model
-# output for a dummy input.
+# From the models’ receptive field, we compute the number of predictions per
+# input window. It is the stride between windows, so that every time step of
+# a trial is predicted once.
 #
 
-n_preds_per_input = get_output_shape(model, n_chans, input_window_samples)[2]
+window_params = get_cropped_window_params(model, input_window_samples)
 
 
 ######################################################################
@@ -221,10 +223,9 @@ windows_dataset = create_windows_from_events(
     dataset,
     trial_start_offset_samples=trial_start_offset_samples,
     trial_stop_offset_samples=0,
-    window_size_samples=input_window_samples,
-    window_stride_samples=n_preds_per_input,
     drop_last_window=False,
     preload=True,
+    **window_params,
 )
 
 
@@ -18,7 +18,8 @@ from braindecode.datasets import BaseDataset, BaseConcatDataset
 from braindecode.training.losses import CroppedLoss
 from braindecode.models import Deep4Net
 from braindecode.models import ShallowFBCSPNet
-from braindecode.models.util import to_dense_prediction_model, get_output_shape
+from braindecode.models.util import (
+    to_dense_prediction_model, get_cropped_window_params)
 from braindecode.util import set_random_seeds, create_mne_dummy_raw
 
 model_name = "shallow"  # 'shallow' or 'deep'
@@ -79,7 +80,7 @@ if cuda:
     model.cuda()
 
 to_dense_prediction_model(model)
-n_preds_per_input = get_output_shape(model, n_chans, input_window_samples)[2]
+window_params = get_cropped_window_params(model, input_window_samples)
 
 def fake_regression_dataset(n_fake_recs, n_fake_chs, fake_sfreq, fake_duration_s):
     datasets = []
@@ -106,10 +107,9 @@ windows_dataset = create_fixed_length_windows(
     dataset,
     start_offset_samples=0,
     stop_offset_samples=0,
-    window_size_samples=input_window_samples,
-    window_stride_samples=n_preds_per_input,
     drop_last_window=False,
     drop_bad_windows=True,
+    **window_params,
 )
 
 splits = windows_dataset.split("session")
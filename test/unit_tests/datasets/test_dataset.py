@@ -3,13 +3,18 @@
 #
 # License: BSD (3-clause)
 
+import pickle
+
 import mne
 import numpy as np
 import pandas as pd
 import pytest
 
+from braindecode.datasets import base
 from braindecode.datasets import WindowsDataset, BaseDataset, BaseConcatDataset
 from braindecode.datasets.moabb import fetch_data_with_moabb
+from braindecode.datautil.windowers import create_windows_from_events
+from braindecode.util import create_mne_dummy_raw
 
 # TODO: split file up into files with proper matching names
 @pytest.fixture(scope="module")
@@ -126,3 +131,257 @@ def test_concat_concat_dataset(concat_ds_targets):
     assert len(concat_concat_ds.description) == len(descriptions)
     np.testing.assert_array_equal(cumsums, concat_concat_ds.cumulative_sizes)
     pd.testing.assert_frame_equal(descriptions, concat_concat_ds.description)
+
+
+@pytest.fixture(scope="module")
+def concat_windows_dataset():
+    """Two recordings with 10 trials of 3 windows each."""
+    rng = np.random.RandomState(42)
+    list_of_ds = []
+    for subject in [1, 2]:
+        info = mne.create_info(ch_names=['0', '1'], sfreq=50, ch_types='eeg')
+        raw = mne.io.RawArray(data=rng.randn(2, 2000), info=info)
+        onsets = np.arange(10) * 3 + 1
+        anns = mne.Annotations(
+            onset=onsets, duration=np.ones(10),
+            description=['T0', 'T1'] * 5)
+        raw.set_annotations(anns)
+        desc = pd.Series({'subject': subject, 'session': 'train'})
+        list_of_ds.append(BaseDataset(raw, desc))
+    return create_windows_from_events(
+        BaseConcatDataset(list_of_ds), trial_start_offset_samples=0,
+        trial_stop_offset_samples=0, window_size_samples=20,
+        window_stride_samples=15, drop_last_window=False)
+
+
+def test_window_index(concat_windows_dataset):
+    concat_ds = concat_windows_dataset
+    window_index = concat_ds.window_index
+    assert window_index is concat_ds.window_index
+    assert len(window_index) == len(concat_ds) == 60
+    np.testing.assert_array_equal(
+        window_index['i_recording'], np.repeat([0, 1], 30))
+    np.testing.assert_array_equal(
+        window_index['i_trial'], np.repeat(np.arange(20), 3))
+    np.testing.assert_array_equal(
+        window_index['subject'], np.repeat([1, 2], 30))
+    assert (window_index['session'] == 'train').all()
+    for i_window in range(len(concat_ds)):
+        _, y, crop_inds = concat_ds[i_window]
+        row = window_index.iloc[i_window]
+        assert row['target'] == y
+        np.testing.assert_array_equal(
+            row[['i_window_in_trial', 'i_start_in_trial',
+                 'i_stop_in_trial']], crop_inds)
+
+
+def test_window_index_trials_with_dropped_windows():
+    rng = np.random.RandomState(42)
+    info = mne.create_info(ch_names=['0', '1'], sfreq=50, ch_types='eeg')
+    raw = mne.io.RawArray(data=rng.randn(2, 500), info=info)
+    # bad segment only overlaps the middle window of the first trial
+    raw.set_annotations(mne.Annotations(
+        onset=[1, 4, 1.45], duration=[1, 1, 0.05],
+        description=['T0', 'T1', 'BAD_segment']))
+    windows = create_windows_from_events(
+        BaseConcatDataset([BaseDataset(raw, pd.Series({'subject': 1}))]),
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        window_size_samples=20, window_stride_samples=15,
+        drop_last_window=False, mapping={'T0': 0, 'T1': 1})
+    window_index = windows.window_index
+    np.testing.assert_array_equal(
+        window_index['i_window_in_trial'], [0, 2, 0, 1, 2])
+    np.testing.assert_array_equal(window_index['i_trial'], [0, 0, 1, 1, 1])
+
+
+def test_select_windows(concat_windows_dataset):
+    concat_ds = concat_windows_dataset
+    window_index = concat_ds.window_index
+    mask = (window_index['subject'] == 2) & (window_index['target'] == 1)
+    subset = concat_ds.select_windows(mask)
+    assert len(subset) == mask.sum() == 15
+    for i_window, i_window_in_ds in enumerate(np.flatnonzero(mask)):
+        x, y, crop_inds = subset[i_window]
+        x_ds, y_ds, crop_inds_ds = concat_ds[i_window_in_ds]
+        np.testing.assert_array_equal(x, x_ds)
+        assert y == y_ds == 1
+        np.testing.assert_array_equal(crop_inds, crop_inds_ds)
+    with pytest.raises(ValueError, match='Expected a boolean mask'):
+        concat_ds.select_windows(mask[:10])
+
+
+def test_window_index_requires_windows(set_up):
+    _, base_dataset, _, _, _, _ = set_up
+    with pytest.raises(ValueError, match='only be built for WindowsDatasets'):
+        BaseConcatDataset([base_dataset]).window_index
+
+
+def test_compact_window_metadata(set_up):
+    raw, _, mne_epochs, windows_dataset, events, window_idxs = set_up
+    assert windows_dataset.window_table.dtype.names == (
+        'i_window_in_trial', 'i_start_in_trial', 'i_stop_in_trial',
+        'i_trial')
+    assert windows_dataset.crop_inds.dtype == np.int32
+    assert windows_dataset.crop_inds.base is not None
+    np.testing.assert_array_equal(windows_dataset.crop_inds, window_idxs)
+    np.testing.assert_array_equal(
+        windows_dataset.window_table['i_start_in_trial'],
+        [w[1] for w in window_idxs])
+    assert windows_dataset.y.dtype == np.int32
+    assert type(windows_dataset[0][1]) is np.int64
+
+    # metadata of the windows does not copy the window table and targets
+    metadata = windows_dataset.windows.metadata
+    for name in ['i_window_in_trial', 'i_stop_in_trial', 'i_trial']:
+        assert np.shares_memory(
+            metadata[name].to_numpy(), windows_dataset.window_table)
+    assert np.shares_memory(metadata['target'].to_numpy(), windows_dataset.y)
+    # other columns of the metadata and its index are retained as well
+    usage = metadata.memory_usage(index=True, deep=True)
+    assert windows_dataset.memory_usage() == (
+        len(window_idxs) * (4 * 4 + 4) + usage['sample'] + usage['x'] +
+        usage['Index'])
+    unpickled = pickle.loads(pickle.dumps(windows_dataset))
+    assert np.shares_memory(
+        unpickled.windows.metadata['i_trial'].to_numpy(),
+        unpickled.window_table)
+    assert unpickled.memory_usage() == windows_dataset.memory_usage()
+
+    metadata = mne_epochs.metadata.copy()
+    metadata['target'] = metadata['target'] * 0.5
+    metadata['i_start_in_trial'] += 2 ** 40
+    large_ds = WindowsDataset(mne.Epochs(raw, events, metadata=metadata))
+    assert large_ds.y.dtype == np.float32
+    np.testing.assert_allclose(large_ds.y, events[:, 2] * 0.5)
+    assert large_ds.crop_inds.dtype == np.int64
+    np.testing.assert_array_equal(
+        large_ds.crop_inds[:, 1], [w[1] + 2 ** 40 for w in window_idxs])
+
+
+def test_split_windows_dataset(concat_windows_dataset):
+    concat_ds = concat_windows_dataset
+    splits = concat_ds.split('subject')
+    assert list(splits.keys()) == [1, 2]
+    for subject, split in splits.items():
+        assert isinstance(split, BaseConcatDataset)
+        assert len(split.datasets) == 1
+        assert len(split) == 30
+        assert split.cumulative_sizes == [30]
+        assert split.description['subject'].tolist() == [subject]
+        np.testing.assert_array_equal(split.description.index, [0])
+    splits = concat_ds.split(split_ids=[[1, 0]])
+    assert splits[0].datasets[0] is concat_ds.datasets[1]
+    assert splits[0].cumulative_sizes == [30, 60]
+    assert splits[0].description['subject'].tolist() == [2, 1]
+    np.testing.assert_array_equal(splits[0][30][0], concat_ds[0][0])
+
+
+def test_description_from_differing_series():
+    descriptions = [pd.Series({'subject': 1}),
+                    pd.Series({'subject': 2, 'session': 'test'})]
+    expected = pd.DataFrame(descriptions)
+    list_of_ds = [BaseDataset(mne.io.RawArray(
+        np.zeros((1, 10)), mne.create_info(['0'], 10, 'eeg')), desc)
+        for desc in descriptions]
+    pd.testing.assert_frame_equal(
+        BaseConcatDataset(list_of_ds).description, expected)
+
+
+@pytest.fixture
+def lazy_concat_ds(tmpdir):
+    list_of_ds = []
+    for subject in range(10):
+        _, fnames = create_mne_dummy_raw(
+            n_channels=3, n_times=20000, sfreq=100,
+            savedir=str(tmpdir.mkdir(f'subject_{subject}')),
+            save_format='fif', description=['T0', 'T1'] * 5)
+        raw = mne.io.read_raw_fif(fnames['fif'], preload=False)
+        raw.pick_channels(raw.ch_names[1:])
+        list_of_ds.append(BaseDataset(raw, pd.Series({'subject': subject})))
+    return BaseConcatDataset(list_of_ds)
+
+
+def test_pickle_lazy_datasets(lazy_concat_ds, monkeypatch):
+    header_reads = []
+    open_raw = base._open_raw
+
+    def open_and_count_raw(raw_cls, init_kwargs):
+        header_reads.append(init_kwargs['fname'])
+        return open_raw(raw_cls, init_kwargs)
+
+    monkeypatch.setattr(base, '_open_raw', open_and_count_raw)
+    windows_ds = create_windows_from_events(
+        lazy_concat_ds, trial_start_offset_samples=0,
+        trial_stop_offset_samples=0, window_size_samples=100,
+        window_stride_samples=100, drop_last_window=False)
+    windows_ds.window_index
+    for concat_ds, attr in [(lazy_concat_ds, 'raw'),
+                            (windows_ds, 'windows')]:
+        mne_objs = [getattr(ds, attr) for ds in concat_ds.datasets]
+        pickled_mne_objs = pickle.dumps(mne_objs)
+        header_reads.clear()
+        pickled = pickle.dumps(concat_ds)
+        assert len(pickled) < len(pickled_mne_objs) / 5
+        # the header of each file is read once to check that its raw can be
+        # reopened, not on every pickle
+        assert len(set(header_reads)) == len(header_reads) == len(mne_objs)
+        assert pickle.dumps(concat_ds) == pickled
+        assert len(header_reads) == len(mne_objs)
+
+        unpickled = pickle.loads(pickled)
+        assert unpickled._window_index is None
+        assert all([attr not in ds.__dict__ for ds in unpickled.datasets])
+        assert len(unpickled) == len(concat_ds)
+        for i in [0, len(concat_ds) // 2, len(concat_ds) - 1]:
+            for actual, expected in zip(unpickled[i], concat_ds[i]):
+                np.testing.assert_array_equal(actual, expected)
+        # reopened lazily on access
+        ds, unpickled_ds = concat_ds.datasets[3], unpickled.datasets[3]
+        assert getattr(unpickled_ds, attr).ch_names == (
+            getattr(ds, attr).ch_names)
+        assert not getattr(unpickled_ds, attr).preload
+        # reopened datasets can be pickled again, without reading the file
+        # headers once more
+        for ds in unpickled.datasets:
+            getattr(ds, attr)
+        header_reads.clear()
+        assert len(pickle.dumps(unpickled)) < len(pickled_mne_objs) / 5
+        assert len(header_reads) == 0
+    np.testing.assert_array_equal(
+        unpickled.datasets[0].windows.events,
+        windows_ds.datasets[0].windows.events)
+
+    raw = lazy_concat_ds.datasets[0].raw.copy().crop(tmin=10.37, tmax=150.21)
+    unpickled_raw = pickle.loads(pickle.dumps(
+        BaseDataset(raw, pd.Series({'subject': 0})))).raw
+    assert unpickled_raw.first_samp == raw.first_samp
+    np.testing.assert_array_equal(unpickled_raw.get_data(), raw.get_data())
+    np.testing.assert_allclose(
+        unpickled_raw.annotations.onset, raw.annotations.onset)
+
+
+def test_pickle_lazy_datasets_with_changed_info(lazy_concat_ds):
+    raw = lazy_concat_ds.datasets[0].raw
+    raw.pick_channels(raw.ch_names[::-1], ordered=True)
+    raw.rename_channels({name: f'EEG {name}' for name in raw.ch_names})
+    raw.set_channel_types({raw.ch_names[0]: 'misc'})
+    windows_ds = create_windows_from_events(
+        lazy_concat_ds, trial_start_offset_samples=0,
+        trial_stop_offset_samples=0, window_size_samples=100,
+        window_stride_samples=100, drop_last_window=False)
+    for concat_ds, attr in [(lazy_concat_ds, 'raw'),
+                            (windows_ds, 'windows')]:
+        ds = concat_ds.datasets[0]
+        unpickled_ds = pickle.loads(pickle.dumps(ds))
+        # renamed and retyped channels are replayed on reopening
+        assert attr not in unpickled_ds.__dict__
+        unpickled_mne_obj = getattr(unpickled_ds, attr)
+        assert unpickled_mne_obj.ch_names == getattr(ds, attr).ch_names
+        assert unpickled_mne_obj.get_channel_types() == ['misc', 'eeg']
+        np.testing.assert_array_equal(unpickled_ds[3][0], ds[3][0])
+
+    # changes that are not replayed fall back to pickling the raw
+    raw.set_eeg_reference(projection=True, verbose='error')
+    unpickled_ds = pickle.loads(pickle.dumps(lazy_concat_ds.datasets[0]))
+    assert 'raw' in unpickled_ds.__dict__
+    assert len(unpickled_ds.raw.info['projs']) == 1
@@ -125,6 +125,8 @@ def test_create_from_mne_epochs():
     # windows per trial: 0-5,2-7,4-9,6-11,...,14-19,15-20
     # and then: 0-5,2-7,4-9,5-10
     assert len(windows) == 9 * n_anns + 4 * n_anns
+    # one dataset per mne.Epochs
+    assert len(windows.datasets) == len(all_epochs)
     for i_w, (x, y, (i_w_in_t, i_start, i_stop)) in enumerate(windows):
         if i_w < 9 * n_anns:
             assert i_w_in_t == i_w % 9
@@ -137,4 +139,6 @@ def test_create_from_mne_epochs():
             assert i_w_in_t == (i_w - n_anns * 9) % 4
             i_t = ((i_w - n_anns * 9) // 4)
             assert i_start == inds[i_t] + i_w_in_t * 2 - (i_w_in_t == 3)
-            assert i_stop == inds[i_t] + i_w_in_t * 2 - (i_w_in_t == 3) + 5
\ No newline at end of file
+            assert i_stop == inds[i_t] + i_w_in_t * 2 - (i_w_in_t == 3) + 5
+            np.testing.assert_allclose(x, datas[1][:, i_start:i_stop],
+                                       atol=1e-5, rtol=1e-5)
\ No newline at end of file
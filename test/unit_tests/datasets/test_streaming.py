@@ -0,0 +1,124 @@
+# License: BSD-3
+
+import mne
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from braindecode.datasets import (
+    BaseDataset, BaseConcatDataset, StreamingWindowsDataset,
+    ShardedWindowsDataset)
+from braindecode.datautil import (
+    create_fixed_length_windows, create_windows_from_events,
+    save_concat_dataset)
+
+WINDOWER_KWARGS = dict(
+    start_offset_samples=0, stop_offset_samples=0,
+    window_size_samples=50, window_stride_samples=50, drop_last_window=True)
+
+
+@pytest.fixture
+def concat_ds():
+    rng = np.random.RandomState(0)
+    list_of_ds = []
+    for i_recording, n_times in enumerate([500, 300, 450, 1000, 250]):
+        info = mne.create_info(ch_names=['0', '1'], sfreq=50, ch_types='eeg')
+        data = rng.randn(2, n_times)
+        # mark every sample with its recording for the checks below
+        data[0] = i_recording
+        raw = mne.io.RawArray(data, info)
+        anns = mne.Annotations(
+            onset=[1, 3], duration=[1, 1], description=['T0', 'T1'])
+        raw.set_annotations(anns)
+        list_of_ds.append(BaseDataset(
+            raw, pd.Series({'subject': i_recording, 'target': i_recording}),
+            target_name='target'))
+    return BaseConcatDataset(list_of_ds)
+
+
+def _windows_as_array(windows):
+    return np.array(sorted([
+        (X[0, 0], y, *i) for X, y, i in windows]))
+
+
+def test_streaming_fixed_length_windows(concat_ds):
+    expected = create_fixed_length_windows(concat_ds, **WINDOWER_KWARGS)
+    ds = StreamingWindowsDataset(
+        concat_ds, create_fixed_length_windows, shuffle_buffer_size=10,
+        random_state=0, **WINDOWER_KWARGS)
+    windows = list(ds)
+    assert len(windows) == len(expected)
+    np.testing.assert_array_equal(
+        _windows_as_array(windows), _windows_as_array(expected))
+    # windows of different recordings are mixed
+    i_recordings = [X[0, 0] for X, y, i in windows]
+    assert np.sum(np.diff(i_recordings) != 0) > len(concat_ds.datasets)
+    # a different order in the next epoch
+    assert [X[0, 0] for X, y, i in ds] != i_recordings
+
+
+def test_streaming_windows_from_events(concat_ds):
+    kwargs = dict(
+        trial_start_offset_samples=0, trial_stop_offset_samples=0,
+        window_size_samples=25, window_stride_samples=25,
+        drop_last_window=False, mapping={'T0': 0, 'T1': 1})
+    expected = create_windows_from_events(concat_ds, **kwargs)
+    ds = StreamingWindowsDataset(
+        concat_ds, create_windows_from_events, shuffle_buffer_size=0,
+        shuffle_recordings=False, **kwargs)
+    for (X, y, i), (X_exp, y_exp, i_exp) in zip(ds, expected):
+        np.testing.assert_array_equal(X, X_exp)
+        assert y == y_exp
+        assert i == i_exp
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_streaming_from_directory_with_workers(
+        concat_ds, tmpdir, num_workers):
+    save_concat_dataset(str(tmpdir), concat_ds)
+    expected = create_fixed_length_windows(concat_ds, **WINDOWER_KWARGS)
+    ds = StreamingWindowsDataset(
+        str(tmpdir), create_fixed_length_windows, shuffle_buffer_size=20,
+        **WINDOWER_KWARGS)
+    loader = DataLoader(ds, batch_size=7, num_workers=num_workers)
+    for _ in range(2):
+        Xs, ys, inds = zip(*list(loader))
+        X = torch.cat(Xs).numpy()
+        y = torch.cat(ys).numpy()
+        # every window exactly once per epoch
+        assert len(X) == len(expected)
+        np.testing.assert_array_equal(
+            np.sort(X[:, 0, 0]),
+            np.sort([X_exp[0, 0] for X_exp, _, _ in expected]))
+        np.testing.assert_array_equal(X[:, 0, 0], y)
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_sharded_windows_dataset(concat_ds, tmpdir, num_workers):
+    windows_ds = create_fixed_length_windows(concat_ds, **WINDOWER_KWARGS)
+    save_concat_dataset(str(tmpdir), windows_ds, shard_size=16)
+    n_windows = [16] * (len(windows_ds) // 16) + [len(windows_ds) % 16]
+    ds = ShardedWindowsDataset(str(tmpdir), random_state=0)
+    assert [shard['n_windows'] for shard in ds.shards] == n_windows
+    assert len(ds) == len(windows_ds)
+    pd.testing.assert_frame_equal(ds.description, windows_ds.description)
+    with pytest.raises(FileExistsError):
+        save_concat_dataset(str(tmpdir), windows_ds, shard_size=16)
+
+    windows = list(ds)
+    np.testing.assert_array_equal(
+        _windows_as_array(windows), _windows_as_array(windows_ds))
+    X, y, inds = windows[0]
+    assert X.dtype == np.float32
+    assert X.shape == windows_ds[0][0].shape
+    assert isinstance(inds, list)
+    # windows are shuffled inside the shards
+    assert [X[0, 0] for X, y, i in windows] != sorted(
+        [X[0, 0] for X, y, i in windows])
+
+    loader = DataLoader(ds, batch_size=5, num_workers=num_workers)
+    X = torch.cat([X for X, y, i in loader]).numpy()
+    np.testing.assert_array_equal(
+        np.sort(X[:, 0, 0]), np.sort([X[0, 0] for X, y, i in windows]))
@@ -0,0 +1,158 @@
+# License: BSD-3
+
+import mne
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from braindecode.datasets.base import BaseDataset, BaseConcatDataset
+from braindecode.classifier import EEGClassifier
+from braindecode.datautil.samplers import (
+    RecordingBlockSampler, BalancedWindowSampler, StratifiedWindowSampler,
+    DistributedRecordingSampler)
+from braindecode.datautil.xy import create_from_X_y
+
+
+@pytest.fixture
+def concat_ds():
+    info = mne.create_info(ch_names=['0'], sfreq=10, ch_types='eeg')
+    list_of_ds = [BaseDataset(
+        mne.io.RawArray(np.zeros((1, n_times)), info),
+        pd.Series({'subject': i}), target_name='subject')
+        for i, n_times in enumerate([10, 20, 5, 15, 30, 7, 13])]
+    return BaseConcatDataset(list_of_ds)
+
+
+def _i_recordings(concat_ds, inds):
+    return np.searchsorted(concat_ds.cumulative_sizes, inds, side='right')
+
+
+@pytest.mark.parametrize('n_recordings_per_block', [1, 3, 7])
+def test_recording_block_sampler(concat_ds, n_recordings_per_block):
+    sampler = RecordingBlockSampler(
+        concat_ds, n_recordings_per_block=n_recordings_per_block,
+        random_state=0)
+    inds = list(sampler)
+    assert len(inds) == len(sampler) == len(concat_ds)
+    np.testing.assert_array_equal(np.sort(inds), np.arange(len(concat_ds)))
+    # every block only holds windows of its recordings
+    i_recordings = _i_recordings(concat_ds, inds)
+    _, first_inds = np.unique(i_recordings, return_index=True)
+    order = i_recordings[np.sort(first_inds)]
+    blocks = [order[i:i + n_recordings_per_block]
+              for i in range(0, len(order), n_recordings_per_block)]
+    block_stops = np.cumsum([
+        sum([len(concat_ds.datasets[i]) for i in block]) for block in blocks])
+    for block, block_inds in zip(
+            blocks, np.split(i_recordings, block_stops[:-1])):
+        assert set(block_inds) == set(block)
+    # a new order in every epoch
+    assert list(sampler) != inds
+
+
+def test_recording_block_sampler_without_shuffling(concat_ds):
+    sampler = RecordingBlockSampler(
+        concat_ds, n_recordings_per_block=2, shuffle_recordings=False,
+        shuffle_within_block=False)
+    np.testing.assert_array_equal(list(sampler), np.arange(len(concat_ds)))
+    loader = DataLoader(concat_ds, batch_size=8, sampler=sampler)
+    assert sum([len(X) for X, y in loader]) == len(concat_ds)
+
+
+@pytest.fixture
+def imbalanced_windows_ds():
+    rng = np.random.RandomState(0)
+    X = rng.randn(40, 2, 100).astype('float32')
+    y = np.array([0] * 30 + [1] * 8 + [2] * 2)
+    windows_ds = create_from_X_y(
+        X, y, drop_last_window=False, window_size_samples=50,
+        window_stride_samples=50)
+    windows_ds.description['subject'] = np.arange(40) % 4
+    return windows_ds
+
+
+def test_balanced_window_sampler(imbalanced_windows_ds):
+    sampler = BalancedWindowSampler(
+        imbalanced_windows_ds, n_samples=30000, random_state=0)
+    inds = np.array(list(sampler))
+    assert len(inds) == len(sampler) == 30000
+    y = np.concatenate([ds.y for ds in imbalanced_windows_ds.datasets])
+    np.testing.assert_allclose(
+        np.bincount(y[inds]) / len(inds), [1 / 3] * 3, atol=0.02)
+
+    sampler = BalancedWindowSampler(
+        imbalanced_windows_ds, replacement=False, random_state=0)
+    np.testing.assert_array_equal(np.sort(list(sampler)), np.arange(80))
+    with pytest.raises(ValueError):
+        BalancedWindowSampler(
+            imbalanced_windows_ds, n_samples=81, replacement=False)
+
+
+@pytest.mark.parametrize('by', [None, 'subject'])
+def test_stratified_window_sampler(imbalanced_windows_ds, by):
+    sampler = StratifiedWindowSampler(
+        imbalanced_windows_ds, by=by, random_state=0)
+    if by is None:
+        groups = np.concatenate(
+            [ds.y for ds in imbalanced_windows_ds.datasets])
+    else:
+        groups = np.repeat(imbalanced_windows_ds.description['subject'], 2)
+    groups = np.asarray(groups)
+    for _ in range(3):
+        inds = np.array(list(sampler))
+        assert len(inds) == len(sampler)
+        np.testing.assert_array_equal(np.sort(inds), np.arange(80))
+        # every batch of 20 windows has the groups in the overall proportion,
+        # up to one window
+        expected = np.bincount(groups) / 4
+        for batch_inds in inds.reshape(4, 20):
+            counts = np.bincount(groups[batch_inds], minlength=len(expected))
+            assert np.all(np.abs(counts - expected) <= 1)
+
+
+def test_sampler_in_classifier(imbalanced_windows_ds):
+    sampler = BalancedWindowSampler(imbalanced_windows_ds, random_state=0)
+    clf = EEGClassifier(
+        nn.Sequential(nn.Flatten(), nn.Linear(100, 3)),
+        criterion=torch.nn.CrossEntropyLoss, train_split=None,
+        iterator_train__sampler=sampler, batch_size=16, max_epochs=1)
+    assert clf.iterator_train__shuffle is False
+    clf.fit(imbalanced_windows_ds, y=None)
+
+
+def test_distributed_recording_sampler(concat_ds):
+    # recordings have 10, 20, 5, 15, 30, 7, 13 windows
+    samplers = [DistributedRecordingSampler(
+        concat_ds, num_replicas=3, rank=rank, seed=1) for rank in range(3)]
+    np.testing.assert_array_equal(
+        np.sort(np.concatenate([s.i_recordings for s in samplers])),
+        np.arange(7))
+    n_windows = [len(s.inds) for s in samplers]
+    assert sum(n_windows) == len(concat_ds)
+    assert max(n_windows) - min(n_windows) <= 7
+    for epoch in range(2):
+        all_inds = []
+        for sampler in samplers:
+            sampler.set_epoch(epoch)
+            inds = list(sampler)
+            assert len(inds) == len(sampler) == max(n_windows)
+            # only windows of the own recordings
+            assert set(_i_recordings(concat_ds, inds)) == set(
+                sampler.i_recordings)
+            all_inds.extend(inds)
+        assert set(all_inds) == set(range(len(concat_ds)))
+    # same order for the same epoch, different order for a new epoch
+    samplers[0].set_epoch(1)
+    inds = list(samplers[0])
+    assert list(samplers[0]) == inds
+    samplers[0].set_epoch(2)
+    assert list(samplers[0]) != inds
+
+    sampler = DistributedRecordingSampler(
+        concat_ds, num_replicas=3, rank=0, shuffle=False, pad=False)
+    np.testing.assert_array_equal(list(sampler), samplers[0].inds)
+    with pytest.raises(ValueError):
+        DistributedRecordingSampler(concat_ds, num_replicas=8, rank=0)
@@ -0,0 +1,62 @@
+# License: BSD-3
+
+import os
+import pickle
+
+import mne
+import numpy as np
+import pandas as pd
+import pytest
+
+from braindecode.datasets.base import BaseDataset, BaseConcatDataset
+from braindecode.datautil.shared_memory import share_memory
+from braindecode.datautil.windowers import create_fixed_length_windows
+
+
+@pytest.fixture
+def concat_ds():
+    rng = np.random.RandomState(0)
+    list_of_ds = []
+    for subject in [1, 2]:
+        info = mne.create_info(ch_names=['0', '1'], sfreq=50, ch_types='eeg')
+        raw = mne.io.RawArray(data=rng.randn(2, 5000), info=info)
+        desc = pd.Series({'subject': subject, 'target': subject})
+        list_of_ds.append(BaseDataset(raw, desc, target_name='target'))
+    return BaseConcatDataset(list_of_ds)
+
+
+def test_share_memory_raws(concat_ds):
+    expected = [concat_ds[i] for i in [0, 4999, 5000, 9999]]
+    n_bytes = len(pickle.dumps(concat_ds))
+    share_memory(concat_ds)
+    filenames = [ds._shared_data.filename for ds in concat_ds.datasets]
+    assert all([os.path.exists(f) for f in filenames])
+
+    pickled = pickle.dumps(concat_ds)
+    assert len(pickled) < n_bytes / 4
+    unpickled = pickle.loads(pickled)
+    for i, (X, y) in zip([0, 4999, 5000, 9999], expected):
+        X_shared, y_shared = unpickled[i]
+        np.testing.assert_array_equal(X_shared, X)
+        assert y_shared == y
+
+    # changes in the unpickled copy do not affect the original
+    unpickled.datasets[0].raw._data[:] = 0
+    np.testing.assert_array_equal(concat_ds[0][0], expected[0][0])
+
+    del concat_ds, unpickled
+    assert not any([os.path.exists(f) for f in filenames])
+
+
+def test_share_memory_windows(concat_ds, tmpdir):
+    windows_ds = create_fixed_length_windows(
+        concat_ds, start_offset_samples=0, stop_offset_samples=5000,
+        window_size_samples=100, window_stride_samples=100,
+        drop_last_window=False, preload=True)
+    expected = windows_ds[60][0]
+    share_memory(windows_ds, dirname=str(tmpdir))
+    assert all([ds.windows._data.filename.startswith(str(tmpdir))
+                for ds in windows_ds.datasets])
+    unpickled = pickle.loads(pickle.dumps(windows_ds))
+    np.testing.assert_array_equal(unpickled[60][0], expected)
+    assert unpickled[60][1] == windows_ds[60][1]
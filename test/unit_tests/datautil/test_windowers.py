@@ -14,6 +14,7 @@ from braindecode.datasets.base import BaseDataset, BaseConcatDataset
 from braindecode.datasets.moabb import fetch_data_with_moabb
 from braindecode.datautil import (
     create_windows_from_events, create_fixed_length_windows)
+from braindecode.datautil.windowers import _get_valid_windows_mask
 from braindecode.util import create_mne_dummy_raw
 
 
@@ -307,3 +308,54 @@ def test_fixed_length_windower(start_offset_samples, window_size_samples,
             epochs_data[j, :],
             err_msg=f"Epochs different for epoch {j}"
         )
+
+
+def test_drop_bad_windows_matches_mne_drop_bad():
+    rng = np.random.RandomState(42)
+    sfreq = 100
+    info = mne.create_info(ch_names=['0', '1'], sfreq=sfreq, ch_types='eeg')
+    raw = mne.io.RawArray(data=rng.randn(2, 3000), info=info, first_samp=50)
+    anns = mne.Annotations(
+        onset=[0.2, 3, 3.2, 9, 12, 20, 25],
+        duration=[0.5, 0.5, 0.1, 1, 0.5, 0, 2],
+        description=['T0', 'T1', 'BAD_muscle', 'T0', 'bad', 'T1', 'BAD'],
+        orig_time=None)
+    raw.set_annotations(anns)
+    concat_ds = BaseConcatDataset([BaseDataset(raw)])
+
+    # windows over and beyond the whole recording
+    starts = np.arange(raw.first_samp - 100, raw.last_samp + 100, 7)
+    events = np.stack(
+        [starts, np.zeros_like(starts), np.ones_like(starts)], axis=1)
+    mne_epochs = mne.Epochs(
+        raw, events, baseline=None, tmin=0, tmax=(100 - 1) / sfreq,
+        preload=False)
+    mne_epochs.drop_bad(reject=None, flat=None)
+    valid_mask = _get_valid_windows_mask(raw, starts, 100)
+    np.testing.assert_array_equal(
+        mne_epochs.events[:, 0], starts[valid_mask])
+
+    for windower, kwargs in (
+            (create_fixed_length_windows, dict(
+                start_offset_samples=0, stop_offset_samples=0,
+                window_size_samples=100, window_stride_samples=30,
+                drop_last_window=False)),
+            (create_windows_from_events, dict(
+                trial_start_offset_samples=-50, trial_stop_offset_samples=50,
+                window_size_samples=40, window_stride_samples=20,
+                drop_last_window=False, mapping={'T0': 0, 'T1': 1}))):
+        windows = windower(concat_ds, drop_bad_windows=True, **kwargs)
+        windows_mne_dropped = windower(
+            concat_ds, drop_bad_windows=False, **kwargs)
+        epochs = windows.datasets[0].windows
+        mne_epochs = windows_mne_dropped.datasets[0].windows
+        assert epochs._bad_dropped
+        assert not mne_epochs._bad_dropped
+        mne_epochs.drop_bad(reject=None, flat=None)
+        assert len(mne_epochs.events) < len(
+            windows_mne_dropped.datasets[0].windows.drop_log)
+        np.testing.assert_array_equal(
+            mne_epochs.events[:, 0], epochs.events[:, 0])
+        np.testing.assert_array_equal(
+            mne_epochs.metadata.values, epochs.metadata.values)
+        np.testing.assert_allclose(epochs.get_data(), mne_epochs.get_data())
@@ -0,0 +1,239 @@
+# License: BSD-3
+
+import copy
+import warnings
+
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from braindecode.classifier import EEGClassifier
+from braindecode.datautil.xy import create_from_X_y
+from braindecode.models import (
+    Deep4Net, EEGNetv1, EEGNetv4, EEGResNet, HybridNet, ShallowFBCSPNet, TCN)
+from braindecode.models.modules import AvgPool2dWithConv
+from braindecode.models.util import (
+    get_cropped_window_params, get_dense_window_params, get_output_shape,
+    get_receptive_field, optimize_for_inference, to_dense_prediction_model)
+from braindecode.training.losses import CroppedLoss
+from braindecode.training.scoring import trial_preds_from_window_preds
+from braindecode.util import (
+    create_mne_dummy_raw, predict_recording, set_random_seeds)
+
+
+def _get_model(in_chans, input_window_samples, dense=True):
+    set_random_seeds(0, cuda=False)
+    model = ShallowFBCSPNet(
+        in_chans, 2, input_window_samples=input_window_samples,
+        n_filters_time=4, n_filters_spat=4, filter_time_length=5,
+        pool_time_length=6, pool_time_stride=3, final_conv_length=4)
+    if dense:
+        to_dense_prediction_model(model)
+    return model.eval()
+
+
+def test_dense_windows_same_trial_preds():
+    in_chans, input_window_samples, trial_samples = 3, 40, 100
+    model = _get_model(in_chans, input_window_samples)
+    X = np.random.RandomState(0).randn(
+        4, in_chans, trial_samples).astype('float32')
+    y = np.array([0, 1, 0, 1])
+    clf = EEGClassifier(
+        model, cropped=True, criterion=CroppedLoss,
+        criterion__loss_function=torch.nn.functional.nll_loss)
+    clf.initialize()
+
+    all_trial_preds = []
+    n_windows = []
+    for window_size_samples in [input_window_samples, 70, trial_samples]:
+        window_params = get_dense_window_params(model, window_size_samples)
+        windows_ds = create_from_X_y(
+            X, y, drop_last_window=False, **window_params)
+        results = clf.predict_with_window_inds_and_ys(windows_ds)
+        all_trial_preds.append(trial_preds_from_window_preds(
+            results['preds'], results['i_window_in_trials'],
+            results['i_window_stops']))
+        n_windows.append(len(windows_ds))
+
+    # whole trials are a single window each
+    assert n_windows[0] > n_windows[1] > n_windows[2] == 4
+    n_preds_per_trial = trial_samples - input_window_samples + get_output_shape(
+        model, in_chans, input_window_samples)[2]
+    for trial_preds in all_trial_preds:
+        assert len(trial_preds) == 4
+        for p, p_small in zip(trial_preds, all_trial_preds[0]):
+            assert p.shape == (2, n_preds_per_trial)
+            np.testing.assert_allclose(p, p_small, rtol=1e-4, atol=1e-5)
+
+
+def test_dense_window_params_needs_dense_model():
+    model = _get_model(3, 40, dense=False)
+    with pytest.raises(ValueError, match='to_dense_prediction_model'):
+        get_dense_window_params(model, 60)
+
+
+def test_predict_recording_chunks_same_as_whole_recording():
+    in_chans, n_times = 3, 500
+    model = _get_model(in_chans, 40)
+    raw, _ = create_mne_dummy_raw(in_chans, n_times, 100, include_anns=False)
+    X = raw.get_data().astype('float32')
+    with torch.no_grad():
+        whole_preds = model(torch.as_tensor(X[None]))[0].numpy()
+    receptive_field = n_times - whole_preds.shape[-1] + 1
+    for recording in [X, raw]:
+        # several chunks, the last one shorter than the others
+        trace = predict_recording(model, recording, chunk_size_samples=70)
+        assert trace.shape == (2, n_times)
+        assert np.all(np.isnan(trace[:, :receptive_field - 1]))
+        np.testing.assert_allclose(
+            trace[:, receptive_field - 1:], whole_preds, rtol=1e-4, atol=1e-5)
+    trace = predict_recording(model, X, chunk_size_samples=10 * n_times)
+    np.testing.assert_allclose(
+        trace[:, receptive_field - 1:], whole_preds, rtol=1e-4, atol=1e-5)
+
+
+def test_predict_recording_needs_dense_model():
+    model = _get_model(3, 40, dense=False)
+    X = np.random.RandomState(0).randn(3, 200).astype('float32')
+    with pytest.raises(ValueError, match='to_dense_prediction_model'):
+        predict_recording(model, X, chunk_size_samples=60)
+
+
+def _get_strided_and_dense_models(in_chans):
+    shallow = ShallowFBCSPNet(in_chans, 2, input_window_samples=200)
+    dense_shallow = ShallowFBCSPNet(
+        in_chans, 2, input_window_samples=200, final_conv_length=30)
+    to_dense_prediction_model(dense_shallow)
+    deep = Deep4Net(
+        in_chans, 2, input_window_samples=600, final_conv_length='auto')
+    dense_deep = Deep4Net(
+        in_chans, 2, input_window_samples=600, final_conv_length=2)
+    to_dense_prediction_model(dense_deep)
+    return [
+        shallow, dense_shallow, deep, dense_deep,
+        EEGNetv4(in_chans, 2, input_window_samples=200),
+        EEGNetv1(in_chans, 2, input_window_samples=200),
+        EEGResNet(in_chans, 2, input_window_samples=600,
+                  final_pool_length=10, n_first_filters=8),
+        HybridNet(in_chans, 2, input_window_samples=600),
+        TCN(in_chans, 2, n_blocks=3, n_filters=5, kernel_size=3,
+            drop_prob=0, add_log_softmax=True)]
+
+
+def test_receptive_field_same_as_forward():
+    in_chans = 4
+    for model in _get_strided_and_dense_models(in_chans):
+        model.eval()
+        for input_window_samples in [700, 1001]:
+            info = get_receptive_field(model, input_window_samples)
+            output_shape = get_output_shape(
+                model, in_chans, input_window_samples)
+            n_preds = output_shape[2] if len(output_shape) > 2 else 1
+            assert info['n_preds_per_input'] == n_preds
+            # every added stride adds a prediction
+            assert get_receptive_field(
+                model, input_window_samples + info['stride'])[
+                'n_preds_per_input'] == n_preds + 1
+        min_input_window_samples = info['min_input_window_samples']
+        get_output_shape(model, in_chans, min_input_window_samples)
+        with pytest.raises((RuntimeError, AssertionError)):
+            get_output_shape(model, in_chans, min_input_window_samples - 1)
+        with pytest.raises(ValueError, match='too short'):
+            get_receptive_field(model, min_input_window_samples - 1)
+
+
+def test_dense_receptive_field():
+    model = _get_model(3, 40)
+    info = get_receptive_field(model, 100)
+    n_preds = get_output_shape(model, 3, 100)[2]
+    assert info['stride'] == 1
+    assert info['receptive_field'] == 100 - n_preds + 1
+    assert info['min_input_window_samples'] == info['receptive_field']
+    assert get_cropped_window_params(model, 100) == dict(
+        window_size_samples=100, window_stride_samples=n_preds)
+    with pytest.raises(ValueError, match='to_dense_prediction_model'):
+        get_cropped_window_params(_get_model(3, 40, dense=False), 100)
+
+
+@pytest.mark.parametrize('pool_mode', ['mean', 'max'])
+def test_dense_preds_same_as_strided_preds(pool_mode):
+    set_random_seeds(0, cuda=False)
+    in_chans, input_window_samples = 4, 1000
+    models = [
+        ShallowFBCSPNet(in_chans, 2, input_window_samples=200,
+                        final_conv_length=10, pool_mode=pool_mode),
+        Deep4Net(in_chans, 2, input_window_samples=600, final_conv_length=2,
+                 first_pool_mode=pool_mode, later_pool_mode=pool_mode)]
+    X = torch.randn(2, in_chans, input_window_samples, 1)
+    for model in models:
+        model.eval()
+        dense_model = copy.deepcopy(model)
+        with warnings.catch_warnings():
+            # no warning if dense predictions equal strided predictions
+            warnings.simplefilter('error')
+            to_dense_prediction_model(dense_model)
+        assert not any(isinstance(m, nn.AvgPool2d)
+                       for m in dense_model.modules())
+        assert any(isinstance(m, AvgPool2dWithConv)
+                   for m in dense_model.modules()) == (pool_mode == 'mean')
+        stride = get_receptive_field(model, input_window_samples)['stride']
+        with torch.no_grad():
+            strided_preds = model(X).numpy()
+            dense_preds = dense_model(X).numpy()
+        np.testing.assert_allclose(
+            dense_preds[:, :, ::stride], strided_preds, rtol=1e-4, atol=1e-5)
+
+
+def test_dense_prediction_model_warns_for_padding_after_stride():
+    model = EEGNetv4(4, 2, input_window_samples=200).eval()
+    with pytest.warns(UserWarning, match='conv_separable_depth pads'):
+        to_dense_prediction_model(model)
+
+
+def test_dense_prediction_model_rejects_ceil_mode():
+    model = nn.Sequential(
+        nn.Conv2d(3, 4, (5, 1)), nn.AvgPool2d((3, 1), ceil_mode=True))
+    with pytest.raises(ValueError, match='ceil mode'):
+        to_dense_prediction_model(model)
+
+
+def test_optimize_for_inference_same_outputs():
+    set_random_seeds(0, cuda=False)
+    in_chans = 4
+    dense_deep = Deep4Net(
+        in_chans, 2, input_window_samples=600, final_conv_length=2)
+    to_dense_prediction_model(dense_deep)
+    models = [
+        ShallowFBCSPNet(in_chans, 2, input_window_samples=600),
+        ShallowFBCSPNet(in_chans, 2, input_window_samples=600,
+                        split_first_layer=False),
+        Deep4Net(in_chans, 2, input_window_samples=600,
+                 final_conv_length='auto'),
+        dense_deep,
+        EEGNetv4(in_chans, 2, input_window_samples=600),
+        EEGResNet(in_chans, 2, input_window_samples=600,
+                  final_pool_length=10, n_first_filters=8),
+        HybridNet(in_chans, 2, input_window_samples=600),
+        TCN(in_chans, 2, n_blocks=2, n_filters=5, kernel_size=3,
+            drop_prob=0, add_log_softmax=True)]
+    X = torch.randn(2, in_chans, 700, 1)
+    for model in models:
+        # running statistics different from the initial ones
+        model.train()
+        with torch.no_grad():
+            model(2 * torch.randn(4, in_chans, 700, 1) + 1)
+        model.eval()
+        optimized_model = copy.deepcopy(model)
+        optimize_for_inference(optimized_model)
+        assert not any(
+            isinstance(m, (nn.BatchNorm1d, nn.BatchNorm2d)) or
+            hasattr(m, 'weight_g') for m in optimized_model.modules())
+        if isinstance(getattr(model, 'conv_spat', None), nn.Conv2d):
+            assert isinstance(optimized_model.conv_spat, nn.Identity)
+            assert optimized_model.conv_time.kernel_size == (
+                model.conv_time.kernel_size[0], in_chans)
+        with torch.no_grad():
+            np.testing.assert_allclose(
+                optimized_model(X).numpy(), model(X).numpy(),
+                rtol=1e-4, atol=1e-5)
@@ -3,16 +3,24 @@
 #
 # License: BSD-3
 
-import numpy as np
+import io
+import pickle
+from copy import deepcopy
 
+import numpy as np
+import pytest
 import torch
 
+from braindecode import EEGClassifier
 from braindecode.models import Deep4Net
 from braindecode.models import EEGNetv4, EEGNetv1
 from braindecode.models import HybridNet
 from braindecode.models import ShallowFBCSPNet
 from braindecode.models import EEGResNet
 from braindecode.models import TCN
+from braindecode.models.modules import (
+    apply_max_norm, register_max_norm_hook, set_max_norm)
+from braindecode.training.callbacks import MaxNormConstraintCallback
 
 
 def test_shallow_fbcsp_net():
@@ -117,3 +125,131 @@ def test_tcn():
     X = torch.Tensor(X.astype(np.float32))
     y_pred = model(X)
     assert y_pred.shape == (n_samples, n_classes)
+
+
+def _fit_with_large_steps(model, callbacks=None):
+    rng = np.random.RandomState(42)
+    X = rng.randn(8, 4, 600, 1).astype(np.float32)
+    y = rng.randint(0, 2, size=8)
+    clf = EEGClassifier(
+        model, criterion=torch.nn.NLLLoss, optimizer=torch.optim.SGD,
+        lr=100, train_split=None, max_epochs=2, batch_size=4,
+        callbacks=callbacks)
+    clf.fit(X, y)
+    return clf
+
+
+def test_eegnet_v4_max_norm_after_optimizer_steps():
+    model = EEGNetv4(4, 2, input_window_samples=600)
+    norms = model.conv_spatial.weight.flatten(start_dim=1).norm(dim=1)
+    assert torch.all(norms <= 1 + 1e-5)
+    _fit_with_large_steps(model)
+    norms = model.conv_spatial.weight.flatten(start_dim=1).norm(dim=1)
+    assert torch.all(norms <= 1 + 1e-5)
+    # not applied in the forward pass
+    with torch.no_grad():
+        model.conv_spatial.weight.mul_(2)
+    weight = model.conv_spatial.weight.detach().clone()
+    model.eval()(torch.ones(1, 4, 600, 1))
+    assert torch.equal(model.conv_spatial.weight, weight)
+
+
+def _train_with_large_steps(model, optimizer):
+    X = torch.randn(8, 4, 600, 1)
+    y = torch.randint(0, 2, size=(8,))
+    for _ in range(2):
+        optimizer.zero_grad()
+        torch.nn.functional.nll_loss(model(X), y).backward()
+        optimizer.step()
+
+
+def test_eegnet_v4_max_norm_in_pytorch_loop():
+    model = EEGNetv4(4, 2, input_window_samples=600)
+    optimizer = torch.optim.SGD(model.parameters(), lr=100)
+    handle = register_max_norm_hook(model, optimizer)
+    _train_with_large_steps(model, optimizer)
+    norms = model.conv_spatial.weight.flatten(start_dim=1).norm(dim=1)
+    assert torch.all(norms <= 1 + 1e-5)
+    # other optimizers do not renormalize the model
+    handle.remove()
+    with torch.no_grad():
+        model.conv_spatial.weight.mul_(10)
+    weight = model.conv_spatial.weight.detach().clone()
+    torch.optim.SGD(model.parameters(), lr=0).step()
+    assert torch.equal(model.conv_spatial.weight, weight)
+
+
+@pytest.mark.parametrize('copy', ['deepcopy', 'pickle', 'torch_save'])
+def test_eegnet_v4_max_norm_of_copies(copy):
+    model = EEGNetv4(4, 2, input_window_samples=600)
+    if copy == 'deepcopy':
+        model = deepcopy(model)
+    elif copy == 'pickle':
+        model = pickle.loads(pickle.dumps(model))
+    else:
+        f = io.BytesIO()
+        torch.save(model, f)
+        f.seek(0)
+        model = torch.load(f, weights_only=False)
+    optimizer = torch.optim.SGD(model.parameters(), lr=100)
+    register_max_norm_hook(model, optimizer)
+    _train_with_large_steps(model, optimizer)
+    norms = model.conv_spatial.weight.flatten(start_dim=1).norm(dim=1)
+    assert torch.all(norms <= 1 + 1e-5)
+
+
+@pytest.mark.parametrize('copy', ['deepcopy', 'pickle'])
+def test_eegnet_v4_max_norm_of_copied_classifier(copy, monkeypatch):
+    # skorch loads the module and optimizer of copies with torch.load
+    monkeypatch.setenv('TORCH_FORCE_NO_WEIGHTS_ONLY_LOAD', '1')
+    clf = _fit_with_large_steps(EEGNetv4(4, 2, input_window_samples=600))
+    if copy == 'deepcopy':
+        clf = deepcopy(clf)
+    else:
+        clf = pickle.loads(pickle.dumps(clf))
+    rng = np.random.RandomState(0)
+    X = rng.randn(8, 4, 600, 1).astype(np.float32)
+    y = rng.randint(0, 2, size=8)
+    clf.partial_fit(X, y)
+    norms = clf.module_.conv_spatial.weight.flatten(start_dim=1).norm(dim=1)
+    assert torch.all(norms <= 1 + 1e-5)
+
+
+def test_eegnet_v4_max_norm_with_copied_module():
+    clf = _fit_with_large_steps(EEGNetv4(4, 2, input_window_samples=600))
+    # like sklearn.clone, which deep-copies the module parameter
+    clf.set_params(module=deepcopy(clf.module_))
+    rng = np.random.RandomState(0)
+    X = rng.randn(8, 4, 600, 1).astype(np.float32)
+    y = rng.randint(0, 2, size=8)
+    clf.partial_fit(X, y)
+    norms = clf.module_.conv_spatial.weight.flatten(start_dim=1).norm(dim=1)
+    assert torch.all(norms <= 1 + 1e-5)
+
+
+def test_apply_max_norm_same_as_renorm():
+    model = torch.nn.Sequential(
+        torch.nn.Conv2d(3, 4, (5, 1)), torch.nn.Linear(7, 6),
+        torch.nn.Linear(7, 6).double())
+    for module, max_norm in zip(model, [0.5, 1, 2]):
+        set_max_norm(module, max_norm)
+        with torch.no_grad():
+            module.weight.mul_(10)
+        module.weight.data[0] = 0
+    expected = [module.weight.detach().clone().renorm_(2, 0, max_norm)
+                for module, max_norm in zip(model, [0.5, 1, 2])]
+    apply_max_norm(model)
+    for module, weight in zip(model, expected):
+        assert module.weight.dtype == weight.dtype
+        torch.testing.assert_close(module.weight.detach(), weight)
+
+
+def test_max_norm_constraint_callback():
+    model = Deep4Net(4, 2, input_window_samples=600, final_conv_length="auto")
+    _fit_with_large_steps(
+        model, callbacks=[("max_norm", MaxNormConstraintCallback())])
+    # the module itself is not constrained
+    assert not hasattr(model.conv_2, "max_norms")
+    for module, max_norm in [(model.conv_2, 2), (model.conv_classifier, 0.5)]:
+        norms = module.weight.flatten(start_dim=1).norm(dim=1)
+        assert torch.all(norms <= max_norm + 1e-5)
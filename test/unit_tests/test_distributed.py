@@ -0,0 +1,255 @@
+# License: BSD-3
+
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+import torch
+import torch.distributed as dist
+from torch import nn
+from torch.utils.data import Sampler, Subset
+
+from braindecode.classifier import EEGClassifier
+from braindecode.datautil.xy import create_from_X_y
+from braindecode.training.distributed import get_distributed_iterator
+from braindecode.training.losses import CroppedLoss
+from braindecode.training.scoring import (
+    RecordingEpochScoring, recording_preds_from_window_preds,
+    trial_preds_from_window_preds)
+from braindecode.util import set_random_seeds
+
+WORLD_SIZE = 2
+
+
+def _get_datasets():
+    rng = np.random.RandomState(0)
+    X = rng.randn(56, 3, 60).astype('float32')
+    y = rng.randint(0, 2, size=56)
+    X[y == 1, 0] += 0.5
+    kwargs = dict(drop_last_window=False, window_size_samples=40,
+                  window_stride_samples=10)
+    return (create_from_X_y(X[:40], y[:40], **kwargs),
+            create_from_X_y(X[40:], y[40:], **kwargs))
+
+
+def _get_model(cropped):
+    if cropped:
+        # predictions for 30 time steps of each window
+        return nn.Conv1d(3, 2, kernel_size=11)
+    return nn.Sequential(nn.Flatten(), nn.Linear(3 * 40, 2))
+
+
+def _get_classifier(cropped, distributed, valid_ds, seed):
+    set_random_seeds(seed, cuda=False)
+    criterion = CroppedLoss if cropped else nn.CrossEntropyLoss
+    kwargs = dict(criterion__loss_function=nn.functional.cross_entropy) if (
+        cropped) else {}
+    callbacks = ['accuracy', ('valid_rec_acc', RecordingEpochScoring(
+        'accuracy', lower_is_better=False, name='valid_rec_acc'))]
+    return EEGClassifier(
+        _get_model(cropped), cropped=cropped, criterion=criterion,
+        optimizer=torch.optim.SGD, lr=0.1,
+        train_split=lambda dataset, y=None: (dataset, valid_ds), batch_size=4,
+        max_epochs=2, callbacks=callbacks,
+        distributed=distributed, **kwargs)
+
+
+def _train_rank(rank, init_file, cropped, tmpdir, queue):
+    torch.set_num_threads(1)
+    dist.init_process_group(
+        'gloo', init_method=f'file://{init_file}', rank=rank,
+        world_size=WORLD_SIZE)
+    train_ds, valid_ds = _get_datasets()
+    # different seeds, parameters are synchronized at the start of training
+    clf = _get_classifier(cropped, True, valid_ds, seed=rank)
+    clf.fit(train_ds, y=None)
+    clf.save_params(f_params=os.path.join(tmpdir, f'params_{rank}.pt'))
+    history = [{k: v for k, v in row.items() if k not in ['batches', 'dur']}
+               for row in clf.history]
+    params = [p.detach().numpy() for p in clf.module_.parameters()]
+    queue.put((rank, history, params, dict(clf.callbacks_)[
+        'print_log'].sink is print))
+    dist.destroy_process_group()
+
+
+@pytest.mark.parametrize('cropped', [False, True])
+def test_distributed_training(tmpdir, cropped):
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    init_file = os.path.join(tmpdir, 'init')
+    processes = [ctx.Process(
+        target=_train_rank, args=(rank, init_file, cropped, str(tmpdir), queue))
+        for rank in range(WORLD_SIZE)]
+    for p in processes:
+        p.start()
+    results = sorted([queue.get(timeout=120) for _ in processes],
+                     key=lambda r: r[0])
+    for p in processes:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+    (_, history_0, params_0, prints_0), (_, history_1, params_1, prints_1) = (
+        results)
+
+    # same model and same history in all processes
+    for p_0, p_1 in zip(params_0, params_1):
+        np.testing.assert_array_equal(p_0, p_1)
+    assert history_0 == history_1
+    assert prints_0 and not prints_1
+    assert os.path.exists(os.path.join(tmpdir, 'params_0.pt'))
+    assert not os.path.exists(os.path.join(tmpdir, 'params_1.pt'))
+
+    # scores are computed on the whole datasets
+    train_ds, valid_ds = _get_datasets()
+    clf = _get_classifier(cropped, False, valid_ds, seed=0)
+    clf.initialize()
+    clf.load_params(f_params=os.path.join(tmpdir, 'params_0.pt'))
+    for name, ds in [('train_accuracy', train_ds),
+                     ('valid_accuracy', valid_ds)]:
+        assert _accuracy(clf, ds, cropped) == pytest.approx(
+            history_0[-1][name])
+    window_preds = clf.forward(valid_ds).detach().numpy()
+    recording_preds = recording_preds_from_window_preds(
+        window_preds, valid_ds.cumulative_sizes)
+    assert np.mean(recording_preds.argmax(axis=1) == np.array(
+        [ds.y[0] for ds in valid_ds.datasets])) == pytest.approx(
+        history_0[-1]['valid_rec_acc'])
+    if not cropped:
+        y = np.concatenate([ds.y for ds in valid_ds.datasets])
+        valid_loss = clf.get_loss(
+            clf.forward(valid_ds), torch.as_tensor(y, dtype=torch.int64))
+        assert valid_loss.item() == pytest.approx(
+            history_0[-1]['valid_loss'], rel=1e-5)
+
+
+def _get_subset_classifier(valid_ds, distributed, **kwargs):
+    set_random_seeds(0, cuda=False)
+    return EEGClassifier(
+        _get_model(cropped=True), cropped=True, criterion=CroppedLoss,
+        criterion__loss_function=nn.functional.cross_entropy,
+        optimizer=torch.optim.SGD, lr=0.1,
+        train_split=lambda dataset, y=None: (dataset, valid_ds), batch_size=4,
+        max_epochs=1, callbacks=['accuracy'], distributed=distributed,
+        **kwargs)
+
+
+def _train_rank_with_subset(rank, init_file, queue):
+    torch.set_num_threads(1)
+    dist.init_process_group(
+        'gloo', init_method=f'file://{init_file}', rank=rank,
+        world_size=WORLD_SIZE)
+    train_ds, valid_ds = _get_datasets()
+    # 45 windows of 15 trials, half of them would end in the middle of the
+    # eighth trial
+    valid_ds = Subset(valid_ds, np.arange(len(valid_ds) - 3))
+    clf = _get_subset_classifier(valid_ds, True)
+    clf.fit(train_ds, y=None)
+    queue.put((rank, clf.history[-1, 'valid_accuracy'],
+               [p.detach().numpy() for p in clf.module_.parameters()]))
+    dist.destroy_process_group()
+
+
+def test_distributed_cropped_scoring_of_subset(tmpdir):
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    init_file = os.path.join(tmpdir, 'init')
+    processes = [ctx.Process(
+        target=_train_rank_with_subset, args=(rank, init_file, queue))
+        for rank in range(WORLD_SIZE)]
+    for p in processes:
+        p.start()
+    results = sorted([queue.get(timeout=120) for _ in processes],
+                     key=lambda r: r[0])
+    for p in processes:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+    (_, accuracy_0, params_0), (_, accuracy_1, _) = results
+    assert accuracy_0 == accuracy_1
+
+    # trials are scored as a whole, as without distributed training
+    train_ds, valid_ds = _get_datasets()
+    valid_ds = Subset(valid_ds, np.arange(len(valid_ds) - 3))
+    clf = _get_subset_classifier(valid_ds, False)
+    clf.initialize()
+    for param, param_0 in zip(clf.module_.parameters(), params_0):
+        param.data[:] = torch.as_tensor(param_0)
+    assert _accuracy(clf, valid_ds, cropped=True) == pytest.approx(
+        accuracy_0)
+
+
+class _PermutationSampler(Sampler):
+    def __init__(self, n_inds, seed):
+        self.n_inds = n_inds
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        return iter(rng.permutation(self.n_inds).tolist())
+
+    def __len__(self):
+        return self.n_inds
+
+
+def _train_rank_with_sampler(rank, init_file, queue):
+    torch.set_num_threads(1)
+    dist.init_process_group(
+        'gloo', init_method=f'file://{init_file}', rank=rank,
+        world_size=WORLD_SIZE)
+    train_ds, valid_ds = _get_datasets()
+    # different orders in every rank, only the one of rank 0 is used, and
+    # an odd number of windows that has to be padded
+    sampler = _PermutationSampler(len(train_ds) - 1, seed=rank)
+    clf = _get_subset_classifier(
+        valid_ds, True, iterator_train__sampler=sampler)
+    clf.fit(train_ds, y=None)
+    shard = list(get_distributed_iterator(clf, train_ds, training=True).sampler)
+    clf.set_params(iterator_valid__sampler=sampler)
+    with pytest.raises(ValueError, match='sampler for evaluation'):
+        get_distributed_iterator(clf, valid_ds, training=False)
+    queue.put((rank, shard, sampler.epoch,
+               [p.detach().numpy() for p in clf.module_.parameters()]))
+    dist.destroy_process_group()
+
+
+def test_distributed_training_with_sampler(tmpdir):
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    init_file = os.path.join(tmpdir, 'init')
+    processes = [ctx.Process(
+        target=_train_rank_with_sampler, args=(rank, init_file, queue))
+        for rank in range(WORLD_SIZE)]
+    for p in processes:
+        p.start()
+    results = sorted([queue.get(timeout=120) for _ in processes],
+                     key=lambda r: r[0])
+    for p in processes:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+    (_, shard_0, epoch_0, params_0), (_, shard_1, epoch_1, params_1) = results
+    for p_0, p_1 in zip(params_0, params_1):
+        np.testing.assert_array_equal(p_0, p_1)
+
+    # the order drawn in rank 0 is split between the ranks
+    assert epoch_0 == epoch_1 == 1
+    order = _PermutationSampler(119, seed=0)
+    order.set_epoch(1)
+    order = list(order)
+    assert shard_0 == order[0::2]
+    assert shard_1 == order[1::2] + order[:1]
+
+
+def _accuracy(clf, ds, cropped):
+    if not cropped:
+        y = np.concatenate([d.y for d in ds.datasets])
+        return np.mean(clf.predict(ds) == y)
+    results = clf.predict_with_window_inds_and_ys(ds)
+    trial_preds = trial_preds_from_window_preds(
+        results['preds'], results['i_window_in_trials'],
+        results['i_window_stops'])
+    trial_ys = results['window_ys'][results['i_window_in_trials'] == 0]
+    return np.mean(
+        np.array([p.mean(axis=1).argmax() for p in trial_preds]) == trial_ys)
@@ -6,6 +6,7 @@
 
 
 import numpy as np
+import pytest
 import sklearn.datasets
 import torch
 from sklearn.metrics import f1_score, accuracy_score
@@ -13,7 +14,7 @@ from skorch import History
 from skorch.callbacks import Callback
 from skorch.utils import to_numpy, to_tensor
 from torch import optim
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Subset
 from braindecode.classifier import EEGClassifier
 from braindecode.datautil.xy import create_from_X_y
 from braindecode.training.scoring import CroppedTrialEpochScoring
@@ -21,6 +22,10 @@ from braindecode.training.scoring import PostEpochTrainScoring
 from braindecode.models import ShallowFBCSPNet
 from braindecode.util import set_random_seeds
 from braindecode.training.scoring import trial_preds_from_window_preds
+from braindecode.training.scoring import trial_mean_preds_from_window_preds
+from braindecode.training.scoring import _TrialPredsAccumulator
+from braindecode.training.scoring import RecordingEpochScoring
+from braindecode.training.scoring import recording_preds_from_window_preds
 
 
 class MockSkorchNet:
@@ -279,3 +284,259 @@ def test_three_windows_two_trials_no_overlap():
     window_inds = ((0, 0, 8), (1, 4, 12), (0, 0, 6,))
     expected_trial_preds = [[[4, 5, 6, 7, 6, 7, 8, 9]], [[0, 1, 2, 3]]]
     _check_preds_windows_trials(preds, window_inds, expected_trial_preds)
+
+
+def test_predict_with_window_inds_and_ys():
+    set_random_seeds(0, cuda=False)
+    X = np.random.randn(6, 3, 50).astype('float32')
+    y = np.random.randint(0, 2, size=6)
+    windows_ds = create_from_X_y(
+        X, y, drop_last_window=False, window_size_samples=20,
+        window_stride_samples=15)
+    clf = EEGClassifier(
+        torch.nn.Conv1d(3, 2, kernel_size=5), cropped=True,
+        criterion=torch.nn.CrossEntropyLoss, batch_size=4)
+    clf.initialize()
+
+    results = clf.predict_with_window_inds_and_ys(windows_ds)
+    inds = np.array([windows_ds[i][2] for i in range(len(windows_ds))])
+    np.testing.assert_allclose(
+        results['preds'], clf.predict_proba(windows_ds), rtol=1e-6)
+    assert results['preds'].dtype == np.float32
+    np.testing.assert_array_equal(results['i_window_in_trials'], inds[:, 0])
+    np.testing.assert_array_equal(results['i_window_stops'], inds[:, 2])
+    np.testing.assert_array_equal(
+        results['window_ys'], [windows_ds[i][1] for i in range(len(inds))])
+
+    results_16 = clf.predict_with_window_inds_and_ys(
+        windows_ds, dtype='float16')
+    assert results_16['preds'].dtype == np.float16
+    np.testing.assert_allclose(
+        results_16['preds'], results['preds'], rtol=1e-3, atol=1e-3)
+
+    # no windows, as the only batch is dropped or the dataset is empty
+    clf.set_params(batch_size=len(windows_ds) + 1,
+                   iterator_valid__drop_last=True)
+    results_empty = clf.predict_with_window_inds_and_ys(windows_ds)
+    assert results_empty['preds'].shape == (0,) + results['preds'].shape[1:]
+    assert results_empty['preds'].dtype == np.float32
+    assert results_empty['window_ys'].shape == (0,)
+    assert results_empty['window_ys'].dtype == results['window_ys'].dtype
+    for key in ['i_window_in_trials', 'i_window_stops']:
+        assert results_empty[key].shape == (0,)
+    results_empty = clf.predict_with_window_inds_and_ys(
+        Subset(windows_ds, []))
+    assert all(len(a) == 0 for a in results_empty.values())
+
+
+def _trial_preds_from_window_preds_loop(
+        preds, i_window_in_trials, i_stop_in_trials):
+    # reference implementation, looping through the windows
+    preds_per_trial = []
+    cur_trial_preds = []
+    i_last_stop = None
+    i_last_window = -1
+    for window_preds, i_window, i_stop in zip(
+            preds, i_window_in_trials, i_stop_in_trials):
+        window_preds = np.array(window_preds)
+        if i_window != (i_last_window + 1):
+            preds_per_trial.append(np.concatenate(cur_trial_preds, axis=1))
+            cur_trial_preds = []
+            i_last_stop = None
+        if i_last_stop is not None:
+            n_needed_preds = i_stop - i_last_stop
+            window_preds = window_preds[:, -n_needed_preds:]
+        cur_trial_preds.append(window_preds)
+        i_last_window = i_window
+        i_last_stop = i_stop
+    preds_per_trial.append(np.concatenate(cur_trial_preds, axis=1))
+    return preds_per_trial
+
+
+@pytest.mark.parametrize('window_stride', [3, 10, 14])
+def test_trial_preds_same_as_loop(window_stride):
+    rng = np.random.RandomState(0)
+    n_preds_per_window, n_samples_per_window = 10, 20
+    i_window_in_trials, i_stops = [], []
+    for trial_len in rng.randint(20, 60, size=15):
+        stops = list(range(
+            n_samples_per_window, trial_len + 1, window_stride))
+        if stops[-1] != trial_len:
+            # last window aligned to the end of the trial
+            stops.append(trial_len)
+        i_window_in_trials.extend(range(len(stops)))
+        i_stops.extend(stops)
+    preds = rng.randn(len(i_stops), 4, n_preds_per_window).astype('float32')
+
+    expected = _trial_preds_from_window_preds_loop(
+        preds, i_window_in_trials, i_stops)
+    trial_preds = trial_preds_from_window_preds(
+        preds, i_window_in_trials, i_stops)
+    assert len(trial_preds) == len(expected) == 15
+    for p, p_expected in zip(trial_preds, expected):
+        np.testing.assert_array_equal(p, p_expected)
+    # lists of window predictions are stacked
+    for p, p_expected in zip(trial_preds_from_window_preds(
+            list(preds), i_window_in_trials, i_stops), expected):
+        np.testing.assert_array_equal(p, p_expected)
+    # window predictions of different lengths, e.g. of whole trials
+    ragged_preds = [p[:, rng.randint(0, 4):] for p in preds]
+    expected_ragged = _trial_preds_from_window_preds_loop(
+        ragged_preds, i_window_in_trials, i_stops)
+    for p, p_expected in zip(trial_preds_from_window_preds(
+            ragged_preds, i_window_in_trials, i_stops), expected_ragged):
+        np.testing.assert_array_equal(p, p_expected)
+    whole_trial_preds = trial_preds_from_window_preds(
+        [np.ones((2, 5)), np.ones((2, 7))], [0, 0], [10, 12])
+    assert [p.shape for p in whole_trial_preds] == [(2, 5), (2, 7)]
+
+    mean_preds = trial_mean_preds_from_window_preds(
+        preds, i_window_in_trials, i_stops)
+    assert mean_preds.dtype == np.float32
+    np.testing.assert_allclose(
+        mean_preds, [p.mean(axis=1) for p in expected], rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(
+        trial_mean_preds_from_window_preds(
+            preds.astype('float16'), i_window_in_trials, i_stops),
+        mean_preds, rtol=1e-2, atol=1e-2)
+
+
+def test_trial_mean_preds_accumulated_in_batches():
+    rng = np.random.RandomState(1)
+    i_window_in_trials = [0, 1, 2, 0, 1, 0, 0, 1, 2, 3]
+    i_stops = [20, 25, 30, 20, 32, 20, 20, 26, 32, 38]
+    preds = rng.randn(10, 3, 8)
+    ys = np.array([1, 1, 1, 0, 0, 1, 0, 0, 0, 0])
+    expected = trial_mean_preds_from_window_preds(
+        preds, i_window_in_trials, i_stops)
+
+    for batch_size in [1, 2, 3, 4]:
+        accumulator = _TrialPredsAccumulator()
+        for i_start in range(0, 10, batch_size):
+            batch = slice(i_start, i_start + batch_size)
+            accumulator.add(preds[batch], i_window_in_trials[batch],
+                            i_stops[batch], ys[batch])
+        np.testing.assert_allclose(accumulator.get_mean_preds(), expected)
+        np.testing.assert_array_equal(accumulator.get_ys(), [1, 0, 1, 0])
+
+
+def test_post_epoch_train_scoring_subset_every_n_epochs():
+    set_random_seeds(0, cuda=False)
+    X = np.random.randn(30, 3, 20).astype('float32')
+    y = np.random.randint(0, 2, size=30)
+    train_set = create_from_X_y(X, y, drop_last_window=False)
+    subset_scorings = []
+
+    class TestCallback(Callback):
+        def on_epoch_end(self, net, *args, **kwargs):
+            cb = dict(net.callbacks_)['train_acc_subset']
+            if len(net.history) % 2 == 0:
+                inds = cb.subset_inds_
+                X_subset = np.stack([train_set[i][0] for i in inds])
+                preds = net.predict(X_subset)
+                np.testing.assert_allclose(
+                    net.history[-1, 'train_acc_subset'],
+                    accuracy_score(y[inds], preds))
+                assert net.history[-1, 'train_acc_subset_n_samples'] == 10
+                subset_scorings.append(inds.copy())
+                # other seed, other subset
+                other_inds = dict(net.callbacks_)[
+                    'train_acc_other_subset'].subset_inds_
+                assert not np.array_equal(inds, other_inds)
+                assert net.history[-1, 'train_acc_subset_subset_hash'] != (
+                    net.history[-1, 'train_acc_other_subset_subset_hash'])
+            else:
+                assert 'train_acc_subset' not in net.history[-1]
+            assert 'train_acc' in net.history[-1]
+
+    clf = EEGClassifier(
+        torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(60, 2)),
+        criterion=torch.nn.CrossEntropyLoss,
+        train_split=None,
+        batch_size=8,
+        callbacks=[
+            ("train_acc", PostEpochTrainScoring(
+                "accuracy", lower_is_better=False, name="train_acc")),
+            ("train_acc_subset", PostEpochTrainScoring(
+                "accuracy", lower_is_better=False, name="train_acc_subset",
+                subset_size=1 / 3, every_n_epochs=2, random_state=0)),
+            ("train_acc_other_subset", PostEpochTrainScoring(
+                "accuracy", lower_is_better=False,
+                name="train_acc_other_subset", subset_size=1 / 3,
+                every_n_epochs=2, random_state=1)),
+            ("test_callback", TestCallback()),
+        ],
+    )
+    clf.fit(train_set, y=None, epochs=4)
+
+    # same subset in every scored epoch
+    assert len(subset_scorings) == 2
+    assert len(np.unique(subset_scorings[0])) == 10
+    np.testing.assert_array_equal(subset_scorings[0], subset_scorings[1])
+    assert clf.history[1, 'train_acc_subset_subset_hash'] == (
+        clf.history[3, 'train_acc_subset_subset_hash'])
+    assert 'train_acc_subset_hash' not in clf.history[-1]
+
+
+@pytest.mark.parametrize('aggregation', ['mean', 'median', 'vote'])
+def test_recording_preds_from_window_preds(aggregation):
+    rng = np.random.RandomState(0)
+    n_windows = np.array([3, 0, 1, 4, 2])
+    preds = rng.rand(n_windows.sum(), 3)
+    recording_preds = recording_preds_from_window_preds(
+        preds, np.cumsum(n_windows), aggregation=aggregation)
+    assert recording_preds.shape == (5, 3)
+    assert np.all(np.isnan(recording_preds[1]))
+    for i_rec, rec_preds in enumerate(
+            np.split(preds, np.cumsum(n_windows)[:-1])):
+        if len(rec_preds) == 0:
+            continue
+        if aggregation == 'mean':
+            expected = rec_preds.mean(axis=0)
+        elif aggregation == 'median':
+            expected = np.median(rec_preds, axis=0)
+        else:
+            expected = np.bincount(
+                rec_preds.argmax(axis=1), minlength=3) / len(rec_preds)
+        np.testing.assert_allclose(recording_preds[i_rec], expected)
+
+    # time axis of cropped predictions is averaged per window
+    np.testing.assert_allclose(
+        recording_preds_from_window_preds(
+            np.repeat(preds[:, :, None], 4, axis=2), np.cumsum(n_windows),
+            aggregation=aggregation),
+        recording_preds)
+
+
+def test_recording_epoch_scoring():
+    set_random_seeds(0, cuda=False)
+    X = np.random.randn(20, 3, 50).astype('float32')
+    y = np.random.randint(0, 2, size=20)
+    X[y == 1] += 0.3
+    kwargs = dict(drop_last_window=False, window_size_samples=20,
+                  window_stride_samples=10)
+    train_set = create_from_X_y(X[:14], y[:14], **kwargs)
+    valid_set = create_from_X_y(X[14:], y[14:], **kwargs)
+    clf = EEGClassifier(
+        torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(60, 2)),
+        criterion=torch.nn.CrossEntropyLoss,
+        train_split=lambda dataset, y=None: (dataset, valid_set),
+        batch_size=8,
+        callbacks=[
+            ('valid_rec_acc', RecordingEpochScoring(
+                'accuracy', lower_is_better=False, name='valid_rec_acc')),
+            ('train_rec_acc', RecordingEpochScoring(
+                'accuracy', lower_is_better=False, on_train=True,
+                name='train_rec_acc', aggregation='vote')),
+        ],
+    )
+    clf.fit(train_set, y=None, epochs=2)
+
+    for name, ds, aggregation, ys in [
+            ('valid_rec_acc', valid_set, 'mean', y[14:]),
+            ('train_rec_acc', train_set, 'vote', y[:14])]:
+        window_preds = clf.forward(ds).detach().numpy()
+        rec_preds = recording_preds_from_window_preds(
+            window_preds, ds.cumulative_sizes, aggregation)
+        np.testing.assert_allclose(
+            clf.history[-1, name], np.mean(rec_preds.argmax(axis=1) == ys))
@@ -3,12 +3,16 @@
 # License: BSD-3
 
 import os
+import threading
 
 import mne
 import numpy as np
 import h5py
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
 
-from braindecode.util import create_mne_dummy_raw
+from braindecode.util import create_mne_dummy_raw, ThrowAwayIndexLoader
 
 
 def test_create_mne_dummy_raw(tmp_path):
@@ -28,3 +32,55 @@ def test_create_mne_dummy_raw(tmp_path):
     raw = mne.io.read_raw_fif(fnames['fif'], preload=False, verbose=None)
     with h5py.File(fnames['hdf5'], 'r') as hf:
         _ = np.array(hf['fake_raw'])
+
+
+class _Net(object):
+    pass
+
+
+def _get_loader(n_batches=5):
+    X = torch.arange(n_batches * 4 * 3, dtype=torch.float64).reshape(-1, 3)
+    y = torch.arange(n_batches * 4, dtype=torch.int32)
+    inds = torch.arange(n_batches * 4)
+    return DataLoader(TensorDataset(X, y, inds), batch_size=4)
+
+
+@pytest.mark.parametrize('n_prefetch', [0, 2])
+def test_throw_away_index_loader(n_prefetch):
+    net = _Net()
+    loader = ThrowAwayIndexLoader(
+        net, _get_loader(), is_regression=False, n_prefetch=n_prefetch,
+        device='cpu')
+    assert len(loader) == 5
+    for i_batch, (X, y) in enumerate(loader):
+        assert X.dtype == torch.float32
+        assert y.dtype == torch.int64
+        np.testing.assert_array_equal(
+            net._last_window_inds, np.arange(i_batch * 4, i_batch * 4 + 4))
+        np.testing.assert_array_equal(y, net._last_window_inds)
+        assert hasattr(net, '_last_data_wait') == (n_prefetch > 0)
+    assert i_batch == 4
+
+
+def test_throw_away_index_loader_prefetch_stops():
+    n_threads = threading.active_count()
+    loader = ThrowAwayIndexLoader(
+        _Net(), _get_loader(n_batches=50), is_regression=True, n_prefetch=2)
+    for X, y in loader:
+        assert y.dtype == torch.float32
+        break
+    # the prefetching thread is stopped once the iteration is closed
+    assert threading.active_count() == n_threads
+
+    class _BrokenDataset(TensorDataset):
+        def __getitem__(self, index):
+            if index == 6:
+                raise RuntimeError('broken window')
+            return super().__getitem__(index)
+
+    loader = ThrowAwayIndexLoader(
+        _Net(), DataLoader(_BrokenDataset(torch.zeros(8, 3), torch.zeros(8)),
+                           batch_size=4),
+        is_regression=True, n_prefetch=2)
+    with pytest.raises(RuntimeError, match='broken window'):
+        list(loader)